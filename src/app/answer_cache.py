@@ -0,0 +1,182 @@
+import asyncio
+import os
+import sys
+import threading
+from typing import AsyncIterator, Callable, Hashable, Iterator, List, NamedTuple, Optional, Tuple
+
+try:
+    from src.utils.cache import TTLCache
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+    from src.utils.cache import TTLCache
+
+
+class CachedAnswer(NamedTuple):
+    chunks: Tuple[str, ...]
+    documents: tuple # 生成时检索到的文档 (回答依据的上下文)，与回答一起缓存
+
+
+class Flight:
+    """
+    一次正在进行的回答生成 (single-flight)。
+    生成方把 Token 依次 publish 进来，任意多个订阅者 (同步线程或异步协程) 从头读取同一份 Token 流，
+    后加入的订阅者先补齐已生成的部分，再跟上实时输出。
+    """
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.documents: list = [] # 生成方在结束前写入本次检索到的文档
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self._cancel: Optional[Callable[[], None]] = None
+        self._cond = threading.Condition()
+        self._async_waiters = set()
+
+    def set_canceller(self, cancel: Callable[[], None]):
+        self._cancel = cancel
+
+    def cancel(self):
+        if self._cancel is not None and not self.done:
+            self._cancel()
+
+    def _notify(self):
+        self._cond.notify_all()
+        for loop, event in list(self._async_waiters):
+            loop.call_soon_threadsafe(event.set)
+
+    def publish(self, chunk: str):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._notify()
+
+    def finish(self, error: Optional[BaseException] = None):
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._notify()
+
+    def _read(self, start: int) -> Tuple[List[str], bool, Optional[BaseException]]:
+        with self._cond:
+            return self.chunks[start:], self.done, self.error
+
+    def iter_sync(self) -> Iterator[str]:
+        position = 0
+        while True:
+            with self._cond:
+                while len(self.chunks) <= position and not self.done:
+                    self._cond.wait()
+            new, done, error = self._read(position)
+            yield from new
+            position += len(new)
+            if done and position >= len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+    async def iter_async(self) -> AsyncIterator[str]:
+        event = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), event)
+        with self._cond:
+            self._async_waiters.add(waiter)
+        try:
+            position = 0
+            while True:
+                # 先清空事件再读取：读取之后的 publish 一定会重新置位事件，不会漏掉唤醒
+                event.clear()
+                new, done, error = self._read(position)
+                for chunk in new:
+                    yield chunk
+                position += len(new)
+                if done and not new:
+                    if error is not None:
+                        raise error
+                    return
+                if not new:
+                    await event.wait()
+        finally:
+            with self._cond:
+                self._async_waiters.discard(waiter)
+
+
+class AnswerCache:
+    """
+    回答缓存 + 相同问题的请求合并：
+    - 已完成的回答按 Key (规范化问题, 索引版本, 模型 / Prompt 版本) 缓存 Token 序列和当时检索到的文档 (LRU + TTL)，
+      命中时按原来的分块重放成流，前端表现与实时生成一致；
+    - 同一个 Key 同时只有一次生成在进行，并发的相同问题订阅同一个 Flight，收到完全相同的 Token 流；
+    - 所有订阅者都离开 (客户端断开) 且生成尚未结束时取消生成，不再为无人接收的回答付费。
+    只缓存正常结束的回答，出错或被取消的生成不缓存。
+    另外按 (规范化问题, 模型 / Prompt 版本) 保留每个问题最近一次的回答 (不区分索引版本)，
+    系统满载时可以用它兜底 (可能基于旧索引)，而不是直接拒绝。
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: Optional[float] = 3600):
+        """
+        :param maxsize: 最多缓存的回答数 (0 表示只合并并发请求，不缓存)
+        :param ttl: 回答的过期时间 (秒)
+        """
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.stale = TTLCache(maxsize=maxsize, ttl=None)
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def get(self, key: Hashable) -> Optional[CachedAnswer]:
+        return self.cache.get(key)
+
+    @staticmethod
+    def _stale_key(key: Tuple) -> Tuple:
+        # Key = (规范化问题, 索引版本, 模型 / Prompt 版本)，去掉索引版本
+        return key[0], key[2]
+
+    def get_stale(self, key: Tuple) -> Optional[CachedAnswer]:
+        return self.stale.get(self._stale_key(key))
+
+    def join(self, key: Hashable, admit: Optional[Callable[[], bool]] = None) -> Tuple[Optional[Flight], bool]:
+        """
+        订阅 Key 对应的进行中生成，不存在时创建。
+        :param admit: 需要新建生成时先调用，返回 False (例如系统满载) 时不新建
+        :return: (Flight, 是否新建)。新建时调用方负责启动生成 (并在结束时调用 settle)；
+                 没有进行中的生成且 admit 拒绝时返回 (None, False)
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            created = flight is None
+            if created:
+                if admit is not None and not admit():
+                    return None, False
+                flight = self._flights[key] = Flight()
+            else:
+                self.coalesced += 1
+            flight.subscribers += 1
+            return flight, created
+
+    def leave(self, flight: Flight):
+        """
+        订阅者离开。最后一个订阅者在生成结束前离开时取消生成。
+        """
+        with self._lock:
+            flight.subscribers -= 1
+            abandoned = flight.subscribers <= 0 and not flight.done
+        if abandoned:
+            flight.cancel()
+
+    def settle(self, key: Hashable, flight: Flight, ok: bool):
+        """
+        生成结束 (由生成方调用)：移除进行中的 Flight，正常结束时写入缓存。
+        """
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        if ok:
+            answer = CachedAnswer(tuple(flight.chunks), tuple(flight.documents))
+            self.cache.set(key, answer)
+            self.stale.set(self._stale_key(key), answer)
+
+    def clear(self):
+        # 兜底用的旧回答保留 (索引切换后正好用于满载时兜底)
+        self.cache.clear()
+
+    def stats(self) -> dict:
+        return {**self.cache.stats(), "in_flight": len(self._flights), "coalesced": self.coalesced}
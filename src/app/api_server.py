@@ -0,0 +1,321 @@
+# 文件路径: src/app/api_server.py
+
+import argparse
+import asyncio
+import fcntl
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import List, Literal, Optional
+
+# 确保能找到其他模块 (适配相对导入问题)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from langchain_core.documents import Document
+from pydantic import BaseModel, Field
+
+from src.app.engine import get_engine, reload_engine
+from src.ingestion.pipeline import IngestionPipeline
+from src.ingestion.sync import IndexSyncer
+from src.utils.deadline import DeadlineExceeded, ServerBusy
+from src.utils.metrics import REGISTRY
+
+
+# ==========================================
+# 后台入库任务
+# ==========================================
+class IngestJobs:
+    """
+    后台入库任务 (全量重建 / 增量同步)。
+    任务状态写在 <jobs_dir>/<任务号>.json，多个 worker 进程都能查询同一个任务；
+    同一时间只允许一个入库任务 (跨进程文件锁 <jobs_dir>/ingest.lock)，执行任务的进程退出时锁自动释放。
+    """
+
+    LOCK_FILE = "ingest.lock"
+
+    def __init__(self, jobs_dir: Optional[str] = None):
+        """
+        :param jobs_dir: 任务状态目录，默认读取环境变量 INGEST_JOBS_DIR (未设置时为 ./data/jobs)。
+                         不能放在向量库目录下 (全量重建会清空该目录)
+        """
+        self.jobs_dir = jobs_dir or os.getenv("INGEST_JOBS_DIR", "./data/jobs")
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def _write(self, job: dict):
+        path = self._path(job["id"])
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(job, f, ensure_ascii=False, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def start(self, doc_path: str, mode: str) -> Optional[dict]:
+        """
+        启动一个后台入库任务。
+        :return: 任务信息；已有任务在执行 (本进程或其他 worker) 时返回 None
+        """
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        lock = open(os.path.join(self.jobs_dir, self.LOCK_FILE), "a")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return None
+        job = {"id": uuid.uuid4().hex[:12], "mode": mode, "doc_path": doc_path, "status": "running",
+               "pid": os.getpid(), "created": time.time(), "finished": None,
+               "progress": None, "message": "📂 正在扫描文档...", "result": None, "error": None}
+        self._write(job)
+        threading.Thread(target=self._run, args=(job, lock), name=f"ingest-{job['id']}", daemon=True).start()
+        return job
+
+    def _run(self, job: dict, lock):
+        try:
+            if job["mode"] == "full":
+                for progress in IngestionPipeline(job["doc_path"]).run(force_rebuild=True):
+                    job.update(progress=progress, message=IngestionPipeline.format_progress(progress))
+                    self._write(job)
+            else:
+                job["message"] = "🔍 正在对比文件清单，查找变化的文档..."
+                self._write(job)
+                result = IndexSyncer(job["doc_path"]).sync()
+                job.update(result=result, message=(
+                    f"✅ 增量更新完成。变化文件 {result['changed_files']} 个，删除文件 {result['removed_files']} 个；"
+                    f"写入 {result['upserted_chunks']} 个片段，移除 {result['deleted_chunks']} 个片段。"))
+            # 本进程立即切换到新索引，其他 worker 在下一个请求时发现版本变化后重新加载
+            # (增量同步没有任何改动时索引版本不变，不会重新加载)
+            reload_engine(if_stale=job["mode"] != "full")
+            job["status"] = "succeeded"
+        except Exception as e:
+            print(f"❌ [API] 入库任务 {job['id']} 失败: {e}")
+            job.update(status="failed", error=str(e), message=f"❌ 错误: {e}")
+        finally:
+            job["finished"] = time.time()
+            self._write(job)
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            lock.close()
+
+    def get(self, job_id: str) -> Optional[dict]:
+        if not re.fullmatch(r"[0-9a-f]{12}", job_id):
+            return None
+        try:
+            with open(self._path(job_id), "r", encoding="utf-8") as f:
+                job = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if job["status"] == "running" and not _pid_alive(job["pid"]):
+            # 执行任务的 worker 已退出 (全量重建的新版本目录不会被激活，当前索引不受影响)
+            job.update(status="failed", error="执行任务的进程已退出")
+        return job
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# ==========================================
+# 请求 / 响应
+# ==========================================
+class QueryRequest(BaseModel):
+    question: str = Field(..., min_length=1)
+    stream: bool = True
+
+
+class RetrieveRequest(BaseModel):
+    question: str = Field(..., min_length=1)
+    top_k: Optional[int] = Field(None, ge=1)
+
+
+class IngestRequest(BaseModel):
+    doc_path: str = "./data/raw"
+    mode: Literal["incremental", "full"] = "incremental"
+
+
+def _doc_root() -> str:
+    # 只允许入库该目录下的文档，避免通过 API 读取服务器上的任意路径
+    return os.path.realpath(os.getenv("INGEST_DOC_ROOT", "./data"))
+
+
+def _jsonable(value):
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    try:
+        # numpy 标量 (例如 relevance_score)
+        return float(value)
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def _serialize_docs(docs: List[Document]) -> List[dict]:
+    return [{"content": doc.page_content, "metadata": {key: _jsonable(value) for key, value in doc.metadata.items()}}
+            for doc in docs]
+
+
+def _sse(event: str, data) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+def _busy_response(e: Exception) -> JSONResponse:
+    return JSONResponse({"error": str(e), "code": "busy"}, status_code=503, headers={"Retry-After": "1"})
+
+
+async def _engine():
+    """
+    取进程内的常驻引擎 (首次调用时在线程中构建)，索引被其他 worker 更新过时先重新加载。
+    """
+    try:
+        engine = await asyncio.to_thread(get_engine)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    await asyncio.to_thread(engine.reload_if_stale)
+    return engine
+
+
+# ==========================================
+# 应用
+# ==========================================
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 每个 worker 启动时预先构建常驻引擎；索引尚未构建时只打印警告，入库完成后首个请求会自动加载
+    try:
+        await asyncio.to_thread(get_engine, "LangChain 是什么？")
+    except Exception as e:
+        print(f"⚠️ [API] 引擎预加载失败: {e}")
+    yield
+
+
+app = FastAPI(title="RAG Demo API", lifespan=lifespan)
+jobs = IngestJobs()
+
+
+@app.get("/health")
+async def health():
+    """
+    存活 / 就绪检查：引擎可用时返回 200 和当前索引版本、在途请求数，否则返回 503。
+    """
+    try:
+        engine = await asyncio.to_thread(get_engine)
+    except Exception as e:
+        return JSONResponse({"status": "unavailable", "error": str(e), "pid": os.getpid()}, status_code=503)
+    admission = engine.admission.stats()
+    return {"status": "busy" if engine.admission.saturated() else "ok", "pid": os.getpid(),
+            "index_version": engine.search_engine.db_manager.index_version, **admission}
+
+
+@app.post("/retrieve")
+async def retrieve(body: RetrieveRequest):
+    """
+    只检索不生成：返回 Rerank 后的文档 (内容 + 元数据)。
+    """
+    engine = await _engine()
+    docs = await engine.aretrieve(body.question)
+    if body.top_k is not None:
+        docs = docs[:body.top_k]
+    return {"question": body.question, "documents": _serialize_docs(docs)}
+
+
+@app.post("/query")
+async def query(body: QueryRequest):
+    """
+    问答。stream=true (默认) 时返回 SSE 流：若干 token 事件 {"text"}，之后一个 sources 事件 (引用的文档)，
+    最后一个 done 事件；生成中途出错时发送 error 事件。首个 Token 之前失败时直接返回 HTTP 错误：
+    系统繁忙 503 (带 Retry-After)、超出延迟预算 504。
+    stream=false 时等待生成完成后一次性返回 {"answer", "sources"}。
+    """
+    engine = await _engine()
+    # 引用的文档取自生成时实际检索到的结果 (与 LLM 看到的上下文一致)，不再单独检索一次
+    sources: List[Document] = []
+    chunks = engine.astream(body.question, sources=sources)
+    # 先取首个 Token：准入被拒 / 超时可以用状态码表达，而不是在 200 的流里报错
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = ""
+    except ServerBusy as e:
+        return _busy_response(e)
+    except DeadlineExceeded as e:
+        return JSONResponse({"error": str(e), "code": "deadline"}, status_code=504)
+
+    if not body.stream:
+        answer = [first]
+        async for chunk in chunks:
+            answer.append(chunk)
+        return {"question": body.question, "answer": "".join(answer), "sources": _serialize_docs(sources)}
+
+    async def events():
+        try:
+            if first:
+                yield _sse("token", {"text": first})
+            # 客户端断开时 Starlette 取消这个生成器，引擎随之退订 (最后一个订阅者离开时中止生成)
+            async for chunk in chunks:
+                yield _sse("token", {"text": chunk})
+            yield _sse("sources", _serialize_docs(sources))
+            yield _sse("done", {})
+        except Exception as e:
+            code = "deadline" if isinstance(e, DeadlineExceeded) else "error"
+            yield _sse("error", {"error": str(e), "code": code})
+        finally:
+            await chunks.aclose()
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.post("/ingest", status_code=202)
+async def ingest(body: IngestRequest):
+    """
+    启动后台入库任务 (incremental: 增量同步，full: 全量重建到新版本后原子切换)，立即返回任务号，
+    用 GET /ingest/{job_id} 查询进度。已有任务在执行时返回 409。
+    """
+    doc_path = os.path.realpath(body.doc_path)
+    root = _doc_root()
+    if os.path.commonpath([doc_path, root]) != root:
+        raise HTTPException(status_code=403, detail=f"只允许入库 {root} 下的文档")
+    if not os.path.exists(doc_path):
+        raise HTTPException(status_code=404, detail="路径不存在，请检查输入。")
+    job = jobs.start(doc_path, body.mode)
+    if job is None:
+        raise HTTPException(status_code=409, detail="已有入库任务在执行，请稍后再试。")
+    return {"job_id": job["id"], "status": job["status"], "status_url": f"/ingest/{job['id']}"}
+
+
+@app.get("/ingest/{job_id}")
+async def ingest_status(job_id: str):
+    job = await asyncio.to_thread(jobs.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
+
+@app.get("/metrics")
+async def metrics():
+    # 每个 worker 进程各自导出 (Prometheus 抓取时按 worker 区分)
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+def main(argv: Optional[List[str]] = None):
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="RAG 问答 HTTP API (SSE 流式输出)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="worker 进程数，共享同一份磁盘索引 (每个进程各自持有引擎和缓存)")
+    args = parser.parse_args(argv)
+    uvicorn.run("src.app.api_server:app", host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 # 文件路径: src/app/chain.py
 
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
 
 # 确保能找到其他模块 (适配相对导入问题)
 import sys
@@ -11,36 +11,46 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")
 from src.llm.deepseek_client import DeepSeekClient
 from src.llm.prompts import get_rag_prompt
 from src.retrieval.search import SearchEngine
+from src.app.context import ContextPacker
 
-def format_docs(docs):
+_default_packer = None
+
+def format_docs(docs, packer: ContextPacker = None):
     """
-    将检索到的 Documents 列表格式化为 XML 字符串，供 Prompt 使用。
-    同时保留文件名，方便溯源。
+    将检索到的 Documents 列表格式化为 XML 字符串，供 Prompt 使用，同时保留文件名，方便溯源。
+    同一文件同一章节的片段会合并 (去掉 chunk_overlap 重复的部分)，并按分数装入 Token 预算，见 ContextPacker。
     """
-    formatted = []
-    for i, doc in enumerate(docs):
-        # 获取 metadata，如果没有 source 字段则标记未知
-        source = doc.metadata.get("source", "Unknown")
-        content = doc.page_content
-        formatted.append(f"<doc id='{i}' source='{source}'>\n{content}\n</doc>")
-    return "\n\n".join(formatted)
-
-def build_rag_chain():
+    global _default_packer
+    if packer is None:
+        if _default_packer is None:
+            _default_packer = ContextPacker()
+        packer = _default_packer
+    return packer.format(docs)
+
+def build_rag_chain(llm=None, retriever=None, packer: ContextPacker = None):
     """
     构建 LCEL (LangChain Expression Language) 执行链
+    :param llm: 可选，复用已创建的 LLM 客户端 (常驻引擎传入)
+    :param retriever: 可选，复用已创建的检索器 (常驻引擎传入)
+    :param packer: 可选，上下文组装器 (自定义 Token 预算)，默认读取环境变量 CONTEXT_TOKEN_BUDGET
     """
     # 1. 准备组件
     try:
-        llm = DeepSeekClient().get_llm()
-        retriever = SearchEngine().get_retriever()
+        if llm is None:
+            llm = DeepSeekClient().get_llm()
+        if retriever is None:
+            retriever = SearchEngine().get_retriever()
         prompt = get_rag_prompt()
     except Exception as e:
         raise RuntimeError(f"初始化 RAG 组件失败: {e}")
 
     # 2. 定义链结构
-    # input 字典 -> retriever 找文档 -> format_docs 格式化 -> prompt -> llm -> 字符串输出
+    # input 字典 -> retriever 找文档 -> format_docs 合并 / 裁剪到 Token 预算 -> prompt -> llm -> 字符串输出
+    # (步骤名保持 format_docs，链路追踪按名称计时)
+    format_step = format_docs if packer is None else RunnableLambda(lambda docs: format_docs(docs, packer),
+                                                                    name="format_docs")
     rag_chain = (
-        {"context": retriever | format_docs, "question": RunnablePassthrough()}
+        {"context": retriever | format_step, "question": RunnablePassthrough()}
         | prompt
         | llm
         | StrOutputParser()
@@ -0,0 +1,172 @@
+import math
+import os
+import re
+import sys
+from typing import List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+try:
+    from src.utils.metrics import TOKENS
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+    from src.utils.metrics import TOKENS
+
+# 中日韩字符 (含全角标点)，DeepSeek 分词器下约 0.6 Token / 字；其余字符约 0.3 Token / 字符
+_CJK = re.compile(r"[　-〿㐀-䶿一-鿿＀-￯]")
+CJK_TOKENS_PER_CHAR = 0.6
+OTHER_TOKENS_PER_CHAR = 0.3
+
+HEADER_KEYS = ("h1", "h2", "h3")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    本地快速估算 Token 数 (不加载分词器)，按 DeepSeek 官方给出的经验比例：
+    1 个中文字符约 0.6 Token，1 个英文字符约 0.3 Token。
+    """
+    cjk = len(_CJK.findall(text))
+    return math.ceil(cjk * CJK_TOKENS_PER_CHAR + (len(text) - cjk) * OTHER_TOKENS_PER_CHAR)
+
+
+def _render(index: int, source: str, content: str) -> str:
+    return f"<doc id='{index}' source='{source}'>\n{content}\n</doc>"
+
+
+def _overlap(left: str, right: str, min_overlap: int) -> int:
+    """
+    left 的后缀与 right 的前缀重合的最大长度 (相邻 Chunk 的 chunk_overlap 部分)，没有重合时返回 0。
+    """
+    probe = right[:min_overlap]
+    if len(probe) < min_overlap:
+        return 0
+    start = left.find(probe)
+    while start != -1:
+        if right.startswith(left[start:]):
+            return len(left) - start
+        start = left.find(probe, start + 1)
+    return 0
+
+
+def merge_texts(texts: List[str], min_overlap: int = 20) -> List[str]:
+    """
+    合并同一章节的片段：被其他片段完全包含的删除，首尾重叠的拼接成一段 (去掉重复的部分)。
+    无法拼接的片段原样保留，顺序不变。
+    """
+    segments: List[str] = []
+    for text in texts:
+        text = text.strip()
+        if not text or any(text in seg for seg in segments):
+            continue
+        segments = [seg for seg in segments if seg not in text]
+        merged = True
+        while merged:
+            merged = False
+            for i, seg in enumerate(segments):
+                n = _overlap(seg, text, min_overlap)
+                if n:
+                    text = seg + text[n:]
+                else:
+                    n = _overlap(text, seg, min_overlap)
+                    if not n:
+                        continue
+                    text = text + seg[n:]
+                segments.pop(i)
+                merged = True
+                break
+        segments.append(text)
+    return segments
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """
+    按行截断到 max_tokens 以内 (单行超长时按字符截断)。
+    """
+    lines, used = [], 0
+    for line in text.split("\n"):
+        cost = estimate_tokens(line) + 1
+        if used + cost > max_tokens:
+            if not lines:
+                ratio = max_tokens / max(cost, 1)
+                lines.append(line[:int(len(line) * ratio)])
+            break
+        lines.append(line)
+        used += cost
+    return "\n".join(lines).rstrip() + "\n..."
+
+
+class ContextPacker:
+    """
+    Prompt 上下文组装：
+    1. 同一文件、同一章节 (h1/h2/h3) 的片段归为一组，组内重叠的片段 (chunk_overlap) 拼接、重复的片段删除；
+    2. 按组内最高的 Rerank 分数 (没有时用向量相似度、再没有时用检索排名) 从高到低装入 Token 预算，
+       装不下的最后一段按行截断，剩余预算太少时停止；
+    3. 记录相对于原样拼接节省的 Token 数 (日志 + rag_llm_tokens_total{kind="context_saved"})。
+    """
+
+    def __init__(self, max_tokens: Optional[int] = None, min_tail_tokens: int = 120, log: bool = True):
+        """
+        :param max_tokens: 上下文的 Token 预算，默认读取环境变量 CONTEXT_TOKEN_BUDGET (未设置时为 3000)，<= 0 表示不限制
+        :param min_tail_tokens: 剩余预算少于该值时不再截断装入新的片段
+        :param log: 是否打印每次请求节省的 Token 数
+        """
+        self.max_tokens = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000")) if max_tokens is None else max_tokens
+        self.min_tail_tokens = min_tail_tokens
+        self.log = log
+
+    @staticmethod
+    def _score(doc: Document, rank: int) -> Tuple[float, float, int]:
+        metadata = doc.metadata
+        return (float(metadata.get("relevance_score", float("-inf"))),
+                float(metadata.get("dense_score", float("-inf"))), -rank)
+
+    def _group(self, docs: List[Document]):
+        groups = {}
+        for rank, doc in enumerate(docs):
+            source = str(doc.metadata.get("source", "Unknown"))
+            key = (source,) + tuple(str(doc.metadata.get(h, "")) for h in HEADER_KEYS)
+            group = groups.setdefault(key, {"source": source, "score": self._score(doc, rank), "texts": []})
+            group["score"] = max(group["score"], self._score(doc, rank))
+            group["texts"].append(doc.page_content)
+        return sorted(groups.values(), key=lambda g: g["score"], reverse=True)
+
+    def pack(self, docs: List[Document]) -> Tuple[str, dict]:
+        """
+        :return: (上下文字符串, 统计 {docs, blocks, raw_tokens, packed_tokens, saved_tokens, truncated, dropped})
+        """
+        raw = "\n\n".join(_render(i, doc.metadata.get("source", "Unknown"), doc.page_content)
+                          for i, doc in enumerate(docs))
+        raw_tokens = estimate_tokens(raw)
+
+        blocks, used, truncated, dropped = [], 0, 0, 0
+        budget = self.max_tokens if self.max_tokens > 0 else float("inf")
+        for group in self._group(docs):
+            content = "\n...\n".join(merge_texts(group["texts"]))
+            block = _render(len(blocks), group["source"], content)
+            cost = estimate_tokens(block) + (1 if blocks else 0)
+            if used + cost > budget:
+                remaining = budget - used - estimate_tokens(_render(len(blocks), group["source"], ""))
+                # 第一块无论多少都要保留 (截断)，之后的块剩余预算足够时才截断装入
+                if blocks and remaining < self.min_tail_tokens:
+                    dropped += 1
+                    continue
+                block = _render(len(blocks), group["source"], _truncate(content, max(int(remaining), 1)))
+                cost = estimate_tokens(block) + (1 if blocks else 0)
+                truncated += 1
+            blocks.append(block)
+            used += cost
+
+        context = "\n\n".join(blocks)
+        packed_tokens = estimate_tokens(context)
+        stats = {"docs": len(docs), "blocks": len(blocks), "raw_tokens": raw_tokens, "packed_tokens": packed_tokens,
+                 "saved_tokens": max(raw_tokens - packed_tokens, 0), "truncated": truncated, "dropped": dropped}
+        return context, stats
+
+    def format(self, docs: List[Document]) -> str:
+        context, stats = self.pack(docs)
+        TOKENS.inc(stats["saved_tokens"], kind="context_saved")
+        if self.log and docs:
+            print(f"[Context] {stats['docs']} 个片段 -> {stats['blocks']} 段，约 {stats['raw_tokens']} -> "
+                  f"{stats['packed_tokens']} Token (节省 {stats['saved_tokens']}，截断 {stats['truncated']}，"
+                  f"丢弃 {stats['dropped']})")
+        return context
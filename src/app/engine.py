@@ -0,0 +1,478 @@
+# 文件路径: src/app/engine.py
+
+import sys
+import os
+import asyncio
+import hashlib
+import threading
+from typing import AsyncIterator, Iterator, List, Optional
+
+from langchain_core.documents import Document
+
+# 确保能找到其他模块 (适配相对导入问题)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from src.app.answer_cache import AnswerCache
+from src.app.chain import build_rag_chain
+from src.app.context import ContextPacker
+from src.llm.deepseek_client import DeepSeekClient
+from src.llm.prompts import get_rag_prompt
+from src.retrieval.search import SearchEngine
+from src.utils.cache import normalize_query
+from src.utils.deadline import AdmissionController, DeadlineExceeded, RequestBudget, ServerBusy, use_budget
+from src.utils.metrics import ANSWERS, DEGRADATIONS, REGISTRY
+from src.utils.tracing import RequestTrace, TracingCallbackHandler
+
+
+class RAGEngine:
+    """
+    进程级常驻 RAG 引擎。
+    启动时一次性创建 DeepSeek 客户端、SearchEngine (向量库 + Reranker) 和 LCEL 链，
+    之后所有 Gradio / Streamlit 会话共享同一份对象，不再每条消息都重新构建。
+    索引重建完成后需要显式调用 reload() 切换到新索引，旧的检索组件在使用它的请求全部结束后关闭。
+    相同问题的回答会被缓存，并发的相同问题只生成一次 (见 AnswerCache)。
+    需要新生成的回答经过准入控制 (见 AdmissionController)：每个请求带端到端延迟预算，按负载和剩余预算逐级降级，
+    满载时用该问题最近一次的回答兜底，没有时直接抛出 ServerBusy。
+    """
+
+    def __init__(self, db_path: str = "./data/vector_store", warmup_query: Optional[str] = None,
+                 answer_cache_size: int = 256, answer_cache_ttl: Optional[float] = 3600,
+                 max_inflight: Optional[int] = None, request_budget_ms: Optional[float] = None):
+        """
+        :param answer_cache_size: 回答缓存的最大条目数 (0 表示只合并并发的相同问题，不缓存)
+        :param answer_cache_ttl: 回答缓存的过期时间 (秒)
+        :param max_inflight: 同时生成回答的请求数上限，默认读取环境变量 MAX_INFLIGHT_REQUESTS (未设置时为 16)
+        :param request_budget_ms: 每个请求的端到端延迟预算，默认读取环境变量 REQUEST_BUDGET_MS (未设置时为 20000)
+        """
+        self.db_path = db_path
+        self.warmup_query = warmup_query
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        # 每个 SearchEngine 上正在进行的请求数；被替换的实例在计数归零时关闭
+        self._leases = {}
+        self._retired = set()
+
+        # LLM 客户端与索引无关，整个进程只创建一次 (内部持有 HTTP 连接池)
+        self.llm = DeepSeekClient().get_llm()
+        self.answer_cache = AnswerCache(maxsize=answer_cache_size, ttl=answer_cache_ttl)
+        self.admission = AdmissionController(max_inflight=max_inflight, budget_ms=request_budget_ms)
+        self.answer_version = self._answer_version()
+        self.search_engine, self.chain = self._build()
+        self.loaded_version = self.search_engine.db_manager.index_version
+
+        if warmup_query:
+            self.warmup(warmup_query)
+
+    def _build(self):
+        """
+        构建检索组件和执行链。Chroma 在这里打开一次，之后所有请求复用。
+        """
+        search_engine = SearchEngine(db_path=self.db_path)
+        chain = build_rag_chain(llm=self.llm, retriever=search_engine.get_retriever())
+        return search_engine, chain
+
+    def _answer_version(self) -> str:
+        """
+        模型 / Prompt 版本：模型参数、Prompt 模板或上下文预算变化后，旧的缓存回答不再命中。
+        """
+        llm = self.llm
+        parts = [getattr(llm, "model_name", ""), getattr(llm, "temperature", ""), getattr(llm, "max_tokens", ""),
+                 repr(get_rag_prompt().messages), ContextPacker().max_tokens]
+        return hashlib.sha1("\x00".join(map(str, parts)).encode("utf-8")).hexdigest()[:12]
+
+    def reload(self):
+        """
+        重新打开索引并替换执行链。
+        新链在锁外构建完成后再整体替换，正在进行中的请求继续使用旧链直到结束，之后旧的检索组件被关闭
+        (释放微批线程、连接池和缓存连接)。
+        """
+        print(f"[Engine] 正在重新加载索引: {self.db_path}")
+        search_engine, chain = self._build()
+        with self._lock:
+            old = self.search_engine
+            self.search_engine, self.chain = search_engine, chain
+            self.loaded_version = search_engine.db_manager.index_version
+            idle = not self._leases.get(old)
+            if not idle:
+                self._retired.add(old)
+        if idle:
+            old.close()
+        # 缓存 Key 含索引版本，旧回答本来就不会再命中，这里直接释放
+        self.answer_cache.clear()
+        if self.warmup_query:
+            self.warmup(self.warmup_query)
+
+    def reload_if_stale(self) -> bool:
+        """
+        索引被其他进程更新 (例如 API 服务的另一个 worker 执行了增量同步) 时重新加载，
+        向量库的内存索引只在重新打开时才能看到其他进程的写入。已有其他线程在重新加载时直接返回。
+        :return: 是否执行了重新加载
+        """
+        with self._lock:
+            search_engine, loaded = self.search_engine, self.loaded_version
+        if search_engine.db_manager.index_version == loaded:
+            return False
+        if not self._reload_lock.acquire(blocking=False):
+            return False
+        try:
+            self.reload()
+        finally:
+            self._reload_lock.release()
+        return True
+
+    def warmup(self, query: Optional[str] = None):
+        """
+        预热：跑一次检索 (Embedding + 向量检索 + Rerank)，提前建立各服务的连接。
+        不调用 LLM，避免启动时产生 API 费用。预热失败只打印警告，不影响启动。
+        """
+        query = query or self.warmup_query
+        if not query:
+            return
+        _, search_engine = self._lease()
+        try:
+            search_engine.get_retriever().invoke(query)
+            print(f"[Engine] 预热完成: '{query}'")
+        except Exception as e:
+            print(f"⚠️ [Engine] 预热失败: {e}")
+        finally:
+            self._release(search_engine)
+
+    def _lease(self):
+        """
+        取当前的链和检索组件，并登记一个使用者 (用完后调用 _release)。
+        """
+        with self._lock:
+            search_engine = self.search_engine
+            self._leases[search_engine] = self._leases.get(search_engine, 0) + 1
+            return self.chain, search_engine
+
+    def _release(self, search_engine: SearchEngine):
+        with self._lock:
+            self._leases[search_engine] -= 1
+            if self._leases[search_engine]:
+                return
+            del self._leases[search_engine]
+            if search_engine not in self._retired:
+                return
+            self._retired.discard(search_engine)
+        # 已被 reload 替换且最后一个请求结束
+        search_engine.close()
+
+    @staticmethod
+    def _traced_config(question: str):
+        # 每个问题一个 RequestTrace，通过回调挂到链上，检索器也从回调中取到它
+        trace = RequestTrace(question)
+        return trace, {"callbacks": [TracingCallbackHandler(trace)], "run_name": "rag_query"}
+
+    def _answer_key(self, question: str, search_engine: SearchEngine):
+        return normalize_query(question), search_engine.db_manager.index_version, self.answer_version
+
+    def _settle(self, key, flight, trace: RequestTrace, budget: RequestBudget, status: str,
+                error: Optional[BaseException] = None):
+        # 先移出进行中的列表 (并写入缓存)，再通知订阅者结束，之后到达的相同问题直接命中缓存
+        # 降级生成的回答 (跳过了 MMR / Rerank 等) 不缓存
+        self.admission.release()
+        flight.documents = trace.documents or []
+        self.answer_cache.settle(key, flight, ok=status == "ok" and not budget.degraded)
+        flight.finish(error)
+        if budget.degraded:
+            trace.notes["degraded"] = list(budget.degraded)
+        # 正常结束 / 出错 / 所有订阅者中断 (cancelled) 都记录一次
+        trace.finish(status)
+
+    @staticmethod
+    def _fail(trace: RequestTrace, budget: RequestBudget, error: BaseException):
+        if isinstance(error, DeadlineExceeded):
+            budget.note("deadline_exceeded")
+        if trace.status != "error":
+            trace.fail("chain", error)
+
+    def _produce(self, chain, search_engine: SearchEngine, question: str, key, flight, budget: RequestBudget):
+        """
+        在后台线程中生成回答并发布到 Flight (同步接口使用)。
+        首 Token 的截止时间由 LLM 客户端的请求超时兜底 (同步调用无法从外部中断)。
+        """
+        trace, config = self._traced_config(question)
+        cancelled = threading.Event()
+        flight.set_canceller(cancelled.set)
+        status, error = "cancelled", None
+        with use_budget(budget):
+            stream = chain.stream(question, config=config)
+            try:
+                for chunk in stream:
+                    if cancelled.is_set():
+                        break
+                    flight.publish(chunk)
+                else:
+                    status = "ok"
+            except Exception as e:
+                status, error = "error", e
+                self._fail(trace, budget, e)
+            finally:
+                stream.close()
+                self._settle(key, flight, trace, budget, status, error)
+                self._release(search_engine)
+
+    async def _aproduce(self, chain, search_engine: SearchEngine, question: str, key, flight,
+                        budget: RequestBudget):
+        """
+        生成回答并发布到 Flight 的异步任务 (异步接口使用)，所有订阅者离开时被取消。
+        首 Token 必须在延迟预算内到达，否则中止生成并抛出 DeadlineExceeded；开始输出之后不再限制。
+        """
+        trace, config = self._traced_config(question)
+        status, error = "cancelled", None
+        with use_budget(budget):
+            stream = chain.astream(question, config=config)
+            try:
+                remaining = budget.remaining_ms()
+                try:
+                    first = await asyncio.wait_for(stream.__anext__(),
+                                                   remaining / 1000 if remaining != float("inf") else None)
+                except asyncio.TimeoutError:
+                    raise DeadlineExceeded(f"首 Token 超出延迟预算 {budget.budget_ms:.0f} ms")
+                flight.publish(first)
+                async for chunk in stream:
+                    flight.publish(chunk)
+                status = "ok"
+            except StopAsyncIteration:
+                status = "ok"
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                status, error = "error", e
+                self._fail(trace, budget, e)
+            finally:
+                await stream.aclose()
+                self._settle(key, flight, trace, budget, status, error)
+                self._release(search_engine)
+
+    def _begin(self, question: str):
+        """
+        查缓存 / 加入进行中的生成 / 准入新的生成。
+        :return: (链, 检索组件, Key, 回答来源, 缓存的回答, Flight, 延迟预算)。
+                 来源为 generated 时调用方负责启动生成 (生成结束时对检索组件调用 _release)；
+                 cache / stale_cache 时直接重放缓存的回答
+        :raises ServerBusy: 系统满载且没有可用的旧回答
+        """
+        chain, search_engine = self._lease()
+        try:
+            result = self._begin_leased(question, chain, search_engine)
+        except BaseException:
+            self._release(search_engine)
+            raise
+        if result[3] != "generated":
+            self._release(search_engine)
+        return result
+
+    def _begin_leased(self, question: str, chain, search_engine: SearchEngine):
+        key = self._answer_key(question, search_engine)
+        cached = self.answer_cache.get(key)
+        if cached is not None:
+            return chain, search_engine, key, "cache", cached, None, None
+
+        budget = None
+
+        def admit() -> bool:
+            nonlocal budget
+            budget = self.admission.try_admit()
+            return budget is not None
+
+        flight, created = self.answer_cache.join(key, admit=admit)
+        if flight is not None:
+            return chain, search_engine, key, "generated" if created else "coalesced", None, flight, budget
+
+        # 满载：有该问题最近一次的回答 (可能基于旧索引) 就返回它，否则快速拒绝
+        stale = self.answer_cache.get_stale(key)
+        if stale is not None:
+            DEGRADATIONS.inc(action="stale_answer")
+            return chain, search_engine, key, "stale_cache", stale, None, None
+        DEGRADATIONS.inc(action="rejected")
+        ANSWERS.inc(source="rejected")
+        raise ServerBusy(f"系统繁忙 (同时在生成的回答已达上限 {self.admission.max_inflight})，请稍后再试。")
+
+    @staticmethod
+    def _follower_trace(question: str, source: str) -> RequestTrace:
+        # 缓存命中 / 合并到进行中生成的请求：只记录自己看到的首 Token 和总耗时
+        trace = RequestTrace(question)
+        trace.notes["answer_source"] = source
+        return trace
+
+    def retrieve(self, question: str) -> List[Document]:
+        """
+        只检索不生成 (不经过准入控制)，返回 Rerank 后的文档。刚回答过的问题直接命中检索结果缓存。
+        """
+        _, search_engine = self._lease()
+        try:
+            return search_engine.search(question)
+        finally:
+            self._release(search_engine)
+
+    async def aretrieve(self, question: str) -> List[Document]:
+        """
+        retrieve 的异步版本。
+        """
+        _, search_engine = self._lease()
+        try:
+            return await search_engine.asearch(question)
+        finally:
+            self._release(search_engine)
+
+    def stream(self, question: str, sources: Optional[List[Document]] = None) -> Iterator[str]:
+        """
+        流式回答问题。只在取链时加锁，生成过程本身可以被多个会话并发执行。
+        缓存命中时重放缓存的 Token 流；同一问题正在生成时直接订阅那次生成的输出。
+        :param sources: 可选，回答正常结束时追加这次回答依据的文档 (生成时检索到的结果，不会重新检索)
+        """
+        chain, search_engine, key, source, cached, flight, budget = self._begin(question)
+        ANSWERS.inc(source=source)
+        if cached is not None:
+            yield from self._replay(question, cached.chunks, source)
+            if sources is not None:
+                sources.extend(cached.documents)
+            return
+        created = source == "generated"
+        if created:
+            threading.Thread(target=self._produce, args=(chain, search_engine, question, key, flight, budget),
+                             name="rag-answer", daemon=True).start()
+        trace = None if created else self._follower_trace(question, source)
+        status = "cancelled"
+        try:
+            for chunk in flight.iter_sync():
+                if trace is not None:
+                    trace.mark_first_token()
+                yield chunk
+            status = "ok"
+            if sources is not None:
+                sources.extend(flight.documents)
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            self.answer_cache.leave(flight)
+            if trace is not None:
+                trace.finish(status)
+
+    async def astream(self, question: str, sources: Optional[List[Document]] = None) -> AsyncIterator[str]:
+        """
+        异步流式回答：检索、Rerank 和 LLM 调用都不占用工作线程，适合大量并发会话。
+        缓存、请求合并和 sources 的行为与 stream 一致。
+        """
+        chain, search_engine, key, source, cached, flight, budget = self._begin(question)
+        ANSWERS.inc(source=source)
+        if cached is not None:
+            async for chunk in self._areplay(question, cached.chunks, source):
+                yield chunk
+            if sources is not None:
+                sources.extend(cached.documents)
+            return
+        created = source == "generated"
+        if created:
+            task = asyncio.create_task(self._aproduce(chain, search_engine, question, key, flight, budget))
+            flight.set_canceller(lambda: task.get_loop().call_soon_threadsafe(task.cancel))
+        trace = None if created else self._follower_trace(question, source)
+        status = "cancelled"
+        try:
+            async for chunk in flight.iter_async():
+                if trace is not None:
+                    trace.mark_first_token()
+                yield chunk
+            status = "ok"
+            if sources is not None:
+                sources.extend(flight.documents)
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            self.answer_cache.leave(flight)
+            if trace is not None:
+                trace.finish(status)
+
+    def _replay(self, question: str, chunks, source: str = "cache") -> Iterator[str]:
+        trace = self._follower_trace(question, source)
+        status = "cancelled"
+        try:
+            for chunk in chunks:
+                trace.mark_first_token()
+                yield chunk
+            status = "ok"
+        finally:
+            trace.finish(status)
+
+    async def _areplay(self, question: str, chunks, source: str = "cache") -> AsyncIterator[str]:
+        trace = self._follower_trace(question, source)
+        status = "cancelled"
+        try:
+            for chunk in chunks:
+                trace.mark_first_token()
+                yield chunk
+                # 让出事件循环，前端像实时生成一样逐段刷新
+                await asyncio.sleep(0)
+            status = "ok"
+        finally:
+            trace.finish(status)
+
+    def collect_cache_metrics(self):
+        """
+        /metrics 抓取时导出各级缓存的累计命中 / 未命中数。
+        """
+        _, search_engine = self._lease()
+        try:
+            stats = search_engine.cache_stats()
+            caches = {
+                "answer": self.answer_cache.cache.stats(),
+                "query_embedding": stats["query_embedding"],
+                "retrieval": stats["retrieval"],
+                "rerank_score": stats["rerank"]["score_cache"],
+            }
+            embedding_cache = search_engine.db_manager.embedding_fn.cache
+            if embedding_cache is not None:
+                caches["embedding"] = embedding_cache.stats()
+        finally:
+            self._release(search_engine)
+        documentation = "Cache lookups by cache and result"
+        for name, cache in caches.items():
+            yield "rag_cache_lookups_total", "counter", documentation, {"cache": name, "result": "hit"}, cache["hits"]
+            yield "rag_cache_lookups_total", "counter", documentation, {"cache": name, "result": "miss"}, cache["misses"]
+        for path, count in stats["rerank_paths"]["paths"].items():
+            yield "rag_rerank_path_total", "counter", "Cascade rerank decisions by path", {"path": path}, count
+        yield ("rag_inflight_requests", "gauge", "Answers currently being generated", {},
+               self.admission.inflight)
+
+
+# ==========================================
+# 进程级单例
+# ==========================================
+_engine: Optional[RAGEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_engine(warmup_query: Optional[str] = None) -> RAGEngine:
+    """
+    获取进程内共享的 RAGEngine，首次调用时构建。
+    构建失败 (例如索引尚未创建) 会抛出异常，下次调用会重新尝试。
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                try:
+                    _engine = RAGEngine(warmup_query=warmup_query)
+                except Exception as e:
+                    raise RuntimeError(f"初始化 RAG 引擎失败: {e}")
+                REGISTRY.register_collector("engine_caches", _engine.collect_cache_metrics)
+    return _engine
+
+
+def reload_engine(if_stale: bool = False):
+    """
+    索引重建后调用。引擎尚未创建时什么都不做，下次 get_engine() 会直接加载新索引。
+    :param if_stale: 只在索引版本确实变化时重新加载 (增量同步可能没有任何改动)
+    """
+    with _engine_lock:
+        engine = _engine
+    if engine is None:
+        return
+    if if_stale:
+        engine.reload_if_stale()
+    else:
+        engine.reload()
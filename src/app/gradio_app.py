@@ -1,4 +1,5 @@
 import gradio as gr
+import asyncio
 import sys
 import os
 import time
@@ -9,11 +10,11 @@ project_root = os.path.dirname(os.path.dirname(current_dir))
 sys.path.append(project_root)
 
 # --- 导入业务逻辑 ---
-from src.app.chain import build_rag_chain
-from src.ingestion.loader import DocLoader
-from src.ingestion.cleaner import DataCleaner
-from src.ingestion.splitter import HybridSplitter
-from src.embedding.vector_db import VectorDBManager
+from src.app.engine import get_engine, reload_engine
+from src.ingestion.pipeline import IngestionPipeline
+from src.ingestion.sync import IndexSyncer
+from src.utils.deadline import DeadlineExceeded, ServerBusy
+from src.utils.metrics import start_metrics_server
 
 # ==========================================
 # 逻辑函数定义
@@ -24,35 +25,51 @@ def rebuild_index_logic(doc_path):
         return "❌ 错误：路径不存在，请检查输入。"
     
     try:
-        yield "📂 [1/4] 正在扫描加载文档..."
-        loader = DocLoader(doc_path)
-        raw_docs = loader.load()
-        
-        yield f"🧹 [2/4] 加载成功 ({len(raw_docs)}个文件)，正在清洗..."
-        cleaned_docs = DataCleaner.clean_documents(raw_docs)
-        
-        yield "✂️ [3/4] 正在进行智能分块..."
-        splitter = HybridSplitter()
-        chunks = splitter.split(cleaned_docs)
-        
-        yield f"🧠 [4/4] 正在向量化 {len(chunks)} 个片段..."
-        db_manager = VectorDBManager()
-        db_manager.create_index(chunks, force_rebuild=True)
+        yield "📂 正在扫描文档..."
+        # 加载、清洗、分块、向量化、写入流水线并行，实时显示吞吐
+        for progress in IngestionPipeline(doc_path).run(force_rebuild=True):
+            yield IngestionPipeline.format_progress(progress)
+
+        # 通知常驻引擎切换到新索引
+        reload_engine()
         
-        yield f"✅ 成功！索引重建完成。\n共处理 {len(chunks)} 个片段。"
+        yield IngestionPipeline.format_progress(progress) + "\n🔁 检索引擎已切换到新索引。"
         
     except Exception as e:
         yield f"❌ 错误: {str(e)}"
 
-def chat_response_logic(message, history):
+def update_index_logic(doc_path):
+    if not doc_path or not os.path.exists(doc_path):
+        yield "❌ 错误：路径不存在，请检查输入。"
+        return
+
+    try:
+        yield "🔍 正在对比文件清单，查找变化的文档..."
+        result = IndexSyncer(doc_path).sync()
+
+        # 通知常驻引擎切换到新索引 (没有任何改动时索引版本不变，不会重新加载)
+        reload_engine(if_stale=True)
+
+        yield (f"✅ 增量更新完成。\n变化文件 {result['changed_files']} 个，删除文件 {result['removed_files']} 个；"
+               f"\n写入 {result['upserted_chunks']} 个片段，移除 {result['deleted_chunks']} 个片段。")
+
+    except Exception as e:
+        yield f"❌ 错误: {str(e)}"
+
+async def chat_response_logic(message, history):
     if not message:
         return
     try:
-        chain = build_rag_chain()
+        # 首次调用会构建引擎 (阻塞操作)，放到线程里执行
+        engine = await asyncio.to_thread(get_engine)
         partial_response = ""
-        for chunk in chain.stream(message):
+        async for chunk in engine.astream(message):
             partial_response += chunk
             yield partial_response
+    except ServerBusy as e:
+        yield f"🚦 {e}"
+    except DeadlineExceeded as e:
+        yield f"⏱️ 回答超时: {e}，请稍后重试。"
     except Exception as e:
         yield f"⚠️ 发生错误: {str(e)}"
 
@@ -73,7 +90,9 @@ with gr.Blocks(title="DeepSeek DevDocs RAG", theme=gr.themes.Soft()) as demo:
                 value="./data/raw", 
                 placeholder="/path/to/docs"
             )
-            rebuild_btn = gr.Button("🔄 重建索引", variant="primary")
+            with gr.Row():
+                update_btn = gr.Button("⬆️ 更新索引")
+                rebuild_btn = gr.Button("🔄 重建索引", variant="primary")
             status_output = gr.Textbox(label="系统状态", value="就绪", interactive=False, lines=4)
 
         # --- 右侧：聊天区 ---
@@ -96,6 +115,7 @@ with gr.Blocks(title="DeepSeek DevDocs RAG", theme=gr.themes.Soft()) as demo:
     # ==========================================
     
     rebuild_btn.click(rebuild_index_logic, inputs=[path_input], outputs=[status_output])
+    update_btn.click(update_index_logic, inputs=[path_input], outputs=[status_output])
 
     # 关键修改 2: 适配字典格式的 user_turn
     def user_turn(user_message, history):
@@ -104,7 +124,7 @@ with gr.Blocks(title="DeepSeek DevDocs RAG", theme=gr.themes.Soft()) as demo:
         return "", history + [{"role": "user", "content": user_message}]
 
     # 关键修改 3: 适配字典格式的 bot_turn
-    def bot_turn(history):
+    async def bot_turn(history):
         # 1. 获取最后一条用户消息
         user_msg_data = history[-1]["content"] 
         
@@ -131,7 +151,7 @@ with gr.Blocks(title="DeepSeek DevDocs RAG", theme=gr.themes.Soft()) as demo:
         # 3. 调用 RAG 逻辑 (确保传入的是纯字符串)
         generator = chat_response_logic(user_message, history[:-1])
         
-        for chunk in generator:
+        async for chunk in generator:
             history[-1]["content"] = chunk
             yield history
 
@@ -143,4 +163,15 @@ with gr.Blocks(title="DeepSeek DevDocs RAG", theme=gr.themes.Soft()) as demo:
     )
 
 if __name__ == "__main__":
-    demo.queue().launch(server_name="0.0.0.0", server_port=7860, share=False)
\ No newline at end of file
+    # 启动时预先构建常驻引擎 (打开向量库、建立连接并预热)
+    # 如果索引尚未构建，这里只打印警告，重建索引后首个问题会自动加载
+    try:
+        get_engine(warmup_query="LangChain 是什么？")
+    except Exception as e:
+        print(f"⚠️ 引擎预加载失败: {e}")
+
+    # Prometheus 指标 (/metrics) 在独立端口上提供，默认 9464，METRICS_PORT=0 关闭
+    start_metrics_server()
+
+    # 引擎在会话之间共享，允许多个会话并发生成回答
+    demo.queue(default_concurrency_limit=8).launch(server_name="0.0.0.0", server_port=7860, share=False)
\ No newline at end of file
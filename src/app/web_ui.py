@@ -5,11 +5,10 @@ import os
 # 将项目根目录加入路径，防止找不到模块
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 
-from src.app.chain import build_rag_chain
-from src.ingestion.loader import DocLoader
-from src.ingestion.cleaner import DataCleaner
-from src.ingestion.splitter import HybridSplitter
-from src.embedding.vector_db import VectorDBManager
+from src.app.engine import get_engine, reload_engine
+from src.ingestion.pipeline import IngestionPipeline
+from src.ingestion.sync import IndexSyncer
+from src.utils.deadline import DeadlineExceeded, ServerBusy
 
 # 页面配置
 st.set_page_config(page_title="DevDocs RAG", layout="wide")
@@ -20,30 +19,34 @@ with st.sidebar:
     st.header("知识库管理")
     doc_path = st.text_input("文档目录路径", value="./data/raw")
     
+    if st.button("⬆️ 更新索引 (Update Index)"):
+        with st.status("正在增量更新...", expanded=True) as status:
+            try:
+                st.write("🔍 对比文件清单...")
+                result = IndexSyncer(doc_path).sync()
+
+                # 通知常驻引擎切换到新索引 (没有任何改动时索引版本不变，不会重新加载)
+                reload_engine(if_stale=True)
+
+                status.update(label="✅ 增量更新完成!", state="complete", expanded=False)
+                st.success(f"变化文件 {result['changed_files']} 个，删除文件 {result['removed_files']} 个；"
+                           f"写入 {result['upserted_chunks']} 个片段，移除 {result['deleted_chunks']} 个片段。")
+            except Exception as e:
+                st.error(f"出错: {str(e)}")
+
     if st.button("🔄 重建索引 (Rebuild Index)"):
         with st.status("正在处理数据...", expanded=True) as status:
             try:
-                # 1. 加载
-                st.write("📂 加载文档...")
-                loader = DocLoader(doc_path)
-                raw_docs = loader.load()
-                
-                # 2. 清洗
-                st.write("🧹 清洗数据...")
-                cleaned_docs = DataCleaner.clean_documents(raw_docs)
-                
-                # 3. 分块
-                st.write("✂️ 智能分块...")
-                splitter = HybridSplitter()
-                chunks = splitter.split(cleaned_docs)
-                
-                # 4. 向量化
-                st.write("🧠 向量化并存储 (这可能需要一会)...")
-                db_manager = VectorDBManager()
-                db_manager.create_index(chunks, force_rebuild=True)
+                # 加载、清洗、分块、向量化、写入流水线并行，实时刷新吞吐
+                progress_text = st.empty()
+                for progress in IngestionPipeline(doc_path).run(force_rebuild=True):
+                    progress_text.text(IngestionPipeline.format_progress(progress))
+
+                # 通知常驻引擎切换到新索引
+                reload_engine()
                 
                 status.update(label="✅ 索引构建完成!", state="complete", expanded=False)
-                st.success(f"成功处理 {len(chunks)} 个片段。")
+                st.success(f"成功处理 {progress['chunks_written']} 个片段。")
             except Exception as e:
                 st.error(f"出错: {str(e)}")
 
@@ -68,16 +71,22 @@ if prompt := st.chat_input("如何使用这个框架的 API?"):
         full_response = ""
         
         try:
-            # 初始化链 (建议结合 st.cache_resource 优化加载速度)
-            chain = build_rag_chain()
+            # 获取进程内共享的常驻引擎 (所有 Streamlit 会话共用，只构建一次)
+            engine = get_engine()
             
             # 流式输出
-            chunks = chain.stream(prompt)
+            chunks = engine.stream(prompt)
             for chunk in chunks:
                 full_response += chunk
                 message_placeholder.markdown(full_response + "▌")
             
             message_placeholder.markdown(full_response)
+        except ServerBusy as e:
+            st.warning(f"🚦 {e}")
+            full_response = str(e)
+        except DeadlineExceeded as e:
+            st.warning(f"⏱️ 回答超时: {e}，请稍后重试。")
+            full_response = str(e)
         except Exception as e:
             st.error(f"生成回答时出错: {e}")
             full_response = f"Error: {e}"
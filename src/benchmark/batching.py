@@ -0,0 +1,108 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from typing import List, Optional
+
+# 确保能找到其他模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from langchain_core.documents import Document
+
+from src.benchmark.stub_servers import StubConfig, StubModelServer
+from src.embedding.embedder import LocalEmbeddings
+from src.retrieval.reranker import LocalReranker
+from src.utils.timing import percentiles
+
+
+def _closed_loop(call, concurrency: int, requests_per_client: int) -> dict:
+    """
+    concurrency 个客户端各自连续发送 requests_per_client 个请求 (每个请求内容都不同，不命中缓存)，
+    返回吞吐和延迟分布。
+    """
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def client(client_id: int):
+        for i in range(requests_per_client):
+            start = time.perf_counter()
+            try:
+                call(f"client {client_id} question {i} 如何配置容器网络")
+            except Exception as e:
+                errors.append(e)
+                continue
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {"qps": len(latencies) / elapsed, "errors": len(errors), "latency": percentiles(latencies)}
+
+
+def batching_report(stub_url: str, concurrency: int = 32, requests_per_client: int = 20,
+                    candidates: int = 16, wait_ms: float = 5.0) -> List[dict]:
+    """
+    对比 embed_query 和 /score 在关闭 / 开启跨请求微批时的吞吐 (QPS) 与 p50 / p99 延迟。
+    """
+    docs = [Document(page_content=f"候选片段 {i}：容器网络与端口映射的配置说明") for i in range(candidates)]
+    rows = []
+    for batched in (False, True):
+        embedder = LocalEmbeddings(query_cache_size=0, query_batch_size=32 if batched else 1,
+                                   query_batch_wait_ms=wait_ms)
+        embedder.base_url = f"{stub_url}/v1/embeddings"
+        reranker = LocalReranker(endpoint=f"{stub_url}/score", score_cache_size=0,
+                                 batch_max_pairs=max(64, candidates) if batched else 1, batch_wait_ms=wait_ms)
+
+        for service, call, batcher in (
+            ("embedding", embedder.embed_query, embedder.query_batcher),
+            ("rerank", lambda query: reranker.score(docs, query), reranker._batcher),
+        ):
+            row = _closed_loop(call, concurrency, requests_per_client)
+            row.update({"service": service, "batched": batched,
+                        "batches": batcher.stats() if batcher is not None else None})
+            rows.append(row)
+    return rows
+
+
+def print_report(rows: List[dict], concurrency: int):
+    print(f"------- 跨请求微批: {concurrency} 个并发客户端 (替身服务模拟单卡串行处理) -------")
+    for row in rows:
+        name = f"{row['service']} ({'微批' if row['batched'] else '逐个请求'})"
+        batches = f"，平均每批 {row['batches']['avg_batch']:.1f} 个请求" if row["batches"] else ""
+        print(f"   {name:>22}: {row['qps']:7.1f} QPS，p50 {row['latency']['p50_ms']:7.1f} ms / "
+              f"p99 {row['latency']['p99_ms']:7.1f} ms{batches}")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="embed_query / rerank 跨请求微批的吞吐与延迟对比")
+    parser.add_argument("--concurrency", type=int, default=32, help="并发客户端数")
+    parser.add_argument("--requests", type=int, default=20, help="每个客户端的请求数")
+    parser.add_argument("--candidates", type=int, default=16, help="每个问题的 Rerank 候选数")
+    parser.add_argument("--wait-ms", type=float, default=5.0, help="攒批窗口 (毫秒)")
+    parser.add_argument("--gpu-slots", type=int, default=1, help="替身服务同时处理的请求数 (模拟 GPU 并发能力)")
+    parser.add_argument("--output", help="结果 JSON 的保存路径")
+    args = parser.parse_args(argv)
+
+    # 延迟模型与 vLLM 相近：每个请求有固定开销，每条文本 / 每个候选另有少量边际开销
+    config = StubConfig(dim=1024, embed_latency_ms=15, embed_item_ms=0.5, score_latency_ms=15, score_item_ms=0.5,
+                        gpu_slots=args.gpu_slots)
+    with StubModelServer(config) as server:
+        rows = batching_report(server.url, args.concurrency, args.requests, args.candidates, args.wait_ms)
+
+    print_report(rows, args.concurrency)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+        print(f"[Batching] 结果已保存: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
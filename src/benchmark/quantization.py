@@ -0,0 +1,119 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import List, Optional
+
+import numpy as np
+
+# 确保能找到其他模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from src.benchmark.run import _ingest_phase, _point_to_stub, _run_phase
+from src.benchmark.stub_servers import StubConfig, StubModelServer
+from src.embedding.numpy_store import NumpyVectorStore
+from src.embedding.quantization import DEFAULT_RESCORE_FACTOR
+from src.embedding.vector_db import VectorDBManager
+from src.retrieval.cascade import DEFAULT_QUERIES
+from src.utils.timing import percentiles
+
+# (量化方式, 重排倍数)：rescore_factor = 1 表示不重排，直接使用量化码的排序
+DEFAULT_CONFIGS = [("int8", 1), ("int8", DEFAULT_RESCORE_FACTOR["int8"]),
+                   ("binary", 1), ("binary", DEFAULT_RESCORE_FACTOR["binary"]), ("binary", 20)]
+
+
+def _sample_queries(db_manager: VectorDBManager, n_queries: int, seed: int = 0) -> List[str]:
+    """
+    内置问题 + 从库中随机抽取的片段开头 (模拟只记得部分原文的提问)。
+    """
+    docs = db_manager.get_documents(db_manager.list_ids())
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(docs), size=min(n_queries, len(docs)), replace=False)
+    return list(DEFAULT_QUERIES) + [docs[i].page_content[:80] for i in picks]
+
+
+def _run_config(persist_dir: str, embedding_fn, query_vectors: np.ndarray, k: int,
+                quantization: Optional[str], rescore_factor: Optional[int]) -> dict:
+    store = NumpyVectorStore(persist_dir, embedding_fn, quantization=quantization, rescore_factor=rescore_factor)
+    hits, latencies = [], []
+    for vector in query_vectors:
+        start = time.perf_counter()
+        docs = store.similarity_search_by_vector(vector, k=k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits.append([doc.metadata.get("chunk_id") for doc in docs])
+    return {**store.memory_stats(), "rescore_factor": store.rescore_factor if quantization else None,
+            "latency": percentiles(latencies), "hits": hits}
+
+
+def quantization_report(persist_dir: str, embedding_fn, queries: List[str], k: int = 10,
+                        configs=DEFAULT_CONFIGS) -> List[dict]:
+    """
+    在已构建的 numpy 索引上对比 float32 精确检索与各量化配置的 Recall@k、常驻内存和查询延迟。
+    量化码缺失时会在索引目录中生成 (qseg_*.npz)，不影响原有数据。
+    """
+    query_vectors = np.asarray(embedding_fn.embed_documents(queries), dtype=np.float32)
+    exact = _run_config(persist_dir, embedding_fn, query_vectors, k, None, None)
+    rows = [exact]
+    for quantization, rescore_factor in configs:
+        rows.append(_run_config(persist_dir, embedding_fn, query_vectors, k, quantization, rescore_factor))
+
+    truth = exact["hits"]
+    for row in rows:
+        hits = row.pop("hits")
+        row["recall_at_k"] = float(np.mean([len(set(a) & set(b)) / max(len(b), 1) for a, b in zip(hits, truth)]))
+        row["memory_ratio"] = row["resident_bytes"] / max(exact["resident_bytes"], 1)
+    return rows
+
+
+def print_report(rows: List[dict], k: int):
+    first = rows[0]
+    print(f"------- 量化检索: {first['rows']} 个向量 x {first['dim']} 维，Recall@{k} 以 float32 精确检索为基准 -------")
+    for row in rows:
+        name = row["quantization"] + (f" (重排 x{row['rescore_factor']})" if row["rescore_factor"] else "")
+        print(f"   {name:>20}: 常驻 {row['resident_bytes'] / 2 ** 20:7.2f} MB ({row['memory_ratio']:.1%})，"
+              f"Recall@{k} {row['recall_at_k']:.3f}，查询 p50 {row['latency']['p50_ms']:.2f} ms / "
+              f"p95 {row['latency']['p95_ms']:.2f} ms")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="量化向量检索的召回率 / 内存对比")
+    parser.add_argument("--data-dir", default="./data/raw")
+    parser.add_argument("--persist-dir", help="已有的 numpy 后端索引目录，使用其中的真实向量和 Embedding 服务 "
+                                              "(默认用替身服务在临时目录中构建)")
+    parser.add_argument("--dim", type=int, default=4096, help="替身 Embedding 的维度 (默认与 Qwen3-Embedding-8B 一致)")
+    parser.add_argument("--queries", type=int, default=200, help="从库中抽取的查询数 (另加内置问题)")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--output", help="结果 JSON 的保存路径")
+    args = parser.parse_args(argv)
+
+    if args.persist_dir:
+        db_manager = VectorDBManager(persist_dir=args.persist_dir, backend="numpy")
+        rows = quantization_report(db_manager.persist_dir, db_manager.embedding_fn,
+                                   _sample_queries(db_manager, args.queries), k=args.k)
+    else:
+        workdir = tempfile.mkdtemp(prefix="rag_quant_")
+        persist_dir = os.path.join(workdir, "vector_store")
+        try:
+            with StubModelServer(StubConfig(dim=args.dim, embed_latency_ms=0, embed_item_ms=0)) as server:
+                print(f"[Quantization] 使用替身服务构建索引: {args.data_dir} -> {persist_dir}")
+                _run_phase(_ingest_phase, args.data_dir, persist_dir, server.url, "numpy", None)
+                db_manager = VectorDBManager(persist_dir=persist_dir, backend="numpy")
+                _point_to_stub(db_manager, server.url)
+                rows = quantization_report(db_manager.persist_dir, db_manager.embedding_fn,
+                                           _sample_queries(db_manager, args.queries), k=args.k)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(rows, args.k)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+        print(f"[Quantization] 结果已保存: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
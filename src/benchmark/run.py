@@ -0,0 +1,265 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Optional
+
+# 确保能找到其他模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from src.benchmark.stub_servers import StubConfig, StubModelServer
+from src.retrieval.cascade import DEFAULT_QUERIES
+from src.utils.timing import peak_rss_mb, percentiles
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _point_to_stub(db_manager, stub_url: str):
+    db_manager.embedding_fn.base_url = f"{stub_url}/v1/embeddings"
+
+
+# ==========================================
+# 各阶段在独立子进程中执行，RSS 峰值互不影响
+# ==========================================
+def _ingest_phase(data_dir: str, persist_dir: str, stub_url: str, backend: str, workers: Optional[int], result):
+    from src.embedding.vector_db import VectorDBManager
+    from src.ingestion.pipeline import IngestionPipeline
+
+    db_manager = VectorDBManager(persist_dir=persist_dir, backend=backend)
+    _point_to_stub(db_manager, stub_url)
+    snapshot = None
+    for snapshot in IngestionPipeline(data_dir, db_manager=db_manager, workers=workers).run(force_rebuild=True):
+        pass
+    result.put({
+        "docs": snapshot["docs_loaded"],
+        "chunks": snapshot["chunks_written"],
+        "elapsed_s": snapshot["elapsed_s"],
+        "docs_per_s": snapshot["docs_per_s"],
+        "chunks_per_s": snapshot["chunks_per_s"],
+        "embed_batch_ms_avg": snapshot["embed_ms_avg"],
+        "embed_batch_ms_p95": snapshot["embed_ms_p95"],
+        "peak_rss_mb": peak_rss_mb(),
+    })
+
+
+def _query_phase(persist_dir: str, stub_url: str, backend: str, queries: List[str], rounds: int,
+                 warm: bool, rerank_mode: str, result):
+    from langchain_openai import ChatOpenAI
+    from src.app.chain import build_rag_chain
+    from src.retrieval.search import SearchEngine
+    from src.utils.timing import TimingStats
+
+    engine = SearchEngine(db_path=persist_dir, backend=backend, rerank_mode=rerank_mode,
+                          result_cache_size=1024 if warm else 0)
+    _point_to_stub(engine.db_manager, stub_url)
+    engine.reranker.endpoint = f"{stub_url}/score"
+    engine.timing_stats = TimingStats(window=len(queries) * rounds)
+    llm = ChatOpenAI(model="deepseek-chat", openai_api_base=f"{stub_url}/v1", openai_api_key="EMPTY",
+                     temperature=0.1, streaming=True)
+
+    started = time.perf_counter()
+    chain = build_rag_chain(llm=llm, retriever=engine.get_retriever())
+    startup_ms = (time.perf_counter() - started) * 1000
+
+    ttft, total = [], []
+    for _ in range(rounds):
+        for query in queries:
+            if not warm:
+                # 冷查询：每次都真实请求 Embedding 和 /score
+                engine.db_manager.embedding_fn.query_cache.clear()
+                engine.reranker.clear_cache()
+            start = time.perf_counter()
+            first = None
+            for _ in chain.stream(query):
+                if first is None:
+                    first = time.perf_counter()
+            end = time.perf_counter()
+            ttft.append(((first or end) - start) * 1000)
+            total.append((end - start) * 1000)
+
+    result.put({
+        "queries": len(total),
+        "warm": warm,
+        "rerank_mode": rerank_mode,
+        "startup_ms": startup_ms,
+        "stages": engine.timing_summary(),
+        "ttft": percentiles(ttft),
+        "total": percentiles(total),
+        "peak_rss_mb": peak_rss_mb(),
+    })
+
+
+def _run_phase(target, *args) -> dict:
+    context = multiprocessing.get_context("spawn")
+    result = context.Queue()
+    process = context.Process(target=target, args=(*args, result))
+    process.start()
+    # 先取结果再 join，避免子进程因队列未被读取而无法退出
+    while True:
+        try:
+            output = result.get(timeout=1.0)
+            break
+        except queue.Empty:
+            if not process.is_alive():
+                raise RuntimeError(f"基准测试阶段 {target.__name__} 异常退出 (exit code {process.exitcode})")
+    process.join()
+    return output
+
+
+def run_benchmark(data_dir: str = "./data/raw", queries: Optional[List[str]] = None, rounds: int = 3,
+                  backend: str = "chroma", workers: Optional[int] = None, warm: bool = False,
+                  rerank_mode: str = "full", stub_config: Optional[StubConfig] = None,
+                  workdir: Optional[str] = None) -> dict:
+    """
+    端到端基准测试：启动替身模型服务，对 data_dir 执行一次完整入库 (IngestionPipeline)，
+    再用 build_rag_chain 流式回答 queries × rounds 次，返回可直接序列化为 JSON 的结果。
+    索引写在临时目录 (或 workdir) 中，不会影响 ./data/vector_store。
+    """
+    queries = queries or DEFAULT_QUERIES
+    stub_config = stub_config or StubConfig()
+    own_workdir = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix="rag_bench_")
+    persist_dir = os.path.join(workdir, "vector_store")
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "data_dir": os.path.abspath(data_dir),
+            "backend": backend,
+            "stub": stub_config.to_dict(),
+        },
+    }
+    try:
+        with StubModelServer(stub_config) as server:
+            print(f"[Benchmark] 入库: {data_dir} -> {persist_dir}")
+            report["ingestion"] = _run_phase(_ingest_phase, data_dir, persist_dir, server.url, backend, workers)
+            print(f"[Benchmark] 查询: {len(queries)} 个问题 × {rounds} 轮 ({'warm' if warm else 'cold'})")
+            report["query"] = _run_phase(_query_phase, persist_dir, server.url, backend, queries, rounds,
+                                         warm, rerank_mode)
+    finally:
+        if own_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+# ==========================================
+# 结果对比
+# ==========================================
+def _flatten(report: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in report.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare_reports(baseline: dict, current: dict, threshold: float = 0.1, min_delta_ms: float = 1.0) -> List[dict]:
+    """
+    对比两次基准结果 (例如两个 commit) 中的延迟 / 吞吐 / 内存指标。
+    耗时和内存上升、吞吐下降超过 threshold (相对值) 的指标标记为 regression；
+    亚毫秒级阶段的抖动很大，耗时指标还要求绝对变化超过 min_delta_ms。
+    """
+    old, new = _flatten(baseline), _flatten(current)
+    rows = []
+    for name in sorted(set(old) & set(new)):
+        if name.startswith("meta.") or name.endswith(".count") or old[name] == 0:
+            continue
+        higher_is_better = name.endswith("_per_s")
+        if not (higher_is_better or name.endswith(("_ms", "_mb", "_s"))):
+            continue
+        change = (new[name] - old[name]) / abs(old[name])
+        worse = -change if higher_is_better else change
+        regression = worse > threshold
+        if name.endswith("_ms") and new[name] - old[name] < min_delta_ms:
+            regression = False
+        rows.append({"metric": name, "baseline": old[name], "current": new[name],
+                     "change": change, "regression": regression})
+    return rows
+
+
+def print_summary(report: dict):
+    ingestion, query = report["ingestion"], report["query"]
+    print("------- 基准测试结果 -------")
+    print(f"   入库: {ingestion['docs']} 个文件 / {ingestion['chunks']} 个片段，用时 {ingestion['elapsed_s']:.1f}s "
+          f"({ingestion['chunks_per_s']:.1f} chunks/s)，RSS 峰值 {ingestion['peak_rss_mb']:.0f} MB")
+    for name, stats in query["stages"].items():
+        print(f"   {name:>14}: p50 {stats['p50_ms']:.1f} ms / p95 {stats['p95_ms']:.1f} ms / p99 {stats['p99_ms']:.1f} ms")
+    for name in ("ttft", "total"):
+        stats = query[name]
+        print(f"   {name:>14}: p50 {stats['p50_ms']:.1f} ms / p95 {stats['p95_ms']:.1f} ms / p99 {stats['p99_ms']:.1f} ms")
+    print(f"   查询进程 RSS 峰值 {query['peak_rss_mb']:.0f} MB")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="RAG 端到端离线基准测试 (使用本地替身模型服务)")
+    parser.add_argument("--data-dir", default="./data/raw")
+    parser.add_argument("--output", help="结果 JSON 的保存路径 (默认只打印)")
+    parser.add_argument("--compare", help="与之前保存的结果 JSON 对比，报告回退的指标")
+    parser.add_argument("--queries", help="问题文件，每行一个 (默认使用内置问题)")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--backend", default=os.getenv("VECTOR_STORE_BACKEND", "chroma"))
+    parser.add_argument("--workers", type=int, help="入库清洗 + 分块的进程数 (默认自动)")
+    parser.add_argument("--rerank-mode", default="full", choices=["full", "cascade"])
+    parser.add_argument("--warm", action="store_true", help="保留查询缓存 (默认每次查询前清空)")
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--embed-latency-ms", type=float, default=20.0)
+    parser.add_argument("--score-latency-ms", type=float, default=15.0)
+    parser.add_argument("--ttft-ms", type=float, default=300.0)
+    parser.add_argument("--token-ms", type=float, default=20.0)
+    parser.add_argument("--answer-tokens", type=int, default=120)
+    args = parser.parse_args(argv)
+
+    queries = None
+    if args.queries:
+        with open(args.queries, encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+    stub_config = StubConfig(dim=args.dim, embed_latency_ms=args.embed_latency_ms,
+                             score_latency_ms=args.score_latency_ms, ttft_ms=args.ttft_ms,
+                             token_ms=args.token_ms, answer_tokens=args.answer_tokens)
+
+    report = run_benchmark(data_dir=args.data_dir, queries=queries, rounds=args.rounds, backend=args.backend,
+                           workers=args.workers, warm=args.warm, rerank_mode=args.rerank_mode,
+                           stub_config=stub_config)
+    print_summary(report)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"[Benchmark] 结果已保存: {args.output}")
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows = compare_reports(baseline, report)
+        print(f"------- 与 {args.compare} 对比 (commit {baseline['meta'].get('commit')}) -------")
+        for row in rows:
+            flag = "⚠️" if row["regression"] else "  "
+            print(f"{flag} {row['metric']}: {row['baseline']:.2f} -> {row['current']:.2f} ({row['change']:+.1%})")
+        if any(row["regression"] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+import base64
+import hashlib
+import json
+import multiprocessing
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+import numpy as np
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9_]+|[一-鿿]")
+
+
+# 每个维度一个固定的高斯基向量，词向量是它的循环移位
+_BASE_VECTORS = {}
+
+
+def _base_vector(dim: int) -> np.ndarray:
+    vector = _BASE_VECTORS.get(dim)
+    if vector is None:
+        vector = _BASE_VECTORS[dim] = np.random.default_rng(0).standard_normal(dim).astype(np.float32)
+    return vector
+
+
+def hash_vector(text: str, dim: int) -> np.ndarray:
+    """
+    确定性的 "词袋哈希" 向量：英文按单词、中文按单字，每个词映射为一个固定高斯向量的循环移位 (带随机符号)，
+    求和后归一化。等价于词袋的随机投影：词汇重叠越多余弦相似度越高，
+    同时向量是稠密且正负各半的 (与真实 Embedding 一致，量化测试才有意义)。
+    同一文本在任何进程、任何时间得到的向量都相同。
+    """
+    base = _base_vector(dim)
+    vector = np.zeros(dim, dtype=np.float32)
+    for token in _TOKEN_PATTERN.findall(str(text).lower()):
+        digest = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+        sign = 1.0 if digest & 1 else -1.0
+        vector += sign * np.roll(base, (digest >> 1) % dim)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class StubConfig:
+    """
+    替身模型服务的配置，所有延迟单位为毫秒。
+    """
+
+    def __init__(self, dim: int = 1024,
+                 embed_latency_ms: float = 20.0, embed_item_ms: float = 0.5,
+                 score_latency_ms: float = 15.0, score_item_ms: float = 1.0,
+                 ttft_ms: float = 300.0, token_ms: float = 20.0, answer_tokens: int = 120,
+                 gpu_slots: int = 0):
+        """
+        :param dim: Embedding 维度
+        :param embed_latency_ms / embed_item_ms: /v1/embeddings 每个请求的固定延迟 / 每条文本的附加延迟
+        :param score_latency_ms / score_item_ms: /score 每个请求的固定延迟 / 每个候选的附加延迟
+        :param ttft_ms: 流式对话的首 Token 延迟
+        :param token_ms: 之后每个 Token 的间隔
+        :param answer_tokens: 每个回答的 Token 数
+        :param gpu_slots: /v1/embeddings 和 /score 各自同时处理的请求数上限，模拟 GPU 的并发能力 (0 表示不限)
+        """
+        self.dim = dim
+        self.embed_latency_ms = embed_latency_ms
+        self.embed_item_ms = embed_item_ms
+        self.score_latency_ms = score_latency_ms
+        self.score_item_ms = score_item_ms
+        self.ttft_ms = ttft_ms
+        self.token_ms = token_ms
+        self.answer_tokens = answer_tokens
+        self.gpu_slots = gpu_slots
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+
+def _sleep_ms(ms: float):
+    if ms > 0:
+        time.sleep(ms / 1000)
+
+
+class _NoLimit:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def _make_handler(config: StubConfig):
+    # 每个模型一个 "GPU"：超出 gpu_slots 的请求排队，请求越碎，固定开销占用的时间越多
+    def slots():
+        return threading.BoundedSemaphore(config.gpu_slots) if config.gpu_slots > 0 else _NoLimit()
+    embed_gpu, score_gpu = slots(), slots()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, payload: dict, status: int = 200):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.rstrip("/") in ("", "/health"):
+                self._send_json({"status": "ok"})
+            else:
+                self._send_json({"error": "not found"}, status=404)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if self.path.endswith("/embeddings"):
+                self._embeddings(body)
+            elif self.path.endswith("/score"):
+                self._score(body)
+            elif self.path.endswith("/chat/completions"):
+                self._chat(body)
+            else:
+                self._send_json({"error": f"unknown path {self.path}"}, status=404)
+
+        def _embeddings(self, body: dict):
+            texts = body.get("input", [])
+            if isinstance(texts, str):
+                texts = [texts]
+            with embed_gpu:
+                _sleep_ms(config.embed_latency_ms + config.embed_item_ms * len(texts))
+            data = []
+            for i, text in enumerate(texts):
+                vector = hash_vector(text, config.dim)
+                if body.get("encoding_format") == "base64":
+                    embedding = base64.b64encode(vector.astype("<f4").tobytes()).decode("ascii")
+                else:
+                    embedding = vector.tolist()
+                data.append({"object": "embedding", "index": i, "embedding": embedding})
+            self._send_json({"object": "list", "data": data, "model": body.get("model", "stub")})
+
+        def _score(self, body: dict):
+            candidates = body.get("text_2", [])
+            queries = body.get("text_1", "")
+            if isinstance(queries, str):
+                queries = [queries] * len(candidates)
+            with score_gpu:
+                _sleep_ms(config.score_latency_ms + config.score_item_ms * len(candidates))
+            data = [
+                {"index": i, "score": float(hash_vector(q, config.dim) @ hash_vector(c, config.dim))}
+                for i, (q, c) in enumerate(zip(queries, candidates))
+            ]
+            self._send_json({"data": data, "model": body.get("model", "stub")})
+
+        def _answer_tokens(self, body: dict) -> List[str]:
+            # 回答内容取自问题本身，循环补足到 answer_tokens 个 Token
+            question = body.get("messages", [{}])[-1].get("content", "")
+            words = question.split()[-50:] or ["ok"]
+            return [words[i % len(words)] + " " for i in range(config.answer_tokens)]
+
+        def _chat(self, body: dict):
+            tokens = self._answer_tokens(body)
+            model = body.get("model", "stub")
+            completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+            if not body.get("stream"):
+                _sleep_ms(config.ttft_ms + config.token_ms * (len(tokens) - 1))
+                self._send_json({
+                    "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                                 "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+                })
+                return
+
+            # 流式响应 (SSE)：不带 Content-Length，发送完毕后关闭连接
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+
+            def event(delta: dict, finish_reason: Optional[str] = None):
+                chunk = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+            _sleep_ms(config.ttft_ms)
+            for i, token in enumerate(tokens):
+                if i > 0:
+                    _sleep_ms(config.token_ms)
+                event({"role": "assistant", "content": token} if i == 0 else {"content": token})
+            event({}, finish_reason="stop")
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+def _serve(config: StubConfig, port_queue):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(config))
+    server.daemon_threads = True
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+class StubModelServer:
+    """
+    本地替身模型服务：在独立子进程中提供 /v1/embeddings、/score 和 OpenAI 兼容的流式 /v1/chat/completions，
+    延迟可配置、向量确定，用于在没有 GPU / DeepSeek API 的环境下跑端到端基准测试。
+    放在子进程中，服务端自身的 CPU 和内存不会计入被测进程。
+
+    用法:
+        with StubModelServer(StubConfig(dim=256)) as server:
+            server.url  # http://127.0.0.1:<随机端口>
+    """
+
+    def __init__(self, config: Optional[StubConfig] = None):
+        self.config = config or StubConfig()
+        self.url: Optional[str] = None
+        self._process = None
+
+    def start(self) -> "StubModelServer":
+        context = multiprocessing.get_context("spawn")
+        port_queue = context.Queue()
+        self._process = context.Process(target=_serve, args=(self.config, port_queue), daemon=True)
+        self._process.start()
+        port = port_queue.get(timeout=30)
+        self.url = f"http://127.0.0.1:{port}"
+        print(f"[Stub] 替身模型服务已启动: {self.url}")
+        return self
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join(timeout=5)
+            self._process = None
+
+    def __enter__(self) -> "StubModelServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def embeddings_url(self) -> str:
+        return f"{self.url}/v1/embeddings"
+
+    @property
+    def score_url(self) -> str:
+        return f"{self.url}/score"
+
+    @property
+    def openai_base_url(self) -> str:
+        return f"{self.url}/v1"
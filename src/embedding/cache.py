@@ -0,0 +1,191 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    基于 SQLite 的持久化 Embedding 缓存 (内容寻址)。
+    Key 为 (模型名, 规范化文本的 SHA-256)，Value 为 float32 向量的二进制。
+    重建索引时未变化的 Chunk 直接命中缓存，只有新增/修改的文本才会发给 Embedding 服务。
+
+    读多写少：命中时只在 last_access 早于 touch_interval 时才回写 (淘汰只需要粗粒度的访问时间)；
+    条目数在内存中近似累计，每隔 count_resync_interval 或接近容量上限时才执行一次 COUNT(*)。
+    """
+
+    def __init__(self, db_path: str = "./data/embedding_cache.sqlite", max_entries: int = 500_000,
+                 touch_interval: float = 600.0, count_resync_interval: float = 60.0):
+        """
+        :param db_path: 缓存文件路径 (放在向量库目录之外，重建索引时不会被删除)
+        :param max_entries: 最大缓存条数，超出后按最近访问时间淘汰
+        :param touch_interval: 命中条目的 last_access 超过该秒数才更新
+        :param count_resync_interval: 近似条目数与数据库重新同步的间隔 (秒，其他进程的写入在同步时计入)
+        """
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        self.count_resync_interval = count_resync_interval
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._approx_entries: Optional[int] = None # 近似条目数 (写入时累加，REPLACE 也计入，只会偏大)
+        self._count_synced = 0.0
+
+        parent = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(parent, exist_ok=True)
+
+        # 并发 Batch 会在多个线程里读写，统一用一把锁串行化
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings (last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """
+        文本规范化：Unicode NFC + 去掉首尾空白 + 行尾空白，避免无意义的差异导致缓存失效。
+        """
+        text = unicodedata.normalize("NFC", text)
+        text = re.sub(r"[ \t]+\n", "\n", text)
+        return text.strip()
+
+    @classmethod
+    def text_hash(cls, text: str) -> str:
+        return hashlib.sha256(cls.normalize(text).encode("utf-8")).hexdigest()
+
+    def get_many(self, model: str, texts: List[str]) -> Dict[int, np.ndarray]:
+        """
+        批量查询缓存。
+        :return: {输入下标: float32 向量}，只包含命中的条目
+        """
+        if not texts:
+            return {}
+        hashes = [self.text_hash(t) for t in texts]
+        unique_hashes = list(set(hashes))
+        found, stale = {}, []
+        now = time.time()
+
+        with self._lock:
+            # SQLite 单条语句的参数个数有限，分段查询
+            for start in range(0, len(unique_hashes), 500):
+                part = unique_hashes[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector, last_access FROM embeddings "
+                    f"WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *part],
+                ).fetchall()
+                for text_hash, blob, last_access in rows:
+                    found[text_hash] = np.frombuffer(blob, dtype=np.float32)
+                    if last_access < now - self.touch_interval:
+                        stale.append(text_hash)
+
+            # 只回写访问时间已经过旧的条目，热点查询不再每次都产生写事务
+            if stale:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, h) for h in stale],
+                )
+                self._conn.commit()
+
+            result = {i: found[h] for i, h in enumerate(hashes) if h in found}
+            self.hits += len(result)
+            self.misses += len(texts) - len(result)
+        return result
+
+    def put_many(self, model: str, texts: List[str], vectors):
+        """
+        批量写入缓存，写入后按容量淘汰最久未访问的条目。
+        :param vectors: (n, dim) 矩阵或向量列表
+        """
+        if not texts:
+            return
+        now = time.time()
+        rows = [
+            (model, self.text_hash(t), np.asarray(v, dtype=np.float32).tobytes(), now)
+            for t, v in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_access) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._evict(len(rows), now)
+            self._conn.commit()
+
+    def _count(self, now: float) -> int:
+        self._approx_entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self._count_synced = now
+        return self._approx_entries
+
+    def _evict(self, added: int, now: float):
+        if self._approx_entries is None or now - self._count_synced > self.count_resync_interval:
+            count = self._count(now)
+        else:
+            self._approx_entries += added
+            if self._approx_entries <= self.max_entries:
+                return
+            # 近似值超过上限 (可能因为 REPLACE 偏大)，用精确值确认
+            count = self._count(now)
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE rowid IN "
+                "(SELECT rowid FROM embeddings ORDER BY last_access LIMIT ?)",
+                (overflow,),
+            )
+            self._approx_entries = self.max_entries
+
+    def stats(self) -> dict:
+        """
+        返回缓存统计：命中/未命中次数、命中率、条目数。
+        """
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "entries": entries,
+            "max_entries": self.max_entries,
+        }
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self, model: Optional[str] = None):
+        """
+        清空缓存 (可只清某个模型的条目)。
+        """
+        with self._lock:
+            if model:
+                self._conn.execute("DELETE FROM embeddings WHERE model = ?", (model,))
+            else:
+                self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._approx_entries = None
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
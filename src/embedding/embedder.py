@@ -1,23 +1,100 @@
 import sys
 import os
-import requests
-from typing import List
+import time
+import asyncio
+import base64
+import json
+import tracemalloc
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import List, Optional
 
 # 确保能找到其他模块
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
+from src.embedding.cache import EmbeddingCache
+from src.utils.batching import MicroBatcher
+from src.utils.cache import TTLCache, normalize_query
+from src.utils.deadline import DeadlineExceeded, stage_timeout
+from src.utils.http import create_session, get_async_client
+from src.utils.metrics import UPSTREAM_ERRORS, UPSTREAM_SECONDS
+
 class LocalEmbeddings:
     """
     手动封装 vLLM Embedding 接口，避免 LangChain 自动构造复杂 Payload 导致的 400 错误。
     对应端口: 4061
     模型名称: Qwen3-Embedding-8B
+
+    大批量文本会按条数和字符数切成多个 Batch，通过连接池并发发送，结果按原顺序拼回。
+    传入 EmbeddingCache 后，embed_documents 只会把缓存未命中的文本发给服务端。
+    embed_query 另有一个内存 LRU/TTL 缓存，重复的问题不再请求服务端。
+    aembed_documents / aembed_query 是对应的异步实现 (共享的 httpx 异步连接池)。
+
+    encoding_format="base64" 时服务端返回二进制 float32，直接解码成连续的 NumPy 矩阵，
+    不再为每个浮点数创建 Python 对象；入库路径可以用 embed_documents_array 直接拿矩阵。
+
+    并发请求的 embed_query / aembed_query (缓存未命中时) 经过共享的 MicroBatcher，
+    短时间内到达的问题合并成一次 /v1/embeddings 调用，减少打到 vLLM 的小请求。
     """
     
-    def __init__(self):
+    def __init__(
+        self,
+        max_batch_size: int = 64,
+        max_batch_chars: int = 64000,
+        max_concurrency: int = 4,
+        max_retries: int = 3,
+        retry_backoff: float = 0.5,
+        timeout: float = 60.0,
+        cache: Optional[EmbeddingCache] = None,
+        query_cache_size: int = 2048,
+        query_cache_ttl: Optional[float] = 3600,
+        encoding_format: str = "float",
+        query_batch_size: int = 32,
+        query_batch_wait_ms: Optional[float] = None,
+    ):
+        """
+        :param max_batch_size: 单个请求最多包含的文本条数
+        :param max_batch_chars: 单个请求的字符总数上限 (近似 Token 预算，防止超出 --max-model-len / 请求体限制)
+        :param max_concurrency: 同时在途的 Batch 请求数
+        :param max_retries: 每个 Batch 失败后的最大重试次数
+        :param retry_backoff: 重试退避基数 (秒)，第 n 次重试等待 retry_backoff * 2^(n-1)
+        :param timeout: 单个 HTTP 请求超时 (秒)
+        :param cache: 可选的持久化 Embedding 缓存
+        :param query_cache_size: 查询向量缓存的最大条目数 (0 表示关闭)
+        :param query_cache_ttl: 查询向量缓存的过期时间 (秒)
+        :param encoding_format: 传输格式，"float" (JSON 浮点数组) 或 "base64" (二进制 float32)
+        :param query_batch_size: 合并查询向量请求时每批最多的问题数 (<= 1 表示不合并，每个问题单独请求)
+        :param query_batch_wait_ms: 服务端忙时的攒批窗口 (毫秒)，默认读取环境变量 MICRO_BATCH_WAIT_MS (未设置时为 5)
+        """
+        if encoding_format not in ("float", "base64"):
+            raise ValueError(f"不支持的 encoding_format: {encoding_format}")
         self.base_url = "http://localhost:4061/v1/embeddings"
         self.model_name = "Qwen3-Embedding-8B"
         self.api_key = "EMPTY"  # vLLM 本地部署不需要 Key
 
+        self.max_batch_size = max_batch_size
+        self.max_batch_chars = max_batch_chars
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.timeout = timeout
+        self.encoding_format = encoding_format
+        self.cache = cache
+        self.query_cache = TTLCache(maxsize=query_cache_size, ttl=query_cache_ttl)
+        self.query_batcher = MicroBatcher(
+            "embedding", self._embed_query_batch, max_batch_size=query_batch_size,
+            max_wait_ms=query_batch_wait_ms, max_concurrency=max_concurrency,
+        ) if query_batch_size > 1 else None
+
+        # Keep-Alive 连接池，连接数与并发 Batch 数一致
+        self.session = create_session(
+            pool_size=max_concurrency,
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {self.api_key}"
+            }
+        )
+
     @property
     def client(self):
         """
@@ -26,51 +103,303 @@ class LocalEmbeddings:
         """
         return self
 
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+    def close(self):
+        """
+        释放后台资源 (微批线程、连接池、缓存连接)。引擎重新加载后关闭旧实例时调用，之后不能再使用。
+        """
+        if self.query_batcher is not None:
+            self.query_batcher.close()
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    def _make_batches(self, texts: List[str]) -> List[List[str]]:
         """
-        批量向量化：手动构造最简单的 HTTP 请求
+        按顺序切分 Batch：条数达到 max_batch_size 或字符数超过 max_batch_chars 时另起一批。
+        单条超长文本单独成批 (截断交给服务端处理)。
+        """
+        batches = []
+        current, current_chars = [], 0
+        for text in texts:
+            if current and (len(current) >= self.max_batch_size
+                            or current_chars + len(text) > self.max_batch_chars):
+                batches.append(current)
+                current, current_chars = [], 0
+            current.append(text)
+            current_chars += len(text)
+        if current:
+            batches.append(current)
+        return batches
+
+    def _build_payload(self, batch: List[str]) -> dict:
+        return {
+            "model": self.model_name,
+            "input": batch, # 直接传字符串列表，不要传字典
+            "encoding_format": self.encoding_format
+        }
+
+    @staticmethod
+    def _parse_response(data: dict) -> np.ndarray:
+        """
+        解析响应为 (n, dim) 的 float32 矩阵。
+        base64 格式逐行解码进预分配的矩阵，全程没有逐个浮点数的 Python 对象。
+        """
+        # 提取向量数据，按 index 排序确保顺序一致
+        data_points = data["data"]
+        data_points.sort(key=lambda x: x["index"])
+        if not data_points:
+            return np.empty((0, 0), dtype=np.float32)
+
+        if isinstance(data_points[0]["embedding"], str):
+            rows = [base64.b64decode(item["embedding"]) for item in data_points]
+            matrix = np.empty((len(rows), len(rows[0]) // 4), dtype=np.float32)
+            for i, raw in enumerate(rows):
+                matrix[i] = np.frombuffer(raw, dtype="<f4")
+            return matrix
+
+        return np.asarray([item["embedding"] for item in data_points], dtype=np.float32)
+
+    @staticmethod
+    def _concat(results: List[np.ndarray]) -> np.ndarray:
+        results = [r for r in results if len(r)]
+        if not results:
+            return np.empty((0, 0), dtype=np.float32)
+        return results[0] if len(results) == 1 else np.concatenate(results)
+
+    def _embed_batch(self, batch: List[str]) -> np.ndarray:
+        """
+        发送单个 Batch，失败时按指数退避重试。
+        """
+        payload = self._build_payload(batch)
+
+        for attempt in range(self.max_retries + 1):
+            response = None
+            started = time.perf_counter()
+            try:
+                response = self.session.post(self.base_url, json=payload, timeout=self.timeout)
+                response.raise_for_status()
+                UPSTREAM_SECONDS.observe(time.perf_counter() - started, service="embedding")
+                return self._parse_response(response.json())
+
+            except Exception as e:
+                UPSTREAM_ERRORS.inc(service="embedding")
+                if attempt < self.max_retries:
+                    wait = self.retry_backoff * (2 ** attempt)
+                    print(f"⚠️ [Embedding] 请求失败 ({e})，{wait:.1f}s 后重试 ({attempt + 1}/{self.max_retries})...")
+                    time.sleep(wait)
+                    continue
+                print(f"❌ [Embedding Error] 请求失败: {e}")
+                # 打印详细的错误响应以供调试
+                if response is not None:
+                    print(f"   Server Response: {response.text}")
+                raise e
+
+    def _embed_uncached(self, texts: List[str]) -> np.ndarray:
+        """
+        直接请求服务端：切分 Batch 后并发请求，结果按输入顺序拼成矩阵
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+
+        batches = self._make_batches(texts)
+        if len(batches) == 1 or self.max_concurrency <= 1:
+            results = [self._embed_batch(batch) for batch in batches]
+        else:
+            # executor.map 保持提交顺序返回，直接拼接即为原始顺序
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                results = list(executor.map(self._embed_batch, batches))
+
+        return self._concat(results)
+
+    def _lookup_cache(self, texts: List[str]):
+        """
+        查缓存，返回 (命中的 {下标: 向量}, 未命中的下标, 去重后需要请求的文本)
+        """
+        cached = self.cache.get_many(self.model_name, texts)
+        miss_indices = [i for i in range(len(texts)) if i not in cached]
+        # 同一批里重复的文本只请求一次
+        unique_misses = list(dict.fromkeys(texts[i] for i in miss_indices))
+        return cached, miss_indices, unique_misses
+
+    def _assemble(self, texts, cached, miss_indices, unique_misses, new_vectors) -> np.ndarray:
+        """
+        把缓存命中和新请求的向量按输入顺序填入同一个矩阵，并把新向量写回缓存。
+        """
+        if unique_misses:
+            self.cache.put_many(self.model_name, unique_misses, new_vectors)
+            dim = new_vectors.shape[1]
+        else:
+            dim = len(next(iter(cached.values())))
+
+        matrix = np.empty((len(texts), dim), dtype=np.float32)
+        for i, vector in cached.items():
+            matrix[i] = vector
+        if unique_misses:
+            position = {text: j for j, text in enumerate(unique_misses)}
+            for i in miss_indices:
+                matrix[i] = new_vectors[position[texts[i]]]
+        return matrix
+
+    def embed_documents_array(self, texts: List[str]) -> np.ndarray:
+        """
+        批量向量化并返回 (n, dim) 的 float32 矩阵：优先查缓存，只把未命中的文本发给服务端。
+        入库路径可以直接使用该矩阵，避免转换成 Python 列表。
         """
         # 清洗输入：确保全是字符串，且不为空
         valid_texts = [str(t) for t in texts if t]
         if not valid_texts:
-            return []
+            return np.empty((0, 0), dtype=np.float32)
 
-        payload = {
-            "model": self.model_name,
-            "input": valid_texts, # 直接传字符串列表，不要传字典
-            "encoding_format": "float"
-        }
-        
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
+        if self.cache is None:
+            return self._embed_uncached(valid_texts)
+
+        cached, miss_indices, unique_misses = self._lookup_cache(valid_texts)
+        new_vectors = self._embed_uncached(unique_misses) if unique_misses else None
+        return self._assemble(valid_texts, cached, miss_indices, unique_misses, new_vectors)
 
-        try:
-            response = requests.post(self.base_url, json=payload, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-            
-            # 提取向量数据，按 index 排序确保顺序一致
-            data_points = data["data"]
-            data_points.sort(key=lambda x: x["index"])
-            return [item["embedding"] for item in data_points]
-            
-        except Exception as e:
-            print(f"❌ [Embedding Error] 请求失败: {e}")
-            # 打印详细的错误响应以供调试
-            if 'response' in locals():
-                print(f"   Server Response: {response.text}")
-            raise e
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        批量向量化 (LangChain 接口，返回 Python 列表)
+        """
+        return self.embed_documents_array(texts).tolist()
+
+    def _embed_query_batch(self, texts: List[str]) -> List[List[float]]:
+        """
+        MicroBatcher 的批处理函数：同一批里相同的问题只请求一次。
+        """
+        unique = list(dict.fromkeys(texts))
+        vectors = self._embed_uncached(unique)
+        position = {text: i for i, text in enumerate(unique)}
+        return [vectors[position[text]].tolist() for text in texts]
 
     def embed_query(self, text: str) -> List[float]:
         """
-        单文本向量化
+        单文本向量化 (查询向量只进内存缓存，不写入持久化缓存，避免用户问题污染文档缓存)
+        """
+        if not text:
+            return []
+        key = (self.model_name, normalize_query(text))
+        vector = self.query_cache.get(key)
+        if vector is not None:
+            return vector
+
+        if self.query_batcher is not None:
+            # 有请求级延迟预算时最多等待预算分给 embed_query 的时间
+            timeout = stage_timeout("embed_query", self.timeout)
+            try:
+                vector = self.query_batcher.submit(str(text)).result(timeout=timeout)
+            except FutureTimeout:
+                raise DeadlineExceeded(f"查询向量化超时 ({timeout * 1000:.0f} ms)")
+        else:
+            vector = self._embed_uncached([str(text)])[0].tolist()
+        self.query_cache.set(key, vector)
+        return vector
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        批量向量化问题 (离线评测 / 批量检索使用)：先查查询向量缓存，未命中的问题去重后按 max_batch_size
+        切成大批并发请求，不经过 MicroBatcher。结果写回查询向量缓存，与 embed_query 共用。
+        空问题返回空列表。
+        """
+        keys = [(self.model_name, normalize_query(text)) if text else None for text in texts]
+        vectors = [self.query_cache.get(key) if key is not None else [] for key in keys]
+        misses = list(dict.fromkeys(str(texts[i]) for i, vector in enumerate(vectors) if vector is None))
+        if misses:
+            fresh = dict(zip(misses, self._embed_uncached(misses).tolist()))
+            for i, vector in enumerate(vectors):
+                if vector is None:
+                    vectors[i] = fresh[str(texts[i])]
+                    self.query_cache.set(keys[i], vectors[i])
+        return vectors
+
+    # ==========================================
+    # 异步接口
+    # ==========================================
+    async def _aembed_batch(self, batch: List[str]) -> np.ndarray:
+        """
+        异步发送单个 Batch，失败时按指数退避重试。
+        """
+        payload = self._build_payload(batch)
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        client = get_async_client()
+
+        for attempt in range(self.max_retries + 1):
+            response = None
+            started = time.perf_counter()
+            try:
+                response = await client.post(self.base_url, json=payload, headers=headers, timeout=self.timeout)
+                response.raise_for_status()
+                UPSTREAM_SECONDS.observe(time.perf_counter() - started, service="embedding")
+                return self._parse_response(response.json())
+
+            except Exception as e:
+                UPSTREAM_ERRORS.inc(service="embedding")
+                if attempt < self.max_retries:
+                    wait = self.retry_backoff * (2 ** attempt)
+                    print(f"⚠️ [Embedding] 请求失败 ({e})，{wait:.1f}s 后重试 ({attempt + 1}/{self.max_retries})...")
+                    await asyncio.sleep(wait)
+                    continue
+                print(f"❌ [Embedding Error] 请求失败: {e}")
+                if response is not None:
+                    print(f"   Server Response: {response.text}")
+                raise e
+
+    async def _aembed_uncached(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+
+        # 最多 max_concurrency 个 Batch 同时在途，gather 按提交顺序返回结果
+        semaphore = asyncio.Semaphore(max(1, self.max_concurrency))
+
+        async def run(batch):
+            async with semaphore:
+                return await self._aembed_batch(batch)
+
+        results = await asyncio.gather(*(run(batch) for batch in self._make_batches(texts)))
+        return self._concat(results)
+
+    async def aembed_documents_array(self, texts: List[str]) -> np.ndarray:
+        """
+        embed_documents_array 的异步版本
+        """
+        valid_texts = [str(t) for t in texts if t]
+        if not valid_texts:
+            return np.empty((0, 0), dtype=np.float32)
+
+        if self.cache is None:
+            return await self._aembed_uncached(valid_texts)
+
+        cached, miss_indices, unique_misses = self._lookup_cache(valid_texts)
+        new_vectors = await self._aembed_uncached(unique_misses) if unique_misses else None
+        return self._assemble(valid_texts, cached, miss_indices, unique_misses, new_vectors)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        异步批量向量化 (LangChain 接口)
+        """
+        return (await self.aembed_documents_array(texts)).tolist()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """
+        异步单文本向量化 (与 embed_query 共用查询向量缓存和 MicroBatcher，同步和异步的请求可以合并到同一批)
         """
-        result = self.embed_documents([text])
-        if result:
-            return result[0]
-        return []
+        if not text:
+            return []
+        key = (self.model_name, normalize_query(text))
+        vector = self.query_cache.get(key)
+        if vector is not None:
+            return vector
+
+        if self.query_batcher is not None:
+            timeout = stage_timeout("embed_query", self.timeout)
+            try:
+                vector = await asyncio.wait_for(asyncio.wrap_future(self.query_batcher.submit(str(text))), timeout)
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded(f"查询向量化超时 ({timeout * 1000:.0f} ms)")
+        else:
+            vector = (await self._aembed_uncached([str(text)]))[0].tolist()
+        self.query_cache.set(key, vector)
+        return vector
 
 # ==========================================
 # 独立执行的测试函数
@@ -90,5 +419,48 @@ def test_embedding_independently():
     except Exception as e:
         print(f"\n❌ 测试失败: {e}")
 
+def compare_encoding_formats(n_texts: int = 256, dim: int = 4096, rounds: int = 3):
+    """
+    离线对比 float / base64 两种传输格式在客户端的解析开销 (不需要启动服务)。
+    用随机向量构造与 vLLM 相同结构的响应体，测量 JSON 解析 + 解码为矩阵的耗时、
+    CPU 时间、响应体大小和 Python 堆内存峰值。
+    """
+    print(f"------- Embedding 传输格式对比 ({n_texts} x {dim}) -------")
+    vectors = np.random.default_rng(0).standard_normal((n_texts, dim)).astype(np.float32)
+    bodies = {
+        "float": json.dumps({"data": [
+            {"index": i, "embedding": v.tolist()} for i, v in enumerate(vectors)
+        ]}),
+        "base64": json.dumps({"data": [
+            {"index": i, "embedding": base64.b64encode(v.astype("<f4").tobytes()).decode()}
+            for i, v in enumerate(vectors)
+        ]}),
+    }
+
+    report = {}
+    for fmt, body in bodies.items():
+        wall, cpu = [], []
+        for _ in range(rounds):
+            start_wall, start_cpu = time.perf_counter(), time.process_time()
+            matrix = LocalEmbeddings._parse_response(json.loads(body))
+            wall.append(time.perf_counter() - start_wall)
+            cpu.append(time.process_time() - start_cpu)
+
+        tracemalloc.start()
+        matrix = LocalEmbeddings._parse_response(json.loads(body))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        assert np.allclose(matrix, vectors)
+        report[fmt] = {
+            "payload_mb": len(body) / 1e6,
+            "parse_ms": min(wall) * 1000,
+            "cpu_ms": min(cpu) * 1000,
+            "peak_mb": peak / 1e6,
+        }
+        print(f"   {fmt:>6}: 响应体 {report[fmt]['payload_mb']:.1f} MB, 解析 {report[fmt]['parse_ms']:.0f} ms, "
+              f"CPU {report[fmt]['cpu_ms']:.0f} ms, 内存峰值 {report[fmt]['peak_mb']:.1f} MB")
+    return report
+
 if __name__ == "__main__":
     test_embedding_independently()
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+
+def assign_chunk_ids(chunks: List[Document]) -> List[str]:
+    """
+    为 Chunk 生成确定性 ID：sha1(source + 文件内序号 + 内容)。
+    同一文件内容不变时重新分块得到的 ID 完全相同，可以直接 upsert / 按 ID 删除。
+    ID 同时写入 metadata["chunk_id"]，方便下游按 ID 引用。
+    """
+    ids = []
+    position: Dict[str, int] = {}
+    for chunk in chunks:
+        source = str(chunk.metadata.get("source", ""))
+        index = position.get(source, 0)
+        position[source] = index + 1
+        key = f"{source}\x00{index}\x00{chunk.page_content}"
+        chunk_id = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        chunk.metadata["chunk_id"] = chunk_id
+        ids.append(chunk_id)
+    return ids
+
+
+def file_fingerprint(path: str, with_hash: bool = True) -> Optional[dict]:
+    """
+    读取文件指纹 (mtime, size, 内容哈希)。文件不存在时返回 None。
+    """
+    if not os.path.isfile(path):
+        return None
+    stat = os.stat(path)
+    fingerprint = {"mtime": stat.st_mtime, "size": stat.st_size, "hash": None}
+    if with_hash:
+        with open(path, "rb") as f:
+            fingerprint["hash"] = hashlib.sha256(f.read()).hexdigest()
+    return fingerprint
+
+
+class IndexManifest:
+    """
+    索引清单：记录每个源文件的路径、mtime、大小、内容哈希以及它产生的 Chunk ID。
+    保存在向量库目录下的 manifest.json，用于增量同步时判断哪些文件需要重新处理。
+
+    内容没变、只是 mtime 变了的文件 (例如被 touch) 的新指纹另存在 manifest.stat.json：
+    不改写 manifest.json，索引版本号 (由它的修改时间得出) 保持不变，下次同步也不必再读取内容计算哈希。
+    """
+
+    FILENAME = "manifest.json"
+    STAT_FILENAME = "manifest.stat.json"
+
+    def __init__(self, persist_dir: str):
+        self.path = os.path.join(persist_dir, self.FILENAME)
+        self.stat_path = os.path.join(persist_dir, self.STAT_FILENAME)
+        # {source: {"mtime", "size", "hash", "chunk_ids"}}
+        self.files: Dict[str, dict] = {}
+        # 只刷新了 mtime 的文件 {source: {"mtime", "size", "hash"}}
+        self.refreshed: Dict[str, dict] = {}
+        self._refreshed_dirty = False
+
+    @staticmethod
+    def _read_json(path: str) -> dict:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    @staticmethod
+    def _write_json(path: str, data: dict):
+        # 先写临时文件再替换，避免中途崩溃留下半个 JSON
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, persist_dir: str) -> "IndexManifest":
+        manifest = cls(persist_dir)
+        if os.path.exists(manifest.path):
+            manifest.files = cls._read_json(manifest.path).get("files", {})
+        if os.path.exists(manifest.stat_path):
+            for source, stat in cls._read_json(manifest.stat_path).get("files", {}).items():
+                entry = manifest.files.get(source)
+                # 只在内容哈希与清单一致时采用 (清单被重写后旧的刷新记录自然失效)
+                if entry and entry.get("hash") == stat.get("hash"):
+                    entry.update(mtime=stat["mtime"], size=stat["size"])
+                    manifest.refreshed[source] = stat
+        return manifest
+
+    def save(self):
+        self._write_json(self.path, {"files": self.files})
+        # 清单已包含最新指纹，刷新记录不再需要
+        if os.path.exists(self.stat_path):
+            os.remove(self.stat_path)
+        self.refreshed, self._refreshed_dirty = {}, False
+
+    def save_fingerprints(self):
+        """
+        只保存 diff 中刷新过 mtime 的指纹 (不改写 manifest.json，索引版本号不变)。没有新的刷新时什么都不做。
+        """
+        if self._refreshed_dirty:
+            self._write_json(self.stat_path, {"files": self.refreshed})
+            self._refreshed_dirty = False
+
+    def record_chunks(self, chunks: List[Document], ids: List[str]):
+        """
+        按 source 分组记录 Chunk ID，并刷新对应文件的指纹 (全量构建后调用)。
+        """
+        grouped: Dict[str, List[str]] = {}
+        for chunk, chunk_id in zip(chunks, ids):
+            grouped.setdefault(str(chunk.metadata.get("source", "")), []).append(chunk_id)
+        self.record_sources(grouped)
+
+    def record_sources(self, chunk_ids_by_source: Dict[str, List[str]]):
+        """
+        记录 {source: [chunk_id, ...]}，并刷新对应文件的指纹。
+        """
+        for source, chunk_ids in chunk_ids_by_source.items():
+            fingerprint = file_fingerprint(source) or {"mtime": None, "size": None, "hash": None}
+            self.files[source] = {**fingerprint, "chunk_ids": chunk_ids}
+
+    def diff(self, paths: List[str]) -> Tuple[Dict[str, dict], List[str]]:
+        """
+        对比当前文件列表和清单。
+        :return: (新增或内容变化的文件 {path: 新指纹}, 已删除的文件列表)
+        mtime 和 size 都没变的文件直接视为未变化，不再读取内容计算哈希。
+        """
+        changed = {}
+        for path in paths:
+            entry = self.files.get(path)
+            fingerprint = file_fingerprint(path, with_hash=False)
+            if fingerprint is None:
+                continue
+            if entry and entry.get("mtime") == fingerprint["mtime"] and entry.get("size") == fingerprint["size"]:
+                continue
+            fingerprint = file_fingerprint(path)
+            if entry and entry.get("hash") == fingerprint["hash"]:
+                # 内容没变 (例如只是 touch 了一下)，只刷新 mtime
+                entry["mtime"] = fingerprint["mtime"]
+                self.refreshed[path] = {key: fingerprint[key] for key in ("mtime", "size", "hash")}
+                self._refreshed_dirty = True
+                continue
+            changed[path] = fingerprint
+
+        current = set(paths)
+        removed = [path for path in self.files if path not in current]
+        return changed, removed
@@ -0,0 +1,79 @@
+from typing import Dict, Optional
+
+import numpy as np
+
+# 支持的量化方式：int8 标量量化 (每行一个缩放系数) / binary 符号位量化 (每维 1 bit)
+QUANTIZATION_MODES = ("int8", "binary")
+
+# 默认重排倍数：第一阶段在量化码上取 k * factor 个候选，再用全精度向量精确打分
+DEFAULT_RESCORE_FACTOR = {"int8": 4, "binary": 10}
+
+# 每次转换 / 打分的行数，限制临时数组的内存
+BLOCK_ROWS = 16384
+
+# 0~255 每个字节的 1 的个数 (NumPy 1.x 没有 bitwise_count)
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def check_mode(mode: Optional[str]) -> Optional[str]:
+    if mode in (None, "", "none", "float32"):
+        return None
+    mode = mode.lower()
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"不支持的量化方式: {mode}，可选: {', '.join(QUANTIZATION_MODES)}")
+    return mode
+
+
+def quantize(vectors: np.ndarray, mode: str) -> Dict[str, np.ndarray]:
+    """
+    把 (已归一化的) float32 向量矩阵转成量化码。
+    - int8：codes = round(v / max|v| * 127)，scales = max|v| / 127，内积 ≈ scales * (codes · q)
+    - binary：按符号位打包 (np.packbits)，每个 4096 维向量只占 512 字节
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if mode == "int8":
+        max_abs = np.abs(vectors).max(axis=1) if len(vectors) else np.zeros(0, dtype=np.float32)
+        max_abs[max_abs == 0] = 1.0
+        scales = (max_abs / 127.0).astype(np.float32)
+        codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+        return {"codes": codes, "scales": scales}
+    return {"bits": np.packbits(vectors > 0, axis=1)}
+
+
+def quantize_blocks(vectors: np.ndarray, mode: str) -> Dict[str, np.ndarray]:
+    """
+    分块量化 (vectors 可以是 mmap 的段文件，不会一次性读入内存)。
+    """
+    parts = [quantize(vectors[start:start + BLOCK_ROWS], mode) for start in range(0, len(vectors), BLOCK_ROWS)]
+    if not parts:
+        return quantize(np.zeros((0, vectors.shape[1]), dtype=np.float32), mode)
+    return {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+
+
+def approximate_scores(quantized: Dict[str, np.ndarray], query: np.ndarray, mode: str) -> np.ndarray:
+    """
+    用量化码估计 (归一化) 查询与每一行的相似度，只用于第一阶段排序，数值不可与余弦相似度直接比较。
+    - int8：非对称打分，查询保持 float32
+    - binary：查询同样取符号位，按汉明距离打分 (维度 - 2 * 汉明距离)
+    """
+    if mode == "int8":
+        codes, scales = quantized["codes"], quantized["scales"]
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), BLOCK_ROWS):
+            block = codes[start:start + BLOCK_ROWS].astype(np.float32)
+            scores[start:start + len(block)] = (block @ query) * scales[start:start + len(block)]
+        return scores
+
+    bits = quantized["bits"]
+    query_bits = np.packbits(query > 0)
+    dim = len(query)
+    scores = np.empty(len(bits), dtype=np.float32)
+    for start in range(0, len(bits), BLOCK_ROWS):
+        block = bits[start:start + BLOCK_ROWS]
+        distance = _POPCOUNT[np.bitwise_xor(block, query_bits)].sum(axis=1, dtype=np.int32)
+        scores[start:start + len(block)] = dim - 2 * distance
+    return scores
+
+
+def nbytes(quantized: Dict[str, np.ndarray]) -> int:
+    return int(sum(array.nbytes for array in quantized.values()))
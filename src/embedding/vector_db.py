@@ -1,9 +1,15 @@
+import asyncio
+import copy
+import json
 import os
 import shutil
 import sys
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
 
 # 引入 LangChain 的核心库
+from chromadb.api.client import SharedSystemClient
 from langchain_chroma import Chroma
 from langchain_core.documents import Document
 from langchain_core.vectorstores import VectorStoreRetriever
@@ -12,64 +18,396 @@ from langchain_core.vectorstores import VectorStoreRetriever
 # 这里的 import 路径是为了兼顾“作为模块运行”和“直接运行脚本”
 try:
     from src.embedding.embedder import LocalEmbeddings
+    from src.embedding.cache import EmbeddingCache
+    from src.embedding.manifest import IndexManifest, assign_chunk_ids
+    from src.embedding.numpy_store import NumpyVectorStore
+    from src.embedding.quantization import check_mode
+    from src.embedding.versions import IndexVersions
+    from src.retrieval.bm25 import BM25Index
+    from src.retrieval.mmr import mmr_select, normalize_rows, relevant_candidates, tail_is_relevant
+    from src.utils.timing import StageTimer
 except ImportError:
     # 如果直接运行此文件用于测试，需要调整路径
     sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
     from src.embedding.embedder import LocalEmbeddings
+    from src.embedding.cache import EmbeddingCache
+    from src.embedding.manifest import IndexManifest, assign_chunk_ids
+    from src.embedding.numpy_store import NumpyVectorStore
+    from src.embedding.quantization import check_mode
+    from src.embedding.versions import IndexVersions
+    from src.retrieval.bm25 import BM25Index
+    from src.retrieval.mmr import mmr_select, normalize_rows, relevant_candidates, tail_is_relevant
+    from src.utils.timing import StageTimer
 
 class VectorDBManager:
     """
-    向量数据库管理器 (基于 ChromaDB)。
+    向量数据库管理器 (默认基于 ChromaDB，可切换为内存映射的 NumPy 后端)。
     负责数据的持久化存储、加载和基础检索。
+    persist_dir 是当前版本的目录：全量重建写入新的版本目录，校验通过后原子切换 (见 IndexVersions)，
+    读者在下一次检查 index_version 时自动切换到新版本。
     """
+
+    # collection_name 类似于关系型数据库的 Table Name
+    COLLECTION_NAME = "dev_docs_collection"
+    BACKENDS = ("chroma", "numpy")
     
-    def __init__(self, persist_dir: str = "./data/vector_store"):
-        self.persist_dir = persist_dir
-        self.embedding_fn = LocalEmbeddings() # 实例化本地模型连接器
+    def __init__(self, persist_dir: str = "./data/vector_store", backend: Optional[str] = None,
+                 quantization: Optional[str] = None, encoding_format: Optional[str] = None):
+        """
+        :param backend: "chroma" 或 "numpy"，默认读取环境变量 VECTOR_STORE_BACKEND (未设置时为 chroma)。
+                        切换后端需要重建索引。
+        :param quantization: 第一阶段检索使用的量化码 ("int8" / "binary")，默认读取环境变量 VECTOR_QUANTIZATION。
+                             仅 numpy 后端支持，切换无需重建 (缺少的量化码在加载时生成)。
+        :param encoding_format: Embedding 接口的传输格式 ("float" / "base64")，默认读取环境变量
+                                EMBEDDING_ENCODING_FORMAT (未设置时为 float)。
+        """
+        self.root_dir = persist_dir
+        self.versions = IndexVersions(persist_dir)
+        self.active_version, self.persist_dir = self.versions.resolve()
+        self._pinned = False # 构建中的版本固定在自己的目录，不跟随 ACTIVE
+        self.backend = (backend or os.getenv("VECTOR_STORE_BACKEND", "chroma")).lower()
+        if self.backend not in self.BACKENDS:
+            raise ValueError(f"不支持的向量库后端: {self.backend}，可选: {', '.join(self.BACKENDS)}")
+        self.quantization = check_mode(quantization or os.getenv("VECTOR_QUANTIZATION"))
+        if self.quantization and self.backend != "numpy":
+            print(f"[VectorDB] 量化检索 ({self.quantization}) 仅支持 numpy 后端，{self.backend} 后端忽略该设置。")
+            self.quantization = None
+        # Embedding 缓存放在向量库目录旁边，强制重建删除向量库时缓存仍然保留
+        cache_path = os.path.join(os.path.dirname(os.path.abspath(persist_dir)), "embedding_cache.sqlite")
+        encoding_format = (encoding_format or os.getenv("EMBEDDING_ENCODING_FORMAT", "float")).lower()
+        self.embedding_fn = LocalEmbeddings(cache=EmbeddingCache(cache_path),
+                                            encoding_format=encoding_format) # 实例化本地模型连接器
+        self._vector_store = None # 已打开的向量库实例 (进程内复用)
         
         # 确保目录存在
         if not os.path.exists(self.persist_dir):
             os.makedirs(self.persist_dir, exist_ok=True)
 
-    def create_index(self, chunks: List[Document], force_rebuild: bool = False) -> Chroma:
+    def _new_store(self):
+        """
+        按配置的后端打开 (或创建) 向量库。
+        """
+        if self.backend == "numpy":
+            return NumpyVectorStore(persist_directory=self.persist_dir, embedding_function=self.embedding_fn,
+                                    quantization=self.quantization)
+        return Chroma(
+            persist_directory=self.persist_dir,
+            embedding_function=self.embedding_fn.client,
+            collection_name=self.COLLECTION_NAME
+        )
+
+    def reset(self):
+        """
+        删除整个向量库目录 (包括所有版本)。全量重建不需要调用，见 begin_version。
+        """
+        if not os.path.exists(self.root_dir):
+            return
+        print(f"[VectorDB] 正在清理旧数据: {self.root_dir}")
+        self._vector_store = None
+        # Chroma 在进程内按目录缓存客户端 (常驻引擎也持有同一个)，
+        # 删除目录前先释放缓存，否则重建时会报 "readonly database"
+        SharedSystemClient.clear_system_cache()
+        shutil.rmtree(self.root_dir)
+        os.makedirs(self.root_dir, exist_ok=True)
+        self.active_version, self.persist_dir = self.versions.resolve()
+
+    # ==========================================
+    # 版本管理 (全量重建不影响正在服务的索引)
+    # ==========================================
+    def _follow_active(self):
+        """
+        ACTIVE 指向的版本变化 (本进程或其他进程完成了重建 / 回滚) 时切换到新版本目录。
+        已经拿到旧向量库实例的请求继续使用旧实例直到结束。
+        """
+        if self._pinned:
+            return
+        version, path = self.versions.resolve()
+        if version != self.active_version:
+            print(f"[VectorDB] 索引版本切换: {self.active_version} -> {version}")
+            self.active_version, self.persist_dir = version, path
+            self._vector_store = None
+
+    def begin_version(self) -> "VectorDBManager":
+        """
+        创建一个新的版本目录，返回写入该目录的 Manager (与当前 Manager 共用 Embedding 客户端和缓存)。
+        构建完成后调用它的 activate_version()，失败时调用 discard_version()。
+        """
+        name, path = self.versions.create()
+        staging = copy.copy(self)
+        staging.active_version, staging.persist_dir = name, path
+        staging._pinned = True
+        staging._vector_store = None
+        print(f"[VectorDB] 开始构建新版本 {name} ({self.backend})，当前版本 {self.active_version} 继续服务。")
+        return staging
+
+    def validate(self, expected_chunks: Optional[int] = None, probe: bool = True) -> dict:
+        """
+        校验 (构建完成的) 索引：片段数非零且与预期一致、清单引用的 Chunk 都存在、探测查询能检索到结果。
+        :raises ValueError: 校验失败
+        """
+        ids = self.list_ids()
+        if not ids:
+            raise ValueError(f"索引为空: {self.persist_dir}")
+        if expected_chunks is not None and len(ids) != expected_chunks:
+            raise ValueError(f"索引片段数 {len(ids)} 与预期 {expected_chunks} 不一致")
+        manifest = IndexManifest.load(self.persist_dir)
+        referenced = {chunk_id for entry in manifest.files.values() for chunk_id in entry.get("chunk_ids", [])}
+        missing = referenced - set(ids)
+        if missing:
+            raise ValueError(f"清单引用的 {len(missing)} 个片段不在索引中")
+
+        result = {"chunks": len(ids), "files": len(manifest.files), "backend": self.backend}
+        if probe:
+            # 用库中一个片段的开头作为查询，应当能检索到结果 (通常就是它自己)
+            doc = self.get_documents(ids[:1])[0]
+            docs, _ = self._query_candidates(self.embedding_fn.embed_query(doc.page_content[:200]), 10)
+            if not docs:
+                raise ValueError("探测查询没有返回任何结果")
+            result["probe_self_hit"] = any(d.metadata.get("chunk_id") == ids[0] for d in docs)
+            if not result["probe_self_hit"]:
+                print(f"⚠️ [VectorDB] 探测查询的 Top 10 中没有出现探测片段本身 ({ids[0][:12]})，请检查 Embedding 服务。")
+        return result
+
+    def activate_version(self, expected_chunks: Optional[int] = None, probe: bool = True) -> dict:
+        """
+        校验本 Manager 构建的版本并原子切换为当前版本，然后按保留策略清理旧版本。
+        校验失败时删除该版本并抛出异常，当前版本不变。
+        """
+        try:
+            result = self.validate(expected_chunks=expected_chunks, probe=probe)
+        except Exception:
+            self.versions.write_info(self.active_version, status="failed")
+            self.discard_version()
+            raise
+        self.versions.write_info(self.active_version, **result)
+        self.versions.activate(self.active_version)
+        self.versions.gc()
+        return result
+
+    def discard_version(self):
+        """
+        丢弃本 Manager 构建中的版本 (构建失败时调用)。
+        """
+        if self._pinned:
+            self._vector_store = None
+            self.versions.discard(self.active_version)
+
+    def rollback(self, version: Optional[str] = None) -> str:
+        """
+        切回旧版本 (默认为上一次启用的版本)，本进程和其他进程的读者在下一次请求时生效。
+        """
+        name = self.versions.rollback(version)
+        self._follow_active()
+        return name
+
+    def create_index(self, chunks: List[Document], force_rebuild: bool = False):
         """
         从文档块构建新的向量索引。
-        :param force_rebuild: 如果为 True，会删除旧的数据库文件重新构建。
+        :param force_rebuild: 如果为 True，在新的版本目录中重新构建，校验通过后切换，旧版本在此期间照常服务。
         """
-        if force_rebuild and os.path.exists(self.persist_dir):
-            print(f"[VectorDB] 正在清理旧数据: {self.persist_dir}")
-            shutil.rmtree(self.persist_dir)
-            os.makedirs(self.persist_dir, exist_ok=True)
+        if force_rebuild:
+            staging = self.begin_version()
+            try:
+                staging.create_index(chunks)
+            except Exception:
+                staging.discard_version()
+                raise
+            staging.activate_version(expected_chunks=len(set(assign_chunk_ids(chunks))))
+            self._follow_active()
+            return self.load_index()
 
-        print(f"[VectorDB] 开始构建索引，共 {len(chunks)} 个片段...")
+        print(f"[VectorDB] 开始构建索引 ({self.backend})，共 {len(chunks)} 个片段...")
+
+        # 使用确定性 ID，后续增量同步可以按 ID 覆盖 / 删除
+        ids = assign_chunk_ids(chunks)
         
-        # Chroma.from_documents 会自动处理 Embedding 并持久化到磁盘
-        # collection_name 类似于关系型数据库的 Table Name
-        vector_store = Chroma.from_documents(
-            documents=chunks,
-            embedding=self.embedding_fn.client, # 传入 LangChain 兼容的 client
-            persist_directory=self.persist_dir,
-            collection_name="dev_docs_collection"
-        )
+        if self.backend == "numpy":
+            # 一次写入整个语料，生成单个段文件
+            vector_store = NumpyVectorStore.from_documents(
+                documents=chunks,
+                ids=ids,
+                embedding=self.embedding_fn,
+                persist_directory=self.persist_dir
+            )
+        else:
+            # Chroma.from_documents 会自动处理 Embedding 并持久化到磁盘
+            vector_store = Chroma.from_documents(
+                documents=chunks,
+                ids=ids,
+                embedding=self.embedding_fn.client, # 传入 LangChain 兼容的 client
+                persist_directory=self.persist_dir,
+                collection_name=self.COLLECTION_NAME
+            )
+
+        self._vector_store = vector_store
+        # 在向量库旁边构建 BM25 词法索引 (混合检索使用)
+        self.refresh_lexical_index()
+
+        # 记录每个源文件产生的 Chunk，供增量同步使用
+        manifest = IndexManifest.load(self.persist_dir)
+        manifest.record_chunks(chunks, ids)
+        manifest.save()
         
         print(f"[VectorDB] 索引构建完成并保存至: {self.persist_dir}")
+        cache_stats = self.embedding_fn.cache.stats()
+        print(f"[VectorDB] Embedding 缓存: 命中 {cache_stats['hits']} / 未命中 {cache_stats['misses']} "
+              f"(命中率 {cache_stats['hit_ratio']:.1%}，缓存条目 {cache_stats['entries']})")
+        self.embedding_fn.cache.reset_stats()
         return vector_store
 
-    def load_index(self) -> Chroma:
+    def load_index(self, reload: bool = False):
         """
         加载已存在的向量数据库。
+        同一个 Manager 只打开一次向量库，后续调用直接复用，避免每次请求都从磁盘冷启动。
+        :param reload: 为 True 时丢弃缓存的实例，重新从磁盘打开。
         """
+        if self._vector_store is not None and not reload:
+            return self._vector_store
+
         if not os.path.exists(self.persist_dir) or not os.listdir(self.persist_dir):
             raise FileNotFoundError(f"向量库不存在或为空: {self.persist_dir}，请先运行构建流程。")
 
-        print(f"[VectorDB] 正在加载现有索引: {self.persist_dir}")
-        vector_store = Chroma(
-            persist_directory=self.persist_dir,
-            embedding_function=self.embedding_fn.client,
-            collection_name="dev_docs_collection"
-        )
+        print(f"[VectorDB] 正在加载现有索引 ({self.backend}): {self.persist_dir}")
+        vector_store = self._new_store()
+        self._vector_store = vector_store
         return vector_store
 
+    @property
+    def index_version(self) -> str:
+        """
+        当前索引版本号 (版本目录名 + manifest.json 的修改时间)。每次构建 / 增量同步 / 回滚都会改变，
+        下游缓存以它为 Key 的一部分，索引更新后旧缓存自然失效。
+        检查时顺带跟随 ACTIVE 切换到最新的版本目录。
+        """
+        self._follow_active()
+        manifest_path = os.path.join(self.persist_dir, IndexManifest.FILENAME)
+        try:
+            return f"{self.active_version}:{os.stat(manifest_path).st_mtime_ns}"
+        except OSError:
+            return f"{self.active_version}:0"
+
+    def _open_store(self):
+        """
+        打开向量库，不存在时自动创建 (增量写入使用，不要求索引已存在)。
+        """
+        if self._vector_store is None:
+            self._vector_store = self._new_store()
+        return self._vector_store
+
+    def upsert_chunks(self, chunks: List[Document], ids: List[str], batch_size: int = 1000):
+        """
+        按 ID 写入或覆盖 Chunk (已存在的 ID 会被更新)。
+        """
+        vector_store = self._open_store()
+        if self.backend == "numpy":
+            # NumpyVectorStore 每次写入生成一个段文件，不分批，避免产生大量小段
+            batch_size = max(len(chunks), 1)
+        for start in range(0, len(chunks), batch_size):
+            vector_store.add_documents(chunks[start:start + batch_size], ids=ids[start:start + batch_size])
+
+    def upsert_embedded(self, chunks: List[Document], ids: List[str], vectors: np.ndarray):
+        """
+        写入已经算好向量的 Chunk (流式入库使用，不再经过向量库内部的 Embedding 调用)。
+        NumpyVectorStore 在这里不自动合并段文件，写入结束后调用 compact()。
+        """
+        if not chunks:
+            return
+        texts = [chunk.page_content for chunk in chunks]
+        metadatas = [chunk.metadata for chunk in chunks]
+        vector_store = self._open_store()
+        if self.backend == "numpy":
+            vector_store.add_embeddings(texts, vectors, metadatas=metadatas, ids=ids, compact=False)
+        else:
+            vector_store._collection.upsert(
+                ids=ids, embeddings=np.asarray(vectors).tolist(), documents=texts, metadatas=metadatas
+            )
+
+    def compact(self):
+        """
+        批量写入结束后整理存储 (NumpyVectorStore 合并段文件；Chroma 无需处理)。
+        """
+        if self.backend == "numpy":
+            self._open_store().compact()
+
+    def save_lexical_index(self, index: BM25Index):
+        index.save(self.persist_dir)
+        print(f"[VectorDB] BM25 词法索引已更新: {len(index)} 个片段，{len(index.terms)} 个词项。")
+
+    def list_ids(self) -> List[str]:
+        """
+        返回向量库中所有 Chunk 的 ID。
+        """
+        return self._open_store().get(include=[])["ids"]
+
+    def get_documents_map(self, ids: List[str]) -> Dict[str, Document]:
+        """
+        按 ID 取回 Chunk {chunk_id: Document}，不存在的 ID 被跳过。
+        """
+        if not ids:
+            return {}
+        data = self._open_store().get(ids=ids, include=["documents", "metadatas"])
+        return {
+            chunk_id: Document(page_content=text, metadata=metadata or {})
+            for chunk_id, text, metadata in zip(data["ids"], data["documents"], data["metadatas"])
+        }
+
+    def get_documents(self, ids: List[str]) -> List[Document]:
+        """
+        按 ID 取回 Chunk，返回顺序与传入的 ids 一致 (不存在的 ID 被跳过)。
+        """
+        found = self.get_documents_map(ids)
+        return [found[chunk_id] for chunk_id in ids if chunk_id in found]
+
+    def update_chunk_sources(self, sources: Dict[str, List[str]]):
+        """
+        记录去重后每个 Chunk 被哪些文件引用：metadata["sources"] 写入 JSON 数组。
+        Chunk 原来的 source 文件已不再引用它时，source 改为第一个引用文件。
+        :param sources: {chunk_id: [文件路径, ...]}
+        """
+        if not sources:
+            return
+        vector_store = self._open_store()
+        data = vector_store.get(ids=list(sources), include=["metadatas"])
+        ids, metadatas = [], []
+        for chunk_id, metadata in zip(data["ids"], data["metadatas"]):
+            refs = sources[chunk_id]
+            update = {"sources": json.dumps(refs, ensure_ascii=False)}
+            if (metadata or {}).get("source") not in refs:
+                update["source"] = refs[0]
+            ids.append(chunk_id)
+            metadatas.append(update)
+        if not ids:
+            return
+        if self.backend == "numpy":
+            vector_store.update_metadata(ids, metadatas)
+        else:
+            vector_store._collection.update(ids=ids, metadatas=metadatas)
+
+    def refresh_lexical_index(self):
+        """
+        用向量库中的全部 Chunk 重建 BM25 词法索引并保存到 persist_dir。
+        """
+        data = self._open_store().get(include=["documents"])
+        self.save_lexical_index(BM25Index.build(data["ids"], data["documents"]))
+
+    def load_lexical_index(self) -> Optional[BM25Index]:
+        """
+        加载 BM25 词法索引，不存在 (旧版本构建的索引) 时返回 None。
+        """
+        return BM25Index.load(self.persist_dir)
+
+    def delete_chunks(self, ids: List[str], batch_size: int = 1000):
+        """
+        按 ID 删除 Chunk。
+        """
+        if not ids:
+            return
+        vector_store = self._open_store()
+        if self.backend == "numpy":
+            batch_size = len(ids)
+        for start in range(0, len(ids), batch_size):
+            vector_store.delete(ids=ids[start:start + batch_size])
+
     def get_retriever(self, search_type="mmr", k=5) -> VectorStoreRetriever:
         """
         获取检索器接口 (供 Chain 使用)
@@ -88,6 +426,181 @@ class VectorDBManager:
         )
         return retriever
 
+    def _query_candidates(self, embedding: List[float], n: int) -> Tuple[List[Document], np.ndarray]:
+        """
+        取与查询最相似的 n 个候选，连同它们的向量一起返回 (MMR 直接复用，不再二次查询)。
+        """
+        vector_store = self.load_index()
+        if self.backend == "numpy":
+            return vector_store.similarity_search_with_vectors(embedding, k=n)
+
+        result = vector_store._collection.query(
+            query_embeddings=[list(embedding)],
+            n_results=n,
+            include=["documents", "metadatas", "embeddings"],
+        )
+        docs = [
+            Document(page_content=text, metadata=metadata or {})
+            for text, metadata in zip(result["documents"][0], result["metadatas"][0])
+        ]
+        return docs, np.asarray(result["embeddings"][0], dtype=np.float32)
+
+    def mmr_search_by_vector(self, embedding: List[float], k: int = 5, fetch_k: Optional[int] = None,
+                             lambda_mult: float = 0.5, relevance_margin: float = 0.2,
+                             redundancy_threshold: float = 0.98, use_mmr: bool = True,
+                             timer: Optional[StageTimer] = None) -> List[Document]:
+        """
+        自适应 fetch_k 的 MMR 检索：
+        1. 先取 2k 个候选；若最后一名仍在相关区间内 (与第一名相似度差距不超过 relevance_margin)，
+           再扩大到 fetch_k (默认 4k)，否则不再多取；
+        2. 丢弃明显不相关的候选 (差距超过 relevance_margin，至少保留 k 个)；
+        3. 在剩余候选上做向量化 MMR，与已选结果相似度 >= redundancy_threshold 的候选视为重复并跳过，
+           全部重复时提前结束。
+        :param use_mmr: 为 False 时跳过 MMR，直接按相似度取前 k 个 (高负载降级)
+        :param timer: 可选的分阶段计时器，记录 vector_search / mmr 耗时和实际 fetch_k
+        """
+        timer = timer or StageTimer()
+        max_fetch = max(fetch_k or k * 4, k)
+        n = min(k * 2, max_fetch)
+        query = normalize_rows(embedding)
+
+        while True:
+            with timer.stage("vector_search"):
+                docs, vectors = self._query_candidates(embedding, n)
+            if not docs:
+                return []
+            relevance = normalize_rows(vectors) @ query
+            if n >= max_fetch or len(docs) < n or not tail_is_relevant(relevance, relevance_margin):
+                break
+            n = max_fetch
+
+        return self._select(docs, vectors, query, relevance, k, lambda_mult, relevance_margin,
+                            redundancy_threshold, use_mmr, timer)
+
+    @staticmethod
+    def _select(docs: List[Document], vectors: np.ndarray, query: np.ndarray, relevance: np.ndarray, k: int,
+                lambda_mult: float, relevance_margin: float, redundancy_threshold: float, use_mmr: bool,
+                timer: StageTimer) -> List[Document]:
+        """
+        在候选上去掉明显不相关的，再做 MMR (或直接按相似度) 选出 k 个。
+        """
+        with timer.stage("mmr"):
+            pool = relevant_candidates(relevance, k, relevance_margin)
+            if use_mmr:
+                selected = mmr_select(query, vectors[pool], k=k, lambda_mult=lambda_mult,
+                                      redundancy_threshold=redundancy_threshold)
+            else:
+                selected = list(np.argsort(-relevance[pool], kind="stable")[:k])
+        timer.note(fetch_k=len(docs), mmr_pool=len(pool), mmr_selected=len(selected))
+        results = []
+        for i in selected:
+            doc = docs[pool[i]]
+            # 保留第一阶段的余弦相似度，级联 Rerank 据此判断是否需要交叉编码器
+            doc.metadata["dense_score"] = float(relevance[pool[i]])
+            results.append(doc)
+        return results
+
+    def _query_candidates_batch(self, embeddings: List[List[float]],
+                                n: int) -> List[Tuple[List[Document], np.ndarray]]:
+        """
+        _query_candidates 的批量版本：numpy 后端一次矩阵乘法，Chroma 一次 query 调用 (query_embeddings 传多条)。
+        """
+        vector_store = self.load_index()
+        if self.backend == "numpy":
+            return vector_store.similarity_search_with_vectors_batch(embeddings, k=n)
+
+        result = vector_store._collection.query(
+            query_embeddings=[list(embedding) for embedding in embeddings],
+            n_results=n,
+            include=["documents", "metadatas", "embeddings"],
+        )
+        candidates = []
+        for texts, metadatas, vectors in zip(result["documents"], result["metadatas"], result["embeddings"]):
+            docs = [Document(page_content=text, metadata=metadata or {}) for text, metadata in zip(texts, metadatas)]
+            candidates.append((docs, np.asarray(vectors, dtype=np.float32)))
+        return candidates
+
+    def mmr_search_by_vectors(self, embeddings: List[List[float]], k: int = 5, fetch_k: Optional[int] = None,
+                              lambda_mult: float = 0.5, relevance_margin: float = 0.2,
+                              redundancy_threshold: float = 0.98,
+                              timer: Optional[StageTimer] = None) -> List[List[Document]]:
+        """
+        mmr_search_by_vector 的批量版本 (离线评测 / 批量检索使用)：
+        所有查询一次取 fetch_k (默认 4k) 个候选，再按单条检索的规则截断 (前 2k 名的最后一名已不相关时只保留前 2k 个)，
+        精确检索下结果与逐条调用一致。
+        """
+        timer = timer or StageTimer()
+        max_fetch = max(fetch_k or k * 4, k)
+        n = min(k * 2, max_fetch)
+        with timer.stage("vector_search"):
+            candidates = self._query_candidates_batch(embeddings, max_fetch)
+
+        results = []
+        for embedding, (docs, vectors) in zip(embeddings, candidates):
+            if not docs:
+                results.append([])
+                continue
+            query = normalize_rows(embedding)
+            relevance = normalize_rows(vectors) @ query
+            if len(docs) > n and not tail_is_relevant(relevance[:n], relevance_margin):
+                docs, vectors, relevance = docs[:n], vectors[:n], relevance[:n]
+            results.append(self._select(docs, vectors, query, relevance, k, lambda_mult, relevance_margin,
+                                        redundancy_threshold, True, timer))
+        return results
+
+    def get_vectors(self, ids: List[str]) -> dict:
+        """
+        按 ID 取回向量 {chunk_id: np.ndarray}，不存在的 ID 被跳过。
+        """
+        if not ids:
+            return {}
+        vector_store = self.load_index()
+        if self.backend == "numpy":
+            return vector_store.get_vectors(ids)
+        data = vector_store.get(ids=ids, include=["embeddings"])
+        return {chunk_id: np.asarray(vector, dtype=np.float32) for chunk_id, vector in zip(data["ids"], data["embeddings"])}
+
+    def attach_dense_scores(self, query: str, docs: List[Document],
+                            query_vector: Optional[List[float]] = None) -> List[Document]:
+        """
+        给缺少 dense_score 的文档 (例如只被 BM25 召回的) 补上与查询的余弦相似度。
+        查询向量此时已在 query_cache 中 (或由调用方直接传入)，不会产生额外的 Embedding 请求。
+        """
+        missing = [doc for doc in docs if "dense_score" not in doc.metadata and doc.metadata.get("chunk_id")]
+        if not missing:
+            return docs
+        query_vector = normalize_rows(self.embedding_fn.embed_query(query) if query_vector is None else query_vector)
+        vectors = self.get_vectors([doc.metadata["chunk_id"] for doc in missing])
+        for doc in missing:
+            vector = vectors.get(doc.metadata["chunk_id"])
+            if vector is not None:
+                doc.metadata["dense_score"] = float(normalize_rows(vector) @ query_vector)
+        return docs
+
+    def mmr_search(self, query: str, k: int = 5, fetch_k: Optional[int] = None,
+                   timer: Optional[StageTimer] = None, **kwargs) -> List[Document]:
+        """
+        MMR 检索 (同步)，参数见 mmr_search_by_vector。
+        """
+        timer = timer or StageTimer()
+        with timer.stage("embed_query"):
+            embedding = self.embedding_fn.embed_query(query)
+        return self.mmr_search_by_vector(embedding, k=k, fetch_k=fetch_k, timer=timer, **kwargs)
+
+    async def amax_marginal_relevance_search(self, query: str, k: int = 5, fetch_k: Optional[int] = None,
+                                             timer: Optional[StageTimer] = None, **kwargs) -> List[Document]:
+        """
+        异步 MMR 检索 (与 mmr_search 的参数一致)。
+        查询向量通过异步 HTTP 获取；向量库检索和 MMR 是本地同步计算，放到线程池执行，不阻塞事件循环。
+        """
+        timer = timer or StageTimer()
+        self.load_index()
+        with timer.stage("embed_query"):
+            embedding = await self.embedding_fn.aembed_query(query)
+        return await asyncio.to_thread(
+            self.mmr_search_by_vector, embedding, k=k, fetch_k=fetch_k, timer=timer, **kwargs
+        )
+
 # ==========================================
 # 独立执行的测试函数
 # ==========================================
@@ -0,0 +1,201 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+import uuid
+from typing import List, Optional, Tuple
+
+
+class IndexVersions:
+    """
+    向量库的版本目录布局：
+
+        <root>/versions/<版本号>/   每次全量构建一个独立目录 (向量库 + BM25 + 去重签名 + manifest.json + version.json)
+        <root>/ACTIVE              当前对外服务的版本号，原子替换 (os.replace)
+
+    构建在新目录中进行，校验通过后才切换 ACTIVE，正在服务的旧版本在构建期间不受任何影响；
+    旧版本保留若干个用于秒级回滚，超出保留数的按策略清理。
+    没有 ACTIVE 文件但根目录下直接有索引文件 (旧版本的布局) 时，根目录本身视为当前版本 "legacy"。
+    """
+
+    VERSIONS_DIR = "versions"
+    ACTIVE_FILE = "ACTIVE"
+    INFO_FILE = "version.json"
+    LEGACY = "legacy"
+
+    def __init__(self, root: str, keep: Optional[int] = None):
+        """
+        :param root: 向量库根目录
+        :param keep: 保留的已就绪版本数 (含当前版本)，默认读取环境变量 INDEX_KEEP_VERSIONS (未设置时为 3)
+        """
+        self.root = root
+        self.keep = int(os.getenv("INDEX_KEEP_VERSIONS", "3")) if keep is None else keep
+        self.versions_dir = os.path.join(root, self.VERSIONS_DIR)
+        self.active_path = os.path.join(root, self.ACTIVE_FILE)
+
+    def path(self, name: str) -> str:
+        return self.root if name == self.LEGACY else os.path.join(self.versions_dir, name)
+
+    # ==========================================
+    # 当前版本
+    # ==========================================
+    def active(self) -> Optional[str]:
+        try:
+            with open(self.active_path, "r", encoding="utf-8") as f:
+                name = f.read().strip()
+        except OSError:
+            return None
+        return name if name and os.path.isdir(self.path(name)) else None
+
+    def resolve(self) -> Tuple[str, str]:
+        """
+        :return: (当前版本号, 当前版本目录)。从未构建过时返回根目录 (按旧布局直接写入)
+        """
+        name = self.active()
+        if name is None:
+            return self.LEGACY, self.root
+        return name, self.path(name)
+
+    def _write_active(self, name: str):
+        tmp_path = f"{self.active_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(name)
+        os.replace(tmp_path, self.active_path)
+
+    # ==========================================
+    # 版本信息
+    # ==========================================
+    def read_info(self, name: str) -> dict:
+        try:
+            with open(os.path.join(self.path(name), self.INFO_FILE), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def write_info(self, name: str, **updates) -> dict:
+        info = {**self.read_info(name), **updates}
+        path = os.path.join(self.path(name), self.INFO_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(info, f, ensure_ascii=False, indent=2)
+        os.replace(path + ".tmp", path)
+        return info
+
+    def names(self) -> List[str]:
+        if not os.path.isdir(self.versions_dir):
+            return []
+        return sorted(name for name in os.listdir(self.versions_dir)
+                      if os.path.isdir(os.path.join(self.versions_dir, name)))
+
+    def list(self) -> List[dict]:
+        active = self.active()
+        rows = []
+        for name in self.names():
+            rows.append({"name": name, "active": name == active, **self.read_info(name)})
+        return rows
+
+    # ==========================================
+    # 构建 / 切换 / 回滚 / 清理
+    # ==========================================
+    def create(self) -> Tuple[str, str]:
+        """
+        创建一个新的 (构建中的) 版本目录。
+        """
+        name = time.strftime("v%Y%m%d-%H%M%S") + f"-{uuid.uuid4().hex[:6]}"
+        path = self.path(name)
+        os.makedirs(path)
+        self.write_info(name, status="building", pid=os.getpid(), created=time.time())
+        return name, path
+
+    def activate(self, name: str):
+        """
+        原子切换当前版本：读者在下一次请求时看到新版本，进行中的请求继续使用旧版本直到结束。
+        """
+        self.write_info(name, status="ready", activated=time.time())
+        previous = self.active()
+        self._write_active(name)
+        print(f"[IndexVersions] 当前版本: {previous or self.LEGACY} -> {name}")
+
+    def rollback(self, name: Optional[str] = None) -> str:
+        """
+        切回指定版本，默认切回当前版本之前最近一次启用的版本。
+        """
+        active = self.active()
+        if name is None:
+            candidates = [row for row in self.list()
+                          if row.get("status") == "ready" and row["name"] != active and row.get("activated")]
+            if not candidates:
+                raise ValueError("没有可以回滚的旧版本")
+            name = max(candidates, key=lambda row: row["activated"])["name"]
+        elif self.read_info(name).get("status") != "ready":
+            raise ValueError(f"版本 {name} 不存在或未通过校验")
+        self.activate(name)
+        return name
+
+    def discard(self, name: str):
+        if name != self.LEGACY and name != self.active():
+            shutil.rmtree(self.path(name), ignore_errors=True)
+
+    @staticmethod
+    def _pid_alive(pid) -> bool:
+        try:
+            os.kill(int(pid), 0)
+        except (OSError, TypeError, ValueError):
+            return False
+        return True
+
+    def gc(self, keep: Optional[int] = None) -> List[str]:
+        """
+        清理旧版本：保留当前版本和最近启用的 keep - 1 个就绪版本，
+        删除更早的版本、校验失败的版本以及构建进程已经不存在的残留目录。
+        :return: 被删除的版本号
+        """
+        keep = self.keep if keep is None else keep
+        active = self.active()
+        ready, removed = [], []
+        for row in self.list():
+            name, status = row["name"], row.get("status")
+            if name == active:
+                continue
+            if status == "ready":
+                ready.append(row)
+            elif status != "building" or not self._pid_alive(row.get("pid")):
+                removed.append(name)
+        ready.sort(key=lambda row: row.get("activated") or row.get("created") or 0, reverse=True)
+        removed += [row["name"] for row in ready[max(keep - 1, 0):]]
+        for name in removed:
+            shutil.rmtree(self.path(name), ignore_errors=True)
+        if removed:
+            print(f"[IndexVersions] 已清理 {len(removed)} 个旧版本: {', '.join(removed)}")
+        return removed
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="向量库版本管理 (查看 / 回滚 / 清理)")
+    parser.add_argument("--root", default="./data/vector_store", help="向量库根目录")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="列出所有版本")
+    rollback = sub.add_parser("rollback", help="切回旧版本")
+    rollback.add_argument("name", nargs="?", help="版本号 (默认为上一次启用的版本)")
+    gc = sub.add_parser("gc", help="清理旧版本")
+    gc.add_argument("--keep", type=int, help="保留的就绪版本数 (含当前版本)")
+    args = parser.parse_args(argv)
+
+    versions = IndexVersions(args.root)
+    if args.command == "list":
+        for row in versions.list():
+            flag = "*" if row["active"] else " "
+            created = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(row.get("created", 0)))
+            print(f"{flag} {row['name']}  {row.get('status', '?'):>8}  {row.get('chunks', '-'):>6} 个片段  "
+                  f"{row.get('backend', '-'):>6}  创建于 {created}")
+        if versions.active() is None:
+            print("  (尚未启用任何版本，根目录按旧布局使用)")
+    elif args.command == "rollback":
+        versions.rollback(args.name)
+    else:
+        versions.gc(args.keep)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,6 +2,12 @@ import re
 from langchain_core.documents import Document
 from typing import List
 
+# 预编译正则 (每个进程只编译一次)
+# 不可见的特殊字符 (保留换行符)
+_CONTROL_CHARS = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]')
+# 连续的多余空行
+_EXTRA_BLANK_LINES = re.compile(r'\n{3,}')
+
 class DataCleaner:
     """
     负责清洗原始文档内容，移除无用字符和特定噪音。
@@ -13,10 +19,10 @@ class DataCleaner:
         清洗纯文本内容
         """
         # 1. 移除不可见的特殊字符 (保留换行符)
-        text = re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]', '', text)
+        text = _CONTROL_CHARS.sub('', text)
         
         # 2. 移除连续的多余空行 (超过3行变2行，保留段落感但压缩空间)
-        text = re.sub(r'\n{3,}', '\n\n', text)
+        text = _EXTRA_BLANK_LINES.sub('\n\n', text)
         
         # 3. 移除常见的文档生成器噪音 (根据你的实际文档情况调整)
         # 例如: "Edit on GitHub", "Last updated on..."
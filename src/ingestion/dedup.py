@@ -0,0 +1,248 @@
+import hashlib
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+_WHITESPACE = re.compile(r"\s+")
+
+# 字符 Shingle 的滚动哈希基数 (64 位无符号整数自然溢出即取模 2^64)
+_SHINGLE_BASE = np.uint64(1_000_003)
+
+
+def normalize_chunk_text(text: str) -> str:
+    """
+    去重用的文本规范化：小写 + 合并空白。
+    """
+    return _WHITESPACE.sub(" ", text.lower()).strip()
+
+
+class MinHasher:
+    """
+    基于字符 Shingle 的 MinHash 签名 (NumPy 向量化)。
+    字符 Shingle 对中英文都适用 (中文没有空格分词)，哈希函数由固定种子生成，
+    签名在不同进程 / 不同次运行之间保持一致，可以持久化。
+    """
+
+    def __init__(self, num_perm: int = 64, shingle_size: int = 5, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        # 乘法-移位哈希族：h(x) = (a * x + b) >> 32，a 取奇数
+        self._a = (rng.randint(1, 2 ** 31, size=num_perm).astype(np.uint64) << np.uint64(32)) | \
+            rng.randint(0, 2 ** 31, size=num_perm).astype(np.uint64) | np.uint64(1)
+        self._b = (rng.randint(0, 2 ** 31, size=num_perm).astype(np.uint64) << np.uint64(32)) | \
+            rng.randint(0, 2 ** 31, size=num_perm).astype(np.uint64)
+
+    def _shingles(self, text: str) -> np.ndarray:
+        codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        n = len(codes) - self.shingle_size + 1
+        if n <= 0:
+            return codes if len(codes) else np.zeros(0, dtype=np.uint64)
+        hashes = np.zeros(n, dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            for offset in range(self.shingle_size):
+                hashes = hashes * _SHINGLE_BASE + codes[offset:offset + n]
+        return np.unique(hashes)
+
+    def signature(self, normalized_text: str) -> np.ndarray:
+        shingles = self._shingles(normalized_text)
+        if len(shingles) == 0:
+            return np.full(self.num_perm, np.iinfo(np.uint32).max, dtype=np.uint32)
+        with np.errstate(over="ignore"):
+            permuted = (shingles[:, None] * self._a[None, :] + self._b[None, :]) >> np.uint64(32)
+        return permuted.min(axis=0).astype(np.uint32)
+
+
+class ChunkDeduplicator:
+    """
+    入库时的 Chunk 去重：完全相同 (规范化后) 的文本按哈希合并，近似重复的文本用 MinHash + LSH 分桶找候选，
+    估计的 Jaccard 相似度 >= threshold 时合并到先出现的 Chunk (canonical)。
+    近似重复只在不同文件之间合并 (同一文件内的相似片段通常是表格的不同行，合并会丢信息)。
+    只有 canonical Chunk 会被 Embedding 和写入向量库，重复 Chunk 所在的文件在清单中指向 canonical ID。
+
+    签名可以保存到向量库目录 (dedup_index.npz)，增量同步时新 Chunk 也能与库中已有 Chunk 比较。
+    """
+
+    FILENAME = "dedup_index.npz"
+
+    def __init__(self, threshold: float = 0.85, num_perm: int = 64, bands: int = 8, shingle_size: int = 5):
+        """
+        :param threshold: 判定为近似重复的 Jaccard 相似度下限
+        :param num_perm: MinHash 签名长度
+        :param bands: LSH 分段数 (每段 num_perm / bands 行)，段数越多召回越高、候选越多
+        :param shingle_size: 字符 Shingle 长度
+        """
+        if num_perm % bands:
+            raise ValueError("num_perm 必须能被 bands 整除")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm=num_perm, shingle_size=shingle_size)
+
+        self._ids: List[str] = []
+        self._signatures: List[np.ndarray] = []
+        self._index_of: Dict[str, int] = {}
+        self._by_hash: Dict[str, str] = {}
+        self._hash_of: Dict[str, str] = {}
+        self._source_of: Dict[str, str] = {}
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+
+        self.seen = 0
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+
+    def __len__(self) -> int:
+        return len(self._index_of)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[b * self.rows:(b + 1) * self.rows].tobytes() for b in range(self.bands)]
+
+    def _register(self, chunk_id: str, text_hash: str, signature: np.ndarray, source: str):
+        index = len(self._ids)
+        self._ids.append(chunk_id)
+        self._signatures.append(signature)
+        self._index_of[chunk_id] = index
+        self._by_hash.setdefault(text_hash, chunk_id)
+        self._hash_of[chunk_id] = text_hash
+        self._source_of[chunk_id] = source
+        for bucket, key in zip(self._buckets, self._band_keys(signature)):
+            bucket.setdefault(key, []).append(index)
+
+    def _find_near(self, signature: np.ndarray, source: str) -> Optional[str]:
+        candidates = set()
+        for bucket, key in zip(self._buckets, self._band_keys(signature)):
+            candidates.update(bucket.get(key, ()))
+        best, best_score = None, self.threshold
+        for index in sorted(candidates):
+            chunk_id = self._ids[index]
+            if self._index_of.get(chunk_id) != index:
+                # 已移除或已被同 ID 的新条目取代
+                continue
+            if source and self._source_of.get(chunk_id) == source:
+                continue
+            score = float(np.mean(self._signatures[index] == signature))
+            if score >= best_score:
+                best, best_score = chunk_id, score
+        return best
+
+    def add(self, chunk_id: str, text: str, source: str = "") -> Optional[str]:
+        """
+        登记一个 Chunk。
+        :param source: Chunk 所在的文件
+        :return: 与已有 Chunk 重复时返回 canonical Chunk 的 ID，否则返回 None (该 Chunk 成为新的 canonical)
+        """
+        self.seen += 1
+        normalized = normalize_chunk_text(text)
+        text_hash = hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+        canonical = self._by_hash.get(text_hash)
+        if canonical is not None:
+            if canonical != chunk_id:
+                self.exact_duplicates += 1
+            return canonical
+
+        signature = self.hasher.signature(normalized)
+        canonical = self._find_near(signature, source)
+        if canonical is not None:
+            self.near_duplicates += 1
+            return canonical
+
+        self._register(chunk_id, text_hash, signature, source)
+        return None
+
+    def remove(self, chunk_ids):
+        """
+        从索引中移除 Chunk (增量同步删除过期 Chunk 后调用)。
+        """
+        for chunk_id in chunk_ids:
+            if self._index_of.pop(chunk_id, None) is not None:
+                text_hash = self._hash_of.pop(chunk_id)
+                self._source_of.pop(chunk_id, None)
+                if self._by_hash.get(text_hash) == chunk_id:
+                    del self._by_hash[text_hash]
+
+    @property
+    def saved(self) -> int:
+        return self.exact_duplicates + self.near_duplicates
+
+    def stats(self) -> dict:
+        return {
+            "chunks": self.seen,
+            "unique": self.seen - self.saved,
+            "exact_duplicates": self.exact_duplicates,
+            "near_duplicates": self.near_duplicates,
+            "embeddings_saved": self.saved,
+        }
+
+    def reset_stats(self):
+        self.seen = self.exact_duplicates = self.near_duplicates = 0
+
+    # ==========================================
+    # 持久化
+    # ==========================================
+    def save(self, persist_dir: str):
+        alive = sorted(self._index_of.values())
+        signatures = np.stack([self._signatures[i] for i in alive]) if alive else \
+            np.zeros((0, self.hasher.num_perm), dtype=np.uint32)
+        path = os.path.join(persist_dir, self.FILENAME)
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            ids=np.array([self._ids[i] for i in alive], dtype=str),
+            hashes=np.array([self._hash_of[self._ids[i]] for i in alive], dtype=str),
+            sources=np.array([self._source_of[self._ids[i]] for i in alive], dtype=str),
+            signatures=signatures,
+            config=np.array([self.threshold, self.hasher.num_perm, self.bands, self.hasher.shingle_size]),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, persist_dir: str, **kwargs) -> Optional["ChunkDeduplicator"]:
+        """
+        加载已保存的签名，不存在或参数不一致 (签名不可比较) 时返回 None。
+        """
+        path = os.path.join(persist_dir, cls.FILENAME)
+        if not os.path.exists(path):
+            return None
+        dedup = cls(**kwargs)
+        with np.load(path) as data:
+            _, num_perm, bands, shingle_size = data["config"]
+            if (int(num_perm), int(bands), int(shingle_size)) != \
+                    (dedup.hasher.num_perm, dedup.bands, dedup.hasher.shingle_size):
+                return None
+            for chunk_id, text_hash, source, signature in zip(data["ids"], data["hashes"], data["sources"],
+                                                              data["signatures"]):
+                dedup._register(str(chunk_id), str(text_hash), signature, str(source))
+        return dedup
+
+
+def sources_by_chunk(ids_by_source: Dict[str, List[str]]) -> Dict[str, List[str]]:
+    """
+    把 {文件: [chunk_id]} 反转成 {chunk_id: [引用它的文件...]} (按文件路径排序)。
+    """
+    sources: Dict[str, List[str]] = {}
+    for source in sorted(ids_by_source):
+        for chunk_id in ids_by_source[source]:
+            refs = sources.setdefault(chunk_id, [])
+            if source not in refs:
+                refs.append(source)
+    return sources
+
+
+def deduplicate(chunks: List[Document], ids: List[str],
+                dedup: ChunkDeduplicator) -> Tuple[List[Document], List[str], Dict[str, List[str]]]:
+    """
+    对一组已分配 ID 的 Chunk 去重。
+    :return: (需要写入的 canonical Chunk, 它们的 ID, {文件: [chunk_id]}，重复 Chunk 记为 canonical ID)
+    """
+    unique_chunks, unique_ids, ids_by_source = [], [], {}
+    for chunk, chunk_id in zip(chunks, ids):
+        source = str(chunk.metadata.get("source", ""))
+        canonical = dedup.add(chunk_id, chunk.page_content, source)
+        ids_by_source.setdefault(source, []).append(canonical or chunk_id)
+        if canonical is None:
+            unique_chunks.append(chunk)
+            unique_ids.append(chunk_id)
+    return unique_chunks, unique_ids, ids_by_source
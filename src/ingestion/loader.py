@@ -1,4 +1,5 @@
 import os
+from pathlib import Path
 from typing import List
 from langchain_community.document_loaders import DirectoryLoader, TextLoader
 from langchain_core.documents import Document
@@ -46,4 +47,23 @@ class DocLoader:
         valid_docs = [doc for doc in docs if doc.page_content and len(doc.page_content.strip()) > 0]
         
         print(f"[Loader] 成功加载 {len(valid_docs)} 个文档文件 (已过滤空文件)。")
-        return valid_docs
\ No newline at end of file
+        return valid_docs
+
+    def list_files(self) -> List[str]:
+        """
+        列出目录下所有 Markdown 文件 (路径格式与 DirectoryLoader 生成的 source 一致)。
+        """
+        if not os.path.exists(self.data_dir):
+            raise FileNotFoundError(f"目录不存在: {self.data_dir}")
+        return sorted(str(p) for p in Path(self.data_dir).glob("**/*.md") if p.is_file())
+
+    def load_file(self, path: str) -> List[Document]:
+        """
+        加载单个文件，读取失败时跳过 (返回空列表)。
+        """
+        try:
+            docs = TextLoader(path, autodetect_encoding=True).load()
+        except Exception as e:
+            print(f"⚠️ [Loader] 跳过无法读取的文件 {path}: {e}")
+            return []
+        return [doc for doc in docs if doc.page_content and len(doc.page_content.strip()) > 0]
@@ -0,0 +1,111 @@
+import multiprocessing
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+# 确保能找到其他模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from src.ingestion.loader import DocLoader
+from src.ingestion.cleaner import DataCleaner
+from src.ingestion.splitter import HybridSplitter
+from src.embedding.manifest import assign_chunk_ids
+
+# 每个 Worker 进程各自持有一份 Loader / Splitter，初始化一次后处理所有分到的文件
+_worker_loader: Optional[DocLoader] = None
+_worker_splitter: Optional[HybridSplitter] = None
+
+
+def _init_worker(data_dir: str, chunk_size: int, chunk_overlap: int):
+    global _worker_loader, _worker_splitter
+    _worker_loader = DocLoader(data_dir)
+    _worker_splitter = HybridSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+
+def split_file_documents(docs: List[Document], splitter: HybridSplitter) -> List[Document]:
+    """
+    清洗 -> 分块 -> 分配 Chunk ID (单个文件加载出的文档，串行和并行模式共用)。
+    """
+    chunks = []
+    for doc in DataCleaner.clean_documents(docs):
+        chunks.extend(splitter.split_document(doc))
+    # 同一文件的 Chunk 一次性分配 ID (ID 依赖文件内序号)
+    assign_chunk_ids(chunks)
+    return chunks
+
+
+def process_file(path: str, loader: DocLoader, splitter: HybridSplitter) -> List[Document]:
+    """
+    加载单个文件并清洗、分块。
+    """
+    return split_file_documents(loader.load_file(path), splitter)
+
+
+def _process_file_in_worker(path: str) -> Tuple[str, List[Document]]:
+    return path, process_file(path, _worker_loader, _worker_splitter)
+
+
+def default_workers(n_files: int, min_files_per_worker: int = 100) -> int:
+    """
+    根据文件数和可用 CPU 决定 Worker 数：文件很少时进程启动开销不划算，直接串行。
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    return max(1, min(cpus, n_files // min_files_per_worker))
+
+
+def iter_processed_files(paths: Iterable[str], data_dir: str, splitter: Optional[HybridSplitter] = None,
+                         workers: int = 1, window: Optional[int] = None) -> Iterator[Tuple[str, List[Document]]]:
+    """
+    按输入顺序逐个产出 (文件路径, Chunk 列表)。
+    workers > 1 时把文件分发到进程池，用滑动窗口限制在途任务数 (默认 4 * workers)：
+    结果始终按提交顺序取回，输出顺序与串行模式完全一致，且不会因为消费慢而在内存中堆积。
+    """
+    splitter = splitter or HybridSplitter()
+    if workers <= 1:
+        loader = DocLoader(data_dir)
+        for path in paths:
+            yield path, process_file(path, loader, splitter)
+        return
+
+    window = window or workers * 4
+    # 使用 spawn：调用方 (Gradio / 流水线) 通常已经启动了其他线程，fork 不安全
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(data_dir, splitter.chunk_size, splitter.chunk_overlap),
+    ) as pool:
+        pending = deque()
+        try:
+            for path in paths:
+                pending.append(pool.submit(_process_file_in_worker, path))
+                if len(pending) >= window:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # 调用方提前关闭生成器 (取消 / 出错) 时取消尚未开始的任务，退出进程池时只等待正在处理的文件
+            for future in pending:
+                future.cancel()
+
+
+def clean_and_split(paths: List[str], data_dir: str, splitter: Optional[HybridSplitter] = None,
+                    workers: Optional[int] = None) -> List[Document]:
+    """
+    对一组文件执行清洗 + 分块 (可并行)，返回按文件顺序排列的全部 Chunk (已带 chunk_id)。
+    :param workers: Worker 进程数，None 表示按文件数和 CPU 数自动选择
+    """
+    workers = default_workers(len(paths)) if workers is None else workers
+    chunks = []
+    for _, file_chunks in iter_processed_files(paths, data_dir, splitter=splitter, workers=workers):
+        chunks.extend(file_chunks)
+    print(f"[Splitter] 处理完成 ({workers} 个进程)。{len(paths)} 个文件 -> {len(chunks)} 个 Chunk。")
+    return chunks
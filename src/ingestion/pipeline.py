@@ -0,0 +1,315 @@
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from typing import Iterator, List, Optional
+
+import numpy as np
+
+# 确保能找到其他模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from src.ingestion.loader import DocLoader
+from src.ingestion.splitter import HybridSplitter
+from src.ingestion.parallel import default_workers, iter_processed_files, split_file_documents
+from src.ingestion.dedup import ChunkDeduplicator, sources_by_chunk
+from src.embedding.manifest import IndexManifest
+from src.embedding.vector_db import VectorDBManager
+from src.retrieval.bm25 import BM25Builder
+from src.utils.metrics import ERRORS, INGEST_ITEMS, INGEST_SECONDS
+
+_DONE = object()
+
+
+class IngestionPipeline:
+    """
+    流式全量入库：加载 -> 清洗 + 分块 -> Embedding -> 写入向量库，四个阶段各占一个线程，
+    之间用有界队列连接，按固定大小的 Batch 流动。
+
+    - 任意时刻每个队列最多只有 queue_size 个 Batch，文本和向量不会整体驻留内存
+      (随语料增长的只有 BM25 倒排表和 Chunk ID 清单)；
+    - 分块在 CPU 上进行的同时，GPU 已经在算上一个 Batch 的向量；
+    - run() 是生成器，按 report_interval 产出实时进度 (docs/s、chunks/s、Embedding 延迟)；
+    - workers > 1 时加载 + 清洗 + 分块改由进程池按文件分片执行，结果按文件顺序取回，
+      Chunk 顺序和 ID 与单进程模式完全一致；
+    - 分块之后、Embedding 之前做去重 (见 ChunkDeduplicator)，重复 Chunk 不再计算向量，
+      只在 canonical Chunk 的 metadata["sources"] 中记录所有引用它的文件。
+    """
+
+    def __init__(self, doc_path: str, db_manager: Optional[VectorDBManager] = None,
+                 splitter: Optional[HybridSplitter] = None, batch_size: int = 256,
+                 queue_size: int = 4, report_interval: float = 1.0, workers: Optional[int] = None,
+                 dedup: bool = True, dedup_threshold: float = 0.85):
+        """
+        :param batch_size: 每个 Embedding / 写入 Batch 的 Chunk 数
+        :param queue_size: 每个阶段之间最多排队的 Batch 数 (决定内存上限)
+        :param report_interval: 进度产出间隔 (秒)
+        :param workers: 清洗 + 分块的进程数，None 表示按文件数和 CPU 数自动选择，1 表示单进程
+        :param dedup: 是否合并完全重复和近似重复的 Chunk
+        :param dedup_threshold: 近似重复的 Jaccard 相似度阈值
+        """
+        self.doc_path = doc_path
+        self.db_manager = db_manager or VectorDBManager()
+        self.splitter = splitter or HybridSplitter()
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.report_interval = report_interval
+        self.workers = workers
+        self.dedup = dedup
+        self.dedup_threshold = dedup_threshold
+
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._errors: List[BaseException] = []
+        self._embed_latencies = deque(maxlen=50)
+        self._deduplicator: Optional[ChunkDeduplicator] = None
+        self._target: Optional[VectorDBManager] = None # 本次写入的 Manager (全量重建时是新的版本目录)
+        self.progress = {}
+
+    # ==========================================
+    # 队列工具 (出错时能及时退出，不会卡在阻塞的 put / get 上)
+    # ==========================================
+    def _put(self, q: queue.Queue, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.2)
+                return
+            except queue.Full:
+                continue
+
+    def _iter(self, q: queue.Queue):
+        while not self._stop.is_set():
+            try:
+                item = q.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            if item is _DONE:
+                return
+            yield item
+
+    def _stage(self, target, *args):
+        def run():
+            try:
+                target(*args)
+            except BaseException as e:
+                ERRORS.inc(component=f"ingestion{target.__name__.replace('_stage', '')}")
+                self._errors.append(e)
+                self._stop.set()
+        thread = threading.Thread(target=run, name=target.__name__, daemon=True)
+        thread.start()
+        return thread
+
+    # ==========================================
+    # 各阶段
+    # ==========================================
+    def _load_stage(self, files: List[str], loader: DocLoader, out: queue.Queue):
+        for path in files:
+            if self._stop.is_set():
+                return
+            start = time.perf_counter()
+            docs = loader.load_file(path)
+            INGEST_SECONDS.observe(time.perf_counter() - start, stage="load")
+            self._put(out, (path, docs))
+            self.progress["docs_loaded"] += 1
+            INGEST_ITEMS.inc(stage="load")
+        self._put(out, _DONE)
+
+    def _split_stage(self, inp: queue.Queue, out: queue.Queue, bm25: BM25Builder, ids_by_source: dict):
+        def processed():
+            for path, docs in self._iter(inp):
+                start = time.perf_counter()
+                chunks = split_file_documents(docs, self.splitter)
+                INGEST_SECONDS.observe(time.perf_counter() - start, stage="split")
+                yield path, chunks
+        self._batch_chunks(processed(), out, bm25, ids_by_source)
+
+    def _parallel_stage(self, files: List[str], workers: int, out: queue.Queue,
+                        bm25: BM25Builder, ids_by_source: dict):
+        def processed():
+            results = iter_processed_files(files, self.doc_path, splitter=self.splitter, workers=workers)
+            try:
+                for path, chunks in results:
+                    if self._stop.is_set():
+                        return
+                    self.progress["docs_loaded"] += 1
+                    INGEST_ITEMS.inc(stage="load")
+                    yield path, chunks
+            finally:
+                # 停止时立即关闭进程池 (取消排队中的文件)，而不是等到生成器被回收
+                results.close()
+        self._batch_chunks(processed(), out, bm25, ids_by_source)
+
+    def _batch_chunks(self, processed, out: queue.Queue, bm25: BM25Builder, ids_by_source: dict):
+        """
+        把逐文件产出的 Chunk (已带 chunk_id) 去重后记入 BM25 和清单，并按 batch_size 切成 Batch 送往下游。
+        重复 Chunk 在清单中记为 canonical Chunk 的 ID，不进入 BM25 和 Embedding。
+        """
+        batch = []
+        for path, chunks in processed:
+            # 没有产生 Chunk 的文件也记入清单，避免增量同步时每次都被当成新文件
+            ids_by_source.setdefault(path, [])
+            for chunk in chunks:
+                chunk_id = chunk.metadata["chunk_id"]
+                source = str(chunk.metadata.get("source", ""))
+                canonical = self._deduplicator.add(chunk_id, chunk.page_content, source) if self._deduplicator is not None else None
+                ids_by_source.setdefault(source, []).append(canonical or chunk_id)
+                if canonical is not None:
+                    self.progress["chunks_deduped"] += 1
+                    continue
+                bm25.add(chunk_id, chunk.page_content)
+                batch.append((chunk, chunk_id))
+            self.progress["chunks_split"] += len(chunks)
+            INGEST_ITEMS.inc(len(chunks), stage="split")
+            while len(batch) >= self.batch_size:
+                self._put(out, batch[:self.batch_size])
+                batch = batch[self.batch_size:]
+        if batch:
+            self._put(out, batch)
+        self._put(out, _DONE)
+
+    def _embed_stage(self, inp: queue.Queue, out: queue.Queue):
+        embedding_fn = self.db_manager.embedding_fn
+        for batch in self._iter(inp):
+            start = time.perf_counter()
+            vectors = embedding_fn.embed_documents_array([chunk.page_content for chunk, _ in batch])
+            elapsed = time.perf_counter() - start
+            self._embed_latencies.append(elapsed * 1000)
+            INGEST_SECONDS.observe(elapsed, stage="embed")
+            self.progress["chunks_embedded"] += len(batch)
+            INGEST_ITEMS.inc(len(batch), stage="embed")
+            self._put(out, (batch, vectors))
+        self._put(out, _DONE)
+
+    def _write_stage(self, inp: queue.Queue):
+        for batch, vectors in self._iter(inp):
+            chunks = [chunk for chunk, _ in batch]
+            ids = [chunk_id for _, chunk_id in batch]
+            start = time.perf_counter()
+            self._target.upsert_embedded(chunks, ids, vectors)
+            INGEST_SECONDS.observe(time.perf_counter() - start, stage="write")
+            self.progress["chunks_written"] += len(batch)
+            INGEST_ITEMS.inc(len(batch), stage="write")
+
+    # ==========================================
+    # 进度
+    # ==========================================
+    def _snapshot(self, started: float, queues) -> dict:
+        elapsed = max(time.perf_counter() - started, 1e-6)
+        latencies = list(self._embed_latencies)
+        snapshot = dict(self.progress)
+        snapshot.update({
+            "elapsed_s": elapsed,
+            "docs_per_s": self.progress["docs_loaded"] / elapsed,
+            "chunks_per_s": self.progress["chunks_written"] / elapsed,
+            "embed_ms_avg": float(np.mean(latencies)) if latencies else 0.0,
+            "embed_ms_p95": float(np.percentile(latencies, 95)) if latencies else 0.0,
+            "queue_depth": [q.qsize() for q in queues],
+        })
+        return snapshot
+
+    @staticmethod
+    def format_progress(snapshot: dict) -> str:
+        """
+        把进度快照格式化成 UI 上显示的状态文本。
+        """
+        head = "✅ 索引重建完成" if snapshot.get("done") else "⏳ 正在流式构建索引"
+        if snapshot.get("version"):
+            head += f"，已切换到版本 {snapshot['version']}"
+        return (
+            f"{head} ({snapshot['elapsed_s']:.0f}s)\n"
+            f"📂 文档 {snapshot['docs_loaded']}/{snapshot['docs_total']} ({snapshot['docs_per_s']:.1f} docs/s)\n"
+            f"✂️ 分块 {snapshot['chunks_split']}  🧠 向量化 {snapshot['chunks_embedded']}  "
+            f"💾 写入 {snapshot['chunks_written']} ({snapshot['chunks_per_s']:.1f} chunks/s)\n"
+            f"♻️ 去重 {snapshot['chunks_deduped']} 个重复片段 (节省 {snapshot['chunks_deduped']} 次 Embedding)\n"
+            f"⏱️ Embedding 每批 {snapshot['embed_ms_avg']:.0f} ms (p95 {snapshot['embed_ms_p95']:.0f} ms)"
+        )
+
+    def run(self, force_rebuild: bool = True) -> Iterator[dict]:
+        """
+        执行全量入库，边执行边产出进度快照，最后一个快照带 done=True。
+        force_rebuild 时写入新的版本目录，校验通过后原子切换 (见 VectorDBManager.begin_version)，
+        构建期间旧索引照常服务，构建失败或中途取消时新目录被删除，当前版本不变。
+        """
+        loader = DocLoader(self.doc_path)
+        files = loader.list_files()
+        self._target = self.db_manager.begin_version() if force_rebuild else self.db_manager
+        try:
+            yield from self._run(loader, files)
+        except BaseException:
+            # 出错或调用方关闭生成器 (取消)：先让各阶段线程退出，确认不再写入新版本目录后再删除它
+            self._shutdown()
+            self._target.discard_version()
+            raise
+        finally:
+            self._target = None
+
+    def _shutdown(self):
+        """
+        通知各阶段停止并等待线程退出 (正在进行的 Embedding / 写入 Batch 会先完成)。
+        """
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self, loader: DocLoader, files: List[str]) -> Iterator[dict]:
+        target = self._target
+        self._stop.clear()
+        self._errors = []
+
+        self.progress = {"docs_total": len(files), "docs_loaded": 0, "chunks_split": 0, "chunks_deduped": 0,
+                         "chunks_embedded": 0, "chunks_written": 0}
+        self._deduplicator = ChunkDeduplicator(threshold=self.dedup_threshold) if self.dedup else None
+        bm25 = BM25Builder()
+        ids_by_source = {}
+        q_docs, q_chunks, q_vectors = (queue.Queue(maxsize=self.queue_size) for _ in range(3))
+
+        workers = default_workers(len(files)) if self.workers is None else self.workers
+        print(f"[Pipeline] 开始流式入库: {len(files)} 个文件，batch_size={self.batch_size}，"
+              f"queue_size={self.queue_size}，workers={workers}")
+        started = time.perf_counter()
+        if workers > 1:
+            # 进程池内部已经按文件流水线化，加载和分块合并为一个阶段
+            self._threads = [self._stage(self._parallel_stage, files, workers, q_chunks, bm25, ids_by_source)]
+        else:
+            self._threads = [
+                self._stage(self._load_stage, files, loader, q_docs),
+                self._stage(self._split_stage, q_docs, q_chunks, bm25, ids_by_source),
+            ]
+        self._threads += [
+            self._stage(self._embed_stage, q_chunks, q_vectors),
+            self._stage(self._write_stage, q_vectors),
+        ]
+        threads = self._threads
+        while any(thread.is_alive() for thread in threads):
+            threads[-1].join(timeout=self.report_interval)
+            yield self._snapshot(started, (q_docs, q_chunks, q_vectors))
+        if self._errors:
+            raise self._errors[0]
+
+        # 收尾：整理存储、记录被多个文件共享的 Chunk、保存 BM25 / 去重签名和清单 (清单最后写入，索引版本号随之变化)
+        target.compact()
+        if self._deduplicator is not None:
+            shared = {chunk_id: refs for chunk_id, refs in sources_by_chunk(ids_by_source).items() if len(refs) > 1}
+            target.update_chunk_sources(shared)
+            self._deduplicator.save(target.persist_dir)
+            INGEST_ITEMS.inc(self.progress["chunks_deduped"], stage="dedup")
+            print(f"[Pipeline] 去重: {self._deduplicator.stats()}，{len(shared)} 个片段被多个文件共享。")
+        target.save_lexical_index(bm25.build())
+        manifest = IndexManifest(target.persist_dir)
+        manifest.record_sources(ids_by_source)
+        manifest.save()
+        if target is not self.db_manager:
+            # 校验 (片段数、清单引用、探测查询) 通过后切换版本，当前进程的 Manager 随即跟随
+            target.activate_version(expected_chunks=self.progress["chunks_written"])
+            self.db_manager._follow_active()
+
+        snapshot = self._snapshot(started, (q_docs, q_chunks, q_vectors))
+        snapshot["done"] = True
+        snapshot["version"] = target.active_version
+        cache_stats = self.db_manager.embedding_fn.cache.stats()
+        print(f"[Pipeline] 入库完成: {snapshot['chunks_written']} 个片段，用时 {snapshot['elapsed_s']:.1f}s "
+              f"({snapshot['chunks_per_s']:.1f} chunks/s)，Embedding 缓存命中率 {cache_stats['hit_ratio']:.1%}")
+        self.db_manager.embedding_fn.cache.reset_stats()
+        yield snapshot
@@ -0,0 +1,130 @@
+import os
+import sys
+from typing import Optional
+
+# 确保能找到其他模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from src.ingestion.loader import DocLoader
+from src.ingestion.splitter import HybridSplitter
+from src.ingestion.parallel import clean_and_split
+from src.ingestion.dedup import ChunkDeduplicator, deduplicate, sources_by_chunk
+from src.embedding.manifest import IndexManifest
+from src.embedding.vector_db import VectorDBManager
+
+
+class IndexSyncer:
+    """
+    增量索引同步：根据 manifest.json 找出新增 / 修改 / 删除的源文件，
+    只对变化的文件重新加载、清洗、分块并 upsert，已删除文件的 Chunk 按 ID 从向量库移除。
+    开启去重时新 Chunk 会与库中已有 Chunk 比较，一个 Chunk 只有在没有任何文件引用它时才会被删除。
+    """
+
+    def __init__(self, doc_path: str, db_manager: Optional[VectorDBManager] = None,
+                 splitter: Optional[HybridSplitter] = None, workers: Optional[int] = None,
+                 dedup: bool = True, dedup_threshold: float = 0.85):
+        """
+        :param workers: 清洗 + 分块的进程数，None 表示按变化文件数和 CPU 数自动选择
+        :param dedup: 是否合并完全重复和近似重复的 Chunk (与 IngestionPipeline 一致)
+        :param dedup_threshold: 近似重复的 Jaccard 相似度阈值
+        """
+        self.doc_path = doc_path
+        self.db_manager = db_manager or VectorDBManager()
+        self.splitter = splitter or HybridSplitter()
+        self.workers = workers
+        self.dedup = dedup
+        self.dedup_threshold = dedup_threshold
+
+    def _load_deduplicator(self) -> ChunkDeduplicator:
+        """
+        加载入库时保存的去重签名；不存在 (旧索引) 时用向量库中的现有 Chunk 现场构建。
+        """
+        dedup = ChunkDeduplicator.load(self.db_manager.persist_dir, threshold=self.dedup_threshold)
+        if dedup is None:
+            dedup = ChunkDeduplicator(threshold=self.dedup_threshold)
+            docs = self.db_manager.get_documents(self.db_manager.list_ids())
+            for doc in docs:
+                dedup.add(doc.metadata["chunk_id"], doc.page_content, str(doc.metadata.get("source", "")))
+            dedup.reset_stats()
+            print(f"[Sync] 未找到去重索引，已根据现有 {len(docs)} 个片段构建。")
+        return dedup
+
+    def sync(self) -> dict:
+        """
+        执行一次增量同步。
+        :return: 统计信息 {changed_files, removed_files, upserted_chunks, deleted_chunks, deduplicated_chunks}
+        """
+        loader = DocLoader(self.doc_path)
+        files = loader.list_files()
+
+        manifest = IndexManifest.load(self.db_manager.persist_dir)
+        changed, removed = manifest.diff(files)
+        print(f"[Sync] 共 {len(files)} 个文件，变化 {len(changed)} 个，删除 {len(removed)} 个。")
+
+        # 1. 收集受影响文件的旧 Chunk ID
+        old_ids = set()
+        if not manifest.files:
+            # 没有清单 (旧版本构建的索引，ID 是随机的)：库里现有的 Chunk 全部视为待替换
+            old_ids.update(self.db_manager.list_ids())
+        for path in list(changed) + removed:
+            old_ids.update(manifest.files.get(path, {}).get("chunk_ids", []))
+        if not changed and not removed and not old_ids:
+            # 没有任何变化：不写清单和去重索引，索引版本号保持不变 (不会让缓存失效、引擎重新加载)；
+            # 只被 touch 过的文件的新 mtime 单独保存，下次同步不必再计算哈希
+            manifest.save_fingerprints()
+            result = {"changed_files": 0, "removed_files": 0, "upserted_chunks": 0,
+                      "deleted_chunks": 0, "deduplicated_chunks": 0}
+            print(f"[Sync] 索引已是最新，无需更新: {result}")
+            return result
+
+        # 2. 只对变化的文件重新加载、清洗、分块，再与库中已有 Chunk 去重
+        chunks, ids = [], []
+        if changed:
+            chunks = clean_and_split(list(changed), self.doc_path, splitter=self.splitter, workers=self.workers)
+            ids = [chunk.metadata["chunk_id"] for chunk in chunks]
+        dedup = self._load_deduplicator() if self.dedup else None
+        if dedup is not None:
+            chunks, ids, new_ids_by_file = deduplicate(chunks, ids, dedup)
+        else:
+            new_ids_by_file = {}
+            for chunk, chunk_id in zip(chunks, ids):
+                new_ids_by_file.setdefault(str(chunk.metadata.get("source", "")), []).append(chunk_id)
+
+        # 3. 更新清单中的文件条目 (只在内存中)，得到同步后每个 Chunk 被哪些文件引用
+        for path, fingerprint in changed.items():
+            manifest.files[path] = {**fingerprint, "chunk_ids": new_ids_by_file.get(path, [])}
+        for path in removed:
+            manifest.files.pop(path, None)
+        referenced = sources_by_chunk({path: entry.get("chunk_ids", []) for path, entry in manifest.files.items()})
+
+        # 4. 先写入新 Chunk 再删除过期 Chunk (不再被任何文件引用的旧 Chunk)，同步过程中检索不会出现空窗
+        if chunks:
+            self.db_manager.upsert_chunks(chunks, ids)
+        stale_ids = list(old_ids - set(referenced))
+        self.db_manager.delete_chunks(stale_ids)
+        if dedup is not None:
+            dedup.remove(stale_ids)
+            # 引用关系可能变化的 Chunk：本次写入的、以及受影响文件中仍被其他文件引用的
+            touched = (set(ids) | old_ids | {i for refs in new_ids_by_file.values() for i in refs}) & set(referenced)
+            self.db_manager.update_chunk_sources(
+                {chunk_id: referenced[chunk_id] for chunk_id in touched
+                 if len(referenced[chunk_id]) > 1 or chunk_id in old_ids and chunk_id not in ids})
+
+        # 5. 重建 BM25 词法索引 (基于更新后的全部 Chunk，纯 CPU，代价远小于 Embedding)
+        if chunks or stale_ids:
+            self.db_manager.refresh_lexical_index()
+
+        # 6. 保存清单 (最后写入，索引版本号随之变化)
+        if dedup is not None:
+            dedup.save(self.db_manager.persist_dir)
+        manifest.save()
+
+        result = {
+            "changed_files": len(changed),
+            "removed_files": len(removed),
+            "upserted_chunks": len(chunks),
+            "deleted_chunks": len(stale_ids),
+            "deduplicated_chunks": dedup.saved if dedup is not None else 0,
+        }
+        print(f"[Sync] 同步完成: {result}")
+        return result
@@ -37,5 +37,7 @@ class DeepSeekClient:
             openai_api_key=self.api_key,
             temperature=temperature,
             streaming=streaming,
-            max_tokens=4096 
+            max_tokens=4096,
+            # 单次请求的超时 (秒)；首 Token 的截止时间另由 RAGEngine 的延迟预算控制
+            timeout=float(os.getenv("LLM_TIMEOUT_S", "60"))
         )
\ No newline at end of file
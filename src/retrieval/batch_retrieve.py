@@ -0,0 +1,132 @@
+import argparse
+import json
+import os
+import sys
+import time
+from typing import List, Optional, Set
+
+# 确保能找到其他模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from langchain_core.documents import Document
+
+from src.retrieval.search import SearchEngine
+
+
+def load_questions(path: str) -> List[dict]:
+    """
+    读取问题集：.jsonl 每行一个对象 (问题放在 question 或 query 字段，可选 id，其余字段原样带到结果中)；
+    其他格式每行一个问题。没有 id 时用行号。
+    """
+    rows = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                record = json.loads(line)
+                question = record.pop("question", None) or record.pop("query", "")
+            else:
+                record, question = {}, line
+            record["id"] = str(record.get("id", line_no))
+            record["query"] = question
+            rows.append(record)
+    return rows
+
+
+def completed_ids(path: str) -> Set[str]:
+    """
+    已完成的问题 id (用于断点续跑)。中断时写了一半的最后一行会被截掉，之后从这里继续追加。
+    """
+    if not os.path.exists(path):
+        return set()
+    done, valid_bytes = set(), 0
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if not line.endswith(b"\n"):
+                break
+            done.add(str(record["id"]))
+            valid_bytes += len(line)
+    if valid_bytes != os.path.getsize(path):
+        with open(path, "r+b") as f:
+            f.truncate(valid_bytes)
+        print(f"[Batch] 已截掉结果文件末尾不完整的记录: {path}")
+    return done
+
+
+def _serialize(doc: Document, with_content: bool) -> dict:
+    row = {key: doc.metadata.get(key) for key in ("chunk_id", "source", "relevance_score", "score_source")
+           if key in doc.metadata}
+    if "relevance_score" in row:
+        row["relevance_score"] = float(row["relevance_score"])
+    if with_content:
+        row["content"] = doc.page_content
+    return row
+
+
+def run_batch(engine: SearchEngine, questions: List[dict], output: str, batch_size: int = 128,
+              rerank_pairs: int = 512, with_content: bool = False, resume: bool = False) -> dict:
+    """
+    批量检索问题集，结果逐批追加写入 JSONL (每行: 输入字段 + documents + cache_hit + timings_ms)。
+    resume 时跳过结果文件中已完成的问题，否则覆盖结果文件。
+    :return: 汇总 {questions, skipped, elapsed_s, qps, stage_ms}
+    """
+    done = completed_ids(output) if resume else set()
+    pending = [row for row in questions if row["id"] not in done]
+    print(f"[Batch] 共 {len(questions)} 个问题，已完成 {len(questions) - len(pending)} 个，本次检索 {len(pending)} 个。")
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    stage_ms, written = {}, 0
+    started = time.perf_counter()
+    with open(output, "a" if resume else "w", encoding="utf-8") as f:
+        queries = [row["query"] for row in pending]
+        for result in engine.batch_retrieve(queries, batch_size=batch_size, rerank_pairs=rerank_pairs):
+            row = pending[result["index"]]
+            record = {**row, "documents": [_serialize(doc, with_content) for doc in result["documents"]],
+                      "cache_hit": result["cache_hit"], "timings_ms": result["timings"]}
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            for name, ms in result["timings"].items():
+                stage_ms[name] = stage_ms.get(name, 0.0) + ms
+            written += 1
+            if written % batch_size == 0 or written == len(pending):
+                # 每批落盘一次，中断后最多重跑一批
+                f.flush()
+                print(f"[Batch] 进度 {written}/{len(pending)} ({written / (time.perf_counter() - started):.1f} 问题/s)")
+
+    elapsed = time.perf_counter() - started
+    return {"questions": written, "skipped": len(questions) - len(pending), "elapsed_s": elapsed,
+            "qps": written / elapsed if elapsed > 0 else 0.0, "stage_ms": stage_ms}
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="批量检索问题集 (离线评测 / 批量查询)，结果写入 JSONL，支持断点续跑")
+    parser.add_argument("--input", required=True, help="问题集 (.jsonl 或每行一个问题的文本文件)")
+    parser.add_argument("--output", required=True, help="结果 JSONL 的路径")
+    parser.add_argument("--db-path", default="./data/vector_store", help="向量库目录")
+    parser.add_argument("--backend", choices=["chroma", "numpy"], help="向量库后端，默认读取 VECTOR_STORE_BACKEND")
+    parser.add_argument("--rerank-mode", choices=["full", "cascade"], default="full")
+    parser.add_argument("--batch-size", type=int, default=128, help="每批的问题数")
+    parser.add_argument("--rerank-pairs", type=int, default=512, help="每次 /score 调用最多的 (问题, 候选) 对数")
+    parser.add_argument("--with-content", action="store_true", help="结果中包含片段正文")
+    parser.add_argument("--resume", action="store_true", help="跳过结果文件中已完成的问题，继续追加")
+    args = parser.parse_args(argv)
+
+    questions = load_questions(args.input)
+    engine = SearchEngine(db_path=args.db_path, backend=args.backend, rerank_mode=args.rerank_mode)
+    engine.db_manager.load_index()
+    summary = run_batch(engine, questions, args.output, batch_size=args.batch_size,
+                        rerank_pairs=args.rerank_pairs, with_content=args.with_content, resume=args.resume)
+
+    stages = "，".join(f"{name} {ms / 1000:.1f}s" for name, ms in summary["stage_ms"].items())
+    print(f"[Batch] 完成: {summary['questions']} 个问题，用时 {summary['elapsed_s']:.1f}s "
+          f"({summary['qps']:.1f} 问题/s)，跳过已完成 {summary['skipped']} 个。各阶段合计: {stages or '-'}")
+    print(f"[Batch] 结果已保存: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import os
+import re
+from array import array
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 标识符 (RunnablePassthrough / with_structured_output / langchain_core)
+_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+# 驼峰拆分：HTTPServer -> HTTP, Server；RunnablePassthrough -> Runnable, Passthrough
+_CAMEL_PART = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+# 中文按字二元组切分
+_CJK = re.compile(r"[\u4e00-\u9fff]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    面向代码文档的分词：
+    1. 完整标识符 (小写) 保留为一个 Token，保证 API 名称精确命中；
+    2. 驼峰 / 下划线命名额外拆出子词，"structured output" 也能匹配 with_structured_output；
+    3. 中文按字二元组切分。
+    """
+    tokens = []
+    for match in _IDENTIFIER.finditer(text):
+        word = match.group()
+        tokens.append(word.lower())
+        parts = [p.lower() for piece in word.split("_") for p in _CAMEL_PART.findall(piece)]
+        if len(parts) > 1:
+            tokens.extend(parts)
+    for match in _CJK.finditer(text):
+        segment = match.group()
+        if len(segment) == 1:
+            tokens.append(segment)
+        else:
+            tokens.extend(segment[i:i + 2] for i in range(len(segment) - 1))
+    return tokens
+
+
+class BM25Index:
+    """
+    紧凑的 BM25 倒排索引 (纯 NumPy 实现)。
+    倒排表按词项连续存放在两个数组里 (文档下标 / 词频)，持久化为一个 .npz 文件，
+    加载后只在内存中构建一个词项 -> 下标的字典。
+    """
+
+    FILENAME = "bm25_index.npz"
+
+    def __init__(self, chunk_ids: Sequence[str], terms: Sequence[str], offsets: np.ndarray,
+                 postings_doc: np.ndarray, postings_tf: np.ndarray, doc_len: np.ndarray,
+                 k1: float = 1.5, b: float = 0.75):
+        self.chunk_ids = list(chunk_ids)
+        self.terms = list(terms)
+        self.offsets = offsets              # 第 i 个词项的倒排表位于 [offsets[i], offsets[i+1])
+        self.postings_doc = postings_doc
+        self.postings_tf = postings_tf
+        self.doc_len = doc_len
+        self.k1 = k1
+        self.b = b
+
+        self._term_index: Dict[str, int] = {t: i for i, t in enumerate(self.terms)}
+        n_docs = max(len(self.chunk_ids), 1)
+        doc_freq = np.diff(self.offsets).astype(np.float32)
+        self._idf = np.log(1.0 + (n_docs - doc_freq + 0.5) / (doc_freq + 0.5)).astype(np.float32)
+        avg_len = float(self.doc_len.mean()) if len(self.doc_len) else 1.0
+        # BM25 长度归一化项只和文档有关，预先算好
+        self._norm = (self.k1 * (1 - self.b + self.b * self.doc_len / max(avg_len, 1e-6))).astype(np.float32)
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    @classmethod
+    def build(cls, chunk_ids: Sequence[str], texts: Sequence[str]) -> "BM25Index":
+        builder = BM25Builder()
+        for chunk_id, text in zip(chunk_ids, texts):
+            builder.add(chunk_id, text)
+        return builder.build()
+
+    def save(self, directory: str):
+        path = os.path.join(directory, self.FILENAME)
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            chunk_ids=np.array(self.chunk_ids, dtype=str),
+            terms=np.array(self.terms, dtype=str),
+            offsets=self.offsets,
+            postings_doc=self.postings_doc,
+            postings_tf=self.postings_tf,
+            doc_len=self.doc_len,
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["BM25Index"]:
+        """
+        从向量库目录加载索引，不存在时返回 None。
+        """
+        path = os.path.join(directory, cls.FILENAME)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return cls(
+                chunk_ids=data["chunk_ids"].tolist(),
+                terms=data["terms"].tolist(),
+                offsets=data["offsets"],
+                postings_doc=data["postings_doc"],
+                postings_tf=data["postings_tf"],
+                doc_len=data["doc_len"],
+            )
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[str, float]]:
+        """
+        返回 BM25 得分最高的 k 个 (chunk_id, score)。
+        """
+        term_ids = {self._term_index[t] for t in tokenize(query) if t in self._term_index}
+        if not term_ids or not self.chunk_ids:
+            return []
+
+        scores = np.zeros(len(self.chunk_ids), dtype=np.float32)
+        for term_id in term_ids:
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs = self.postings_doc[start:end]
+            tf = self.postings_tf[start:end]
+            scores[docs] += self._idf[term_id] * tf * (self.k1 + 1) / (tf + self._norm[docs])
+
+        k = min(k, int(np.count_nonzero(scores)))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.chunk_ids[i], float(scores[i])) for i in top]
+
+
+class BM25Builder:
+    """
+    增量构建 BM25 索引：逐个 Chunk 调用 add()，不需要同时持有全部文本。
+    倒排表用紧凑的 array 存放 (每个条目 8 字节)，流式入库时内存只与倒排表本身的大小相关。
+    """
+
+    def __init__(self):
+        self.chunk_ids: List[str] = []
+        self.doc_len = array("f")
+        self.postings: Dict[str, Tuple[array, array]] = {}
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    def add(self, chunk_id: str, text: str):
+        doc_idx = len(self.chunk_ids)
+        counts = Counter(tokenize(text))
+        self.chunk_ids.append(chunk_id)
+        self.doc_len.append(sum(counts.values()))
+        for term, tf in counts.items():
+            entry = self.postings.get(term)
+            if entry is None:
+                entry = self.postings[term] = (array("i"), array("f"))
+            entry[0].append(doc_idx)
+            entry[1].append(tf)
+
+    def build(self) -> BM25Index:
+        terms = sorted(self.postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        for i, term in enumerate(terms):
+            offsets[i + 1] = offsets[i] + len(self.postings[term][0])
+        postings_doc = np.empty(offsets[-1], dtype=np.int32)
+        postings_tf = np.empty(offsets[-1], dtype=np.float32)
+        for i, term in enumerate(terms):
+            docs, tfs = self.postings[term]
+            postings_doc[offsets[i]:offsets[i + 1]] = np.frombuffer(docs, dtype=np.int32)
+            postings_tf[offsets[i]:offsets[i + 1]] = np.frombuffer(tfs, dtype=np.float32)
+
+        return BM25Index(self.chunk_ids, terms, offsets, postings_doc, postings_tf,
+                         np.frombuffer(self.doc_len, dtype=np.float32).copy())
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> List[str]:
+    """
+    倒数排名融合 (RRF)：score(d) = Σ 1 / (k + rank_i(d))，只依赖名次，不需要对齐两路检索的分数尺度。
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
@@ -0,0 +1,264 @@
+import sys
+import os
+import time
+from collections import Counter
+from typing import List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+try:
+    from src.retrieval.reranker import LocalReranker
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+    from src.retrieval.reranker import LocalReranker
+
+
+class CascadeReranker:
+    """
+    级联重排序：先看第一阶段 (向量检索) 的余弦相似度 dense_score，只在必要时调用交叉编码器。
+
+    - skip：按 dense_score 排序后，第 top_n 名已达到 accept_score，且与第 top_n+1 名的差距 >= decisive_margin，
+            说明赢家已经很明确，直接返回，不调用 Reranker；
+    - band：dense_score >= accept_score 的候选直接保留，< reject_score 的直接丢弃，
+            只把中间的不确定区间按相似度从高到低分批 (initial_band，之后每次 band_step 个) 送去打分，
+            直到通过 score_threshold 的结果凑够 top_n 或区间用完；
+    - full：未启用级联、候选缺少 dense_score 或全部低于 reject_score 时，退回全量重排序。
+    """
+
+    def __init__(self, reranker: LocalReranker, enabled: bool = True,
+                 accept_score: float = 0.75, reject_score: float = 0.3, decisive_margin: float = 0.1,
+                 initial_band: int = 6, band_step: int = 4):
+        """
+        :param enabled: 为 False 时始终全量重排序 (只做统计)
+        :param accept_score: dense_score 不低于该值的候选视为确定相关
+        :param reject_score: dense_score 低于该值的候选视为确定无关
+        :param decisive_margin: skip 路径要求的 "第 top_n 名 - 第 top_n+1 名" 最小分差
+        :param initial_band: 第一批送去打分的不确定候选数
+        :param band_step: 结果不足 top_n 时每次追加的候选数
+        """
+        self.reranker = reranker
+        self.enabled = enabled
+        self.accept_score = accept_score
+        self.reject_score = reject_score
+        self.decisive_margin = decisive_margin
+        self.initial_band = initial_band
+        self.band_step = band_step
+
+        self.paths = Counter()
+        self.queries = 0
+        self.pairs_scored = 0
+
+    @property
+    def top_n(self) -> int:
+        return self.reranker.top_n
+
+    def stats(self) -> dict:
+        """
+        各路径的次数和平均每个问题送去打分的 (query, chunk) 对数。
+        """
+        return {
+            "queries": self.queries,
+            "paths": dict(self.paths),
+            "avg_pairs_scored": self.pairs_scored / self.queries if self.queries else 0.0,
+        }
+
+    def _split(self, documents: Sequence[Document]):
+        """
+        :return: (按 dense_score 降序的全部候选, 确定相关候选, 不确定区间)，
+                 未启用或缺少 dense_score 时返回 None
+        """
+        if not self.enabled or any("dense_score" not in doc.metadata for doc in documents):
+            return None
+        ranked = sorted(documents, key=lambda d: d.metadata["dense_score"], reverse=True)
+        accepted = [d for d in ranked if d.metadata["dense_score"] >= self.accept_score]
+        band = [d for d in ranked if self.reject_score <= d.metadata["dense_score"] < self.accept_score]
+        if not accepted and not band:
+            # 所有候选的向量相似度都很低，不敢直接丢弃，交给交叉编码器判断
+            return None
+        return ranked, accepted, band
+
+    def _is_decisive(self, ranked: List[Document]) -> bool:
+        if len(ranked) < self.top_n:
+            return False
+        last = ranked[self.top_n - 1].metadata["dense_score"]
+        following = ranked[self.top_n].metadata["dense_score"] if len(ranked) > self.top_n else -1.0
+        return last >= self.accept_score and last - following >= self.decisive_margin
+
+    def first_batch(self, documents: Sequence[Document]) -> List[Document]:
+        """
+        compress_documents 第一次调用 Reranker 时会送去打分的候选 (批量检索据此提前合并打分)，
+        不需要打分 (skip / 确定相关的候选已经够 top_n) 时返回空列表。需要先补齐 dense_score。
+        """
+        if not documents:
+            return []
+        split = self._split(documents)
+        if split is None:
+            return list(documents)
+        ranked, accepted, band = split
+        if self._is_decisive(ranked) or len(accepted) >= self.top_n:
+            return []
+        return self._next_batch(band, 0)
+
+    @staticmethod
+    def _with_dense_scores(documents: Sequence[Document]) -> List[Document]:
+        # 未经交叉编码器的结果以 dense_score 作为 relevance_score，并标明来源
+        results = []
+        for doc in documents:
+            metadata = dict(doc.metadata, relevance_score=doc.metadata["dense_score"], score_source="dense")
+            results.append(Document(page_content=doc.page_content, metadata=metadata))
+        return results
+
+    def _next_batch(self, band: List[Document], sent: int) -> List[Document]:
+        size = self.initial_band if sent == 0 else self.band_step
+        return band[sent:sent + size]
+
+    def _finish(self, accepted: List[Document], scored: List[Tuple[Document, float]], path: str,
+                pairs: int) -> Tuple[List[Document], str]:
+        self.queries += 1
+        self.paths[path.split("+")[0]] += 1
+        self.pairs_scored += pairs
+        passed = [(doc, score) for doc, score in scored if score >= self.reranker.score_threshold]
+        passed.sort(key=lambda x: x[1], reverse=True)
+        results = self._with_dense_scores(accepted[:self.top_n])
+        for doc, score in passed[:self.top_n - len(results)]:
+            results.append(Document(page_content=doc.page_content,
+                                    metadata=dict(doc.metadata, relevance_score=score, score_source="rerank")))
+        return results, path
+
+    def compress_documents(self, documents: Sequence[Document], query: str) -> Tuple[List[Document], str]:
+        """
+        :return: (Top N 文档, 本次走的路径)
+        """
+        if not documents:
+            return [], "empty"
+        split = self._split(documents)
+        if split is None:
+            results = list(self.reranker.compress_documents(documents, query))
+            return self._finish_full(results, len(documents))
+        ranked, accepted, band = split
+        if self._is_decisive(ranked):
+            return self._finish(accepted, [], "skip", 0)
+
+        scored, sent, rounds = [], 0, 0
+        while sent < len(band) and len(accepted) + self._count_passed(scored) < self.top_n:
+            batch = self._next_batch(band, sent)
+            scores = self.reranker.score(batch, query)
+            if scores is None:
+                # Reranker 不可用：不确定区间按向量相似度排序，不写入 relevance_score (结果不会被缓存)
+                return self._finish_degraded(accepted, band, sent + len(batch))
+            scored.extend(zip(batch, scores))
+            sent += len(batch)
+            rounds += 1
+        return self._finish(accepted, scored, self._band_path(sent, rounds), sent)
+
+    async def acompress_documents(self, documents: Sequence[Document], query: str) -> Tuple[List[Document], str]:
+        """
+        compress_documents 的异步版本。
+        """
+        if not documents:
+            return [], "empty"
+        split = self._split(documents)
+        if split is None:
+            results = list(await self.reranker.acompress_documents(documents, query))
+            return self._finish_full(results, len(documents))
+        ranked, accepted, band = split
+        if self._is_decisive(ranked):
+            return self._finish(accepted, [], "skip", 0)
+
+        scored, sent, rounds = [], 0, 0
+        while sent < len(band) and len(accepted) + self._count_passed(scored) < self.top_n:
+            batch = self._next_batch(band, sent)
+            scores = await self.reranker.ascore(batch, query)
+            if scores is None:
+                return self._finish_degraded(accepted, band, sent + len(batch))
+            scored.extend(zip(batch, scores))
+            sent += len(batch)
+            rounds += 1
+        return self._finish(accepted, scored, self._band_path(sent, rounds), sent)
+
+    def _count_passed(self, scored: List[Tuple[Document, float]]) -> int:
+        return sum(1 for _, score in scored if score >= self.reranker.score_threshold)
+
+    @staticmethod
+    def _band_path(sent: int, rounds: int) -> str:
+        if sent == 0:
+            return "accept"
+        return f"band+grow{rounds - 1}" if rounds > 1 else "band"
+
+    def _finish_full(self, results: List[Document], pairs: int) -> Tuple[List[Document], str]:
+        self.queries += 1
+        self.paths["full"] += 1
+        self.pairs_scored += pairs
+        return results, "full"
+
+    def _finish_degraded(self, accepted: List[Document], band: List[Document],
+                         pairs: int) -> Tuple[List[Document], str]:
+        self.queries += 1
+        self.paths["degraded"] += 1
+        self.pairs_scored += pairs
+        return (accepted + band)[:self.top_n], "degraded"
+
+
+# ==========================================
+# 独立执行的对比测试
+# ==========================================
+DEFAULT_QUERIES = [
+    "LangChain 是什么？",
+    "How do I use RunnablePassthrough",
+    "with_structured_output example",
+    "如何给智能体添加短期记忆？",
+    "LangGraph 的持久化是怎么实现的？",
+    "How to stream tokens from a chat model",
+    "检索增强生成 RAG 的基本流程",
+    "什么是中间件 middleware？",
+]
+
+
+def compare_rerank_modes(queries: Optional[List[str]] = None, db_path: str = "./data/vector_store",
+                         **cascade_kwargs) -> dict:
+    """
+    同一批问题分别用全量重排序和级联重排序跑一遍 (关闭检索结果缓存)，对比：
+    平均打分对数、平均 Rerank 耗时、各路径次数，以及级联结果与全量结果 Top N 的重合率。
+    """
+    try:
+        from src.retrieval.search import SearchEngine
+    except ImportError:
+        sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+        from src.retrieval.search import SearchEngine
+
+    queries = queries or DEFAULT_QUERIES
+    engines = {
+        mode: SearchEngine(db_path=db_path, result_cache_size=0, rerank_mode=mode, cascade_options=cascade_kwargs)
+        for mode in ("full", "cascade")
+    }
+
+    def key(doc):
+        return doc.metadata.get("chunk_id") or doc.page_content
+
+    report = {}
+    results = {}
+    for mode, engine in engines.items():
+        start = time.perf_counter()
+        results[mode] = [[key(doc) for doc in engine.search(q)] for q in queries]
+        elapsed = (time.perf_counter() - start) * 1000 / len(queries)
+        rerank = engine.timing_summary().get("rerank", {})
+        report[mode] = {
+            "avg_query_ms": elapsed,
+            "rerank_p50_ms": rerank.get("p50_ms", 0.0),
+            **engine.cascade.stats(),
+        }
+
+    overlaps = [
+        len(set(full) & set(cascade)) / max(len(full), 1)
+        for full, cascade in zip(results["full"], results["cascade"])
+    ]
+    report["cascade"]["overlap_with_full"] = sum(overlaps) / len(overlaps)
+
+    print(f"------- Rerank 模式对比 ({len(queries)} 个问题) -------")
+    for mode, stats in report.items():
+        print(f"   {mode:>7}: {stats}")
+    return report
+
+
+if __name__ == "__main__":
+    compare_rerank_modes()
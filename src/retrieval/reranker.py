@@ -1,84 +1,155 @@
-import requests
+import asyncio
+import hashlib
 import json
-from typing import Sequence, List, Optional
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Sequence, List, Optional, Tuple
 from langchain_core.documents import Document
 from langchain_core.callbacks.manager import Callbacks
 from langchain_core.documents.compressor import BaseDocumentCompressor
+from langchain_core.pydantic_v1 import PrivateAttr
+
+try:
+    from src.utils.batching import MicroBatcher
+    from src.utils.cache import TTLCache, normalize_query
+    from src.utils.deadline import stage_timeout
+    from src.utils.http import create_session, get_async_client
+    from src.utils.timing import StageTimer, TimingStats
+    from src.utils.metrics import UPSTREAM_ERRORS, UPSTREAM_SECONDS
+except ImportError:
+    import sys
+    import os
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+    from src.utils.batching import MicroBatcher
+    from src.utils.cache import TTLCache, normalize_query
+    from src.utils.deadline import stage_timeout
+    from src.utils.http import create_session, get_async_client
+    from src.utils.timing import StageTimer, TimingStats
+    from src.utils.metrics import UPSTREAM_ERRORS, UPSTREAM_SECONDS
 
 class LocalReranker(BaseDocumentCompressor):
     """
     自定义 Reranker，适配 vLLM 的 Score API。
     文档参考: https://docs.vllm.ai/en/latest/serving/openai_compatible_server.html#score-api
+    同时提供同步 (requests.Session 连接池) 和异步 (共享 httpx 连接池) 两种调用方式。
+
+    (query, chunk) 的分数会缓存，Key = (模型名, 规范化问题的哈希, chunk_id 或正文哈希)，
+    重复提问 / 重新生成时只把未缓存的候选发给 /score，再与缓存分数合并。
+
+    并发请求的打分经过共享的 MicroBatcher：短时间内到达的多个 (问题, 候选列表) 合并成一次 /score 调用
+    (text_1 / text_2 为等长列表，逐对打分)，结果按请求切回。
     """
     # 根据你提供的文档，API 路径通常是 /score 而不是 /v1/score
     endpoint: str = "http://localhost:4062/score"
     model_name: str = "bge-reranker-v2-m3"
     top_n: int = 5
     score_threshold: float = 0.0
+    timeout: float = 10.0
+    pool_size: int = 10                     # 同步连接池大小 (Keep-Alive)
+    score_cache_size: int = 50_000          # 分数缓存条目数 (0 表示关闭)
+    score_cache_ttl: Optional[float] = 3600 # 分数缓存过期时间 (秒)
+    batch_max_pairs: int = 64               # 合并后每次 /score 最多的 (问题, 候选) 对数 (<= 1 表示不合并)
+    batch_wait_ms: Optional[float] = None   # 服务端忙时的攒批窗口 (毫秒)，默认读取环境变量 MICRO_BATCH_WAIT_MS
+    max_concurrency: int = 4                # 同时在途的 /score 请求数
+
+    _session: Any = PrivateAttr(default=None)
+    _score_cache: Any = PrivateAttr(default=None)
+    _timing: Any = PrivateAttr(default=None)
+    _batcher: Any = PrivateAttr(default=None)
 
     class Config:
         arbitrary_types_allowed = True
         extra = "forbid"
 
-    def compress_documents(
-        self,
-        documents: Sequence[Document],
-        query: str,
-        callbacks: Optional[Callbacks] = None,
-    ) -> Sequence[Document]:
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._session = create_session(pool_size=self.pool_size, headers={"Content-Type": "application/json"})
+        self._score_cache = TTLCache(maxsize=self.score_cache_size, ttl=self.score_cache_ttl)
+        self._timing = TimingStats()
+        if self.batch_max_pairs > 1:
+            self._batcher = MicroBatcher("rerank", self._score_batch, max_batch_size=self.batch_max_pairs,
+                                         max_wait_ms=self.batch_wait_ms, max_concurrency=self.max_concurrency,
+                                         size_of=lambda item: len(item[1]))
+
+    def _cache_key(self, query_hash: str, doc: Document) -> Tuple[str, str, str]:
+        doc_key = doc.metadata.get("chunk_id") or hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+        return self.model_name, query_hash, doc_key
+
+    def _lookup_scores(self, documents: Sequence[Document], query: str):
         """
-        核心重排序逻辑
+        查询分数缓存。
+        :return: (缓存 Key 列表, 分数列表 (未命中为 None), 未命中的下标)
         """
-        if len(documents) == 0:
-            return []
+        query_hash = hashlib.sha1(normalize_query(query).encode("utf-8")).hexdigest()
+        keys = [self._cache_key(query_hash, doc) for doc in documents]
+        scores = [self._score_cache.get(key) for key in keys]
+        missing = [i for i, score in enumerate(scores) if score is None]
+        return keys, scores, missing
+
+    def _merge_scores(self, keys, scores: List[Optional[float]], missing: List[int],
+                      fresh: List[float]) -> List[float]:
+        for i, score in zip(missing, fresh):
+            scores[i] = score
+            self._score_cache.set(keys[i], score)
+        return scores
 
-        # 1. 构造请求 Payload (Batch Inference: One-to-Many)
+    def _record_latency(self, timer: StageTimer):
+        self._timing.record(timer)
+        if "score_request" in timer.timings and self._batcher is None:
+            UPSTREAM_SECONDS.observe(timer.timings["score_request"] / 1000, service="rerank")
+
+    def close(self):
+        """
+        释放微批线程和连接池，之后不能再使用。
+        """
+        if self._batcher is not None:
+            self._batcher.close()
+        self._session.close()
+
+    def clear_cache(self):
+        """
+        清空分数缓存 (例如基准测试需要测量冷启动的 /score 延迟)。
+        """
+        self._score_cache.clear()
+
+    def stats(self) -> dict:
+        """
+        分数缓存命中统计 (按 (query, chunk) 对计) 和 /score 调用耗时 (p50 / p95)。
+        """
+        return {"score_cache": self._score_cache.stats(), "latency": self._timing.summary()}
+
+    def _build_payload(self, documents: Sequence[Document], query: str) -> dict:
+        # 构造请求 Payload (Batch Inference: One-to-Many)
         # text_1: Query (String)
         # text_2: List of Candidates (List[String])
-        payload = {
+        return {
             "model": self.model_name,
             "text_1": query, 
             "text_2": [doc.page_content for doc in documents]
         }
 
-        try:
-            # 发送请求
-            response = requests.post(
-                self.endpoint, 
-                json=payload, 
-                headers={"Content-Type": "application/json"},
-                timeout=10
-            )
-            
-            # 调试：如果报错，打印服务端返回的具体信息
-            if response.status_code != 200:
-                print(f"[Rerank Error] HTTP {response.status_code}: {response.text}")
-            
-            response.raise_for_status()
-            
-            # 2. 解析返回结果
-            # vLLM 返回格式: {"data": [{"index": 0, "score": 0.9}, ...]}
-            results = response.json()
-            
-            if "data" in results:
-                # 确保按 index 排序，因为 API 可能不保证顺序（虽然通常是保序的）
-                data_list = results["data"]
-                # 创建一个长度正确的 score 列表
-                scores = [0.0] * len(documents)
-                for item in data_list:
-                    idx = item.get("index")
-                    score = item.get("score")
-                    if idx is not None and idx < len(scores):
-                        scores[idx] = score
-            else:
-                print(f"[Rerank Error] 响应中未找到 'data' 字段: {results}")
-                return documents[:self.top_n]
+    @staticmethod
+    def _parse_scores(results: dict, size: int) -> Optional[List[float]]:
+        """
+        解析返回结果，vLLM 返回格式: {"data": [{"index": 0, "score": 0.9}, ...]}
+        缺少 data 字段时返回 None。
+        """
+        if "data" not in results:
+            print(f"[Rerank Error] 响应中未找到 'data' 字段: {results}")
+            return None
 
-        except Exception as e:
-            print(f"[Rerank Warning] 服务调用失败: {e}。返回原始排序。")
-            return documents[:self.top_n]
+        # 确保按 index 排序，因为 API 可能不保证顺序（虽然通常是保序的）
+        # 创建一个长度正确的 score 列表
+        scores = [0.0] * size
+        for item in results["data"]:
+            idx = item.get("index")
+            score = item.get("score")
+            if idx is not None and idx < len(scores):
+                scores[idx] = score
+        return scores
 
-        # 3. 结合分数筛选文档
+    def _select_top(self, documents: Sequence[Document], scores: List[float]) -> Sequence[Document]:
+        # 结合分数筛选文档
         final_results = []
         for doc, score in zip(documents, scores):
             if score >= self.score_threshold:
@@ -88,12 +159,206 @@ class LocalReranker(BaseDocumentCompressor):
                 doc.metadata = doc_metadata
                 final_results.append((doc, score))
 
-        # 4. 按分数降序排列
+        # 按分数降序排列
         final_results.sort(key=lambda x: x[1], reverse=True)
 
-        # 5. 返回 Top N
+        # 返回 Top N
         return [doc for doc, score in final_results[:self.top_n]]
 
+    def _score_batch(self, items: List[Tuple[str, List[str]]]) -> List[List[float]]:
+        """
+        MicroBatcher 的批处理函数：items 为 [(问题, 候选正文列表)]，合并成一次 /score 调用。
+        只有一个请求时仍用 "一对多" 的 Payload；失败时抛出异常，由各调用方按原来的方式降级。
+        """
+        if len(items) == 1:
+            query, texts = items[0]
+            payload = {"model": self.model_name, "text_1": query, "text_2": texts}
+        else:
+            payload = {"model": self.model_name,
+                       "text_1": [query for query, texts in items for _ in texts],
+                       "text_2": [text for _, texts in items for text in texts]}
+        total = len(payload["text_2"])
+
+        started = time.perf_counter()
+        response = self._session.post(self.endpoint, json=payload, timeout=self.timeout)
+        if response.status_code != 200:
+            print(f"[Rerank Error] HTTP {response.status_code}: {response.text}")
+        response.raise_for_status()
+        UPSTREAM_SECONDS.observe(time.perf_counter() - started, service="rerank")
+        scores = self._parse_scores(response.json(), total)
+        if scores is None:
+            raise ValueError("响应中未找到 'data' 字段")
+
+        results, offset = [], 0
+        for _, texts in items:
+            results.append(scores[offset:offset + len(texts)])
+            offset += len(texts)
+        return results
+
+    def score(self, documents: Sequence[Document], query: str) -> Optional[List[float]]:
+        """
+        给每个候选打分 (与 documents 顺序一致)，只请求未缓存的 (query, chunk) 对。
+        服务调用失败时返回 None。
+        """
+        if len(documents) == 0:
+            return []
+
+        keys, scores, missing = self._lookup_scores(documents, query)
+        if not missing:
+            return scores
+
+        timer = StageTimer()
+        try:
+            if self._batcher is not None:
+                # 与其他并发请求合并成一次 /score (score_request 包含排队等待的时间)
+                # 有请求级延迟预算时最多等待预算分给 rerank 的时间，超时按服务失败处理 (返回原始排序)
+                timeout = stage_timeout("rerank", self.timeout)
+                with timer.stage("score_request"):
+                    fresh = self._batcher.submit((query, [documents[i].page_content for i in missing])).result(timeout)
+            else:
+                payload = self._build_payload([documents[i] for i in missing], query)
+                # 发送请求 (复用连接池)
+                with timer.stage("score_request"):
+                    response = self._session.post(self.endpoint, json=payload,
+                                                  timeout=stage_timeout("rerank", self.timeout))
+
+                # 调试：如果报错，打印服务端返回的具体信息
+                if response.status_code != 200:
+                    print(f"[Rerank Error] HTTP {response.status_code}: {response.text}")
+
+                response.raise_for_status()
+                fresh = self._parse_scores(response.json(), len(missing))
+
+        except Exception as e:
+            print(f"[Rerank Warning] 服务调用失败: {e}。返回原始排序。")
+            UPSTREAM_ERRORS.inc(service="rerank")
+            return None
+        finally:
+            self._record_latency(timer)
+
+        if fresh is None:
+            return None
+        return self._merge_scores(keys, scores, missing, fresh)
+
+    def score_many(self, requests: Sequence[Tuple[Sequence[Document], str]],
+                   max_pairs: int = 512) -> List[Optional[List[float]]]:
+        """
+        批量打分 (离线评测 / 批量检索使用)：多个 (候选列表, 问题) 中未缓存的 (query, chunk) 对
+        按 max_pairs 打包成大的 /score 调用 (逐对 Payload)，最多 max_concurrency 个请求并发，不经过 MicroBatcher。
+        分数写入分数缓存，之后对同一批候选的 score / compress_documents 直接命中缓存。
+        :return: 与 requests 一一对应的分数列表，所在的 /score 调用失败时为 None
+        """
+        lookups = [self._lookup_scores(documents, query) for documents, query in requests]
+        pending = [i for i, (_, _, missing) in enumerate(lookups) if missing]
+
+        # 按请求整体装箱 (同一问题的候选不拆开)，每个包不超过 max_pairs 对
+        packs, current, size = [], [], 0
+        for i in pending:
+            count = len(lookups[i][2])
+            if current and size + count > max_pairs:
+                packs.append(current)
+                current, size = [], 0
+            current.append(i)
+            size += count
+        if current:
+            packs.append(current)
+
+        def run(pack: List[int]):
+            items = [(requests[i][1], [requests[i][0][j].page_content for j in lookups[i][2]]) for i in pack]
+            timer = StageTimer()
+            try:
+                with timer.stage("score_request"):
+                    return pack, self._score_batch(items)
+            except Exception as e:
+                print(f"[Rerank Warning] 批量打分失败 ({len(items)} 个问题): {e}")
+                UPSTREAM_ERRORS.inc(service="rerank")
+                return pack, None
+            finally:
+                self._timing.record(timer)
+
+        results: List[Optional[List[float]]] = [scores for _, scores, _ in lookups]
+        with ThreadPoolExecutor(max_workers=max(1, self.max_concurrency)) as executor:
+            for pack, fresh in executor.map(run, packs):
+                for position, i in enumerate(pack):
+                    keys, scores, missing = lookups[i]
+                    results[i] = None if fresh is None else self._merge_scores(keys, scores, missing, fresh[position])
+        return results
+
+    async def ascore(self, documents: Sequence[Document], query: str) -> Optional[List[float]]:
+        """
+        score 的异步版本，使用共享的异步连接池。
+        """
+        if len(documents) == 0:
+            return []
+
+        keys, scores, missing = self._lookup_scores(documents, query)
+        if not missing:
+            return scores
+
+        timer = StageTimer()
+        try:
+            if self._batcher is not None:
+                timeout = stage_timeout("rerank", self.timeout)
+                with timer.stage("score_request"):
+                    fresh = await asyncio.wait_for(asyncio.wrap_future(
+                        self._batcher.submit((query, [documents[i].page_content for i in missing]))), timeout)
+            else:
+                payload = self._build_payload([documents[i] for i in missing], query)
+                with timer.stage("score_request"):
+                    response = await get_async_client().post(self.endpoint, json=payload,
+                                                             timeout=stage_timeout("rerank", self.timeout))
+
+                if response.status_code != 200:
+                    print(f"[Rerank Error] HTTP {response.status_code}: {response.text}")
+
+                response.raise_for_status()
+                fresh = self._parse_scores(response.json(), len(missing))
+
+        except Exception as e:
+            print(f"[Rerank Warning] 服务调用失败: {e}。返回原始排序。")
+            UPSTREAM_ERRORS.inc(service="rerank")
+            return None
+        finally:
+            self._record_latency(timer)
+
+        if fresh is None:
+            return None
+        return self._merge_scores(keys, scores, missing, fresh)
+
+    def compress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        """
+        核心重排序逻辑
+        """
+        if len(documents) == 0:
+            return []
+
+        scores = self.score(documents, query)
+        if scores is None:
+            return documents[:self.top_n]
+        return self._select_top(documents, scores)
+
+    async def acompress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        """
+        异步重排序，逻辑与 compress_documents 一致。
+        """
+        if len(documents) == 0:
+            return []
+
+        scores = await self.ascore(documents, query)
+        if scores is None:
+            return documents[:self.top_n]
+        return self._select_top(documents, scores)
+
 # ==========================================
 # 独立执行的测试函数
 # ==========================================
@@ -117,6 +382,10 @@ def test_reranker_independently():
         for i, doc in enumerate(reranked_docs):
             score = doc.metadata.get("relevance_score", "N/A")
             print(f"   {i+1}. [Score: {score}] {doc.page_content}...")
+
+        # 再次调用应全部命中分数缓存，不再请求 /score
+        reranker.compress_documents(docs, query)
+        print(f"   缓存统计: {reranker.stats()}")
             
     except Exception as e:
         print(f"❌ 测试失败: {e}")
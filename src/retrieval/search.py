@@ -1,39 +1,378 @@
 import sys
 import os
-from langchain.retrievers import ContextualCompressionRetriever
+import asyncio
+from typing import Any, Iterator, List, Optional, Sequence
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
 
 # 引入之前的模块
 try:
     from src.retrieval.reranker import LocalReranker
+    from src.retrieval.cascade import CascadeReranker
     from src.embedding.vector_db import VectorDBManager
+    from src.retrieval.bm25 import reciprocal_rank_fusion
+    from src.utils.cache import TTLCache, normalize_query
+    from src.utils.deadline import RequestBudget, current_budget
+    from src.utils.timing import StageTimer, TimingStats
+    from src.utils.metrics import CANDIDATES, STAGE_SECONDS
+    from src.utils.tracing import RequestTrace, find_trace
 except ImportError:
     sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
     from src.retrieval.reranker import LocalReranker
+    from src.retrieval.cascade import CascadeReranker
     from src.embedding.vector_db import VectorDBManager
+    from src.retrieval.bm25 import reciprocal_rank_fusion
+    from src.utils.cache import TTLCache, normalize_query
+    from src.utils.deadline import RequestBudget, current_budget
+    from src.utils.timing import StageTimer, TimingStats
+    from src.utils.metrics import CANDIDATES, STAGE_SECONDS
+    from src.utils.tracing import RequestTrace, find_trace
+
+
+class SearchEngineRetriever(BaseRetriever):
+    """
+    LangChain 检索器适配层，把检索请求转发给 SearchEngine.search (带结果缓存)。
+    """
+    engine: Any
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return self.engine.search(query, trace=find_trace(run_manager))
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return await self.engine.asearch(query, trace=find_trace(run_manager))
+
 
 class SearchEngine:
-    def __init__(self, db_path: str = "./data/vector_store"):
+    def __init__(self, db_path: str = "./data/vector_store",
+                 result_cache_size: int = 1024, result_cache_ttl: Optional[float] = 600,
+                 hybrid: bool = True, dense_k: int = 12, lexical_k: int = 10, rerank_candidates: int = 16,
+                 backend: Optional[str] = None, log_timings: bool = False,
+                 rerank_mode: str = "full", cascade_options: Optional[dict] = None,
+                 quantization: Optional[str] = None):
+        """
+        :param result_cache_size: 检索结果缓存的最大条目数 (0 表示关闭)
+        :param result_cache_ttl: 检索结果缓存的过期时间 (秒)
+        :param hybrid: 是否启用 BM25 + 向量的混合检索 (索引缺少 BM25 文件时自动退回纯向量检索)
+        :param dense_k: 混合模式下向量 MMR 返回的候选数 (fetch_k 根据相似度分布在 2k ~ 4k 之间自适应)
+        :param lexical_k: 混合模式下 BM25 返回的候选数
+        :param rerank_candidates: RRF 融合后送入 Reranker 的候选数
+        :param backend: 向量库后端 ("chroma" / "numpy")，默认读取环境变量 VECTOR_STORE_BACKEND
+        :param log_timings: 是否打印每次查询的分阶段耗时
+        :param rerank_mode: "full" (所有候选都送交叉编码器) 或 "cascade" (按向量相似度跳过 / 缩减 Rerank)
+        :param cascade_options: 级联阈值，见 CascadeReranker
+        :param quantization: numpy 后端第一阶段检索的量化方式 ("int8" / "binary")，默认读取环境变量 VECTOR_QUANTIZATION
+        """
         # 1. 初始化向量库管理器
-        self.db_manager = VectorDBManager(persist_dir=db_path)
-        
+        self.db_manager = VectorDBManager(persist_dir=db_path, backend=backend, quantization=quantization)
+
         # 2. 初始化本地 Reranker (连接 vLLM/TEI)
         self.reranker = LocalReranker(
             top_n=5,               # 最终给大模型看前 5 个最相关的块
             score_threshold=0.3    # 过滤掉相关度太低的噪音
         )
+        if rerank_mode not in ("full", "cascade"):
+            raise ValueError(f"不支持的 rerank_mode: {rerank_mode}，可选: full, cascade")
+        self.rerank_mode = rerank_mode
+        self.cascade = CascadeReranker(self.reranker, enabled=rerank_mode == "cascade", **(cascade_options or {}))
+
+        # 3. 最终 (Rerank 后) 结果缓存，Key = (规范化问题, 索引版本)
+        self.result_cache = TTLCache(maxsize=result_cache_size, ttl=result_cache_ttl)
+        self._index_version: Optional[str] = None
+
+        # 4. 混合检索配置 (BM25 倒排索引随向量库一起构建，这里只加载一次)
+        self.hybrid = hybrid
+        self.dense_k = dense_k
+        self.lexical_k = lexical_k
+        self.rerank_candidates = rerank_candidates
+        self._lexical_index = None
+        self._lexical_loaded = False
+
+        # 5. 分阶段耗时统计 (最近 1000 次查询)
+        self.log_timings = log_timings
+        self.timing_stats = TimingStats()
+
+    def _get_lexical_index(self):
+        if not self.hybrid:
+            return None
+        if not self._lexical_loaded:
+            self._lexical_index = self.db_manager.load_lexical_index()
+            self._lexical_loaded = True
+            if self._lexical_index is None:
+                print("[Search] 未找到 BM25 词法索引，使用纯向量检索 (重建或更新索引后生效)。")
+        return self._lexical_index
+
+    def _dense_k(self) -> int:
+        # 有词法索引兜底精确匹配时，可以减少向量候选数；否则保持原来的 Top 20
+        return self.dense_k if self._get_lexical_index() is not None else 20
+
+    def _lexical_search(self, query: str, timer: StageTimer) -> List[Document]:
+        """
+        BM25 检索，命中的 Chunk 按 ID 从向量库取回正文。
+        """
+        index = self._get_lexical_index()
+        if index is None:
+            return []
+        with timer.stage("lexical"):
+            hits = index.search(query, k=self.lexical_k)
+            return self.db_manager.get_documents([chunk_id for chunk_id, _ in hits])
+
+    def _lexical_search_batch(self, queries: List[str], timer: StageTimer) -> List[List[Document]]:
+        """
+        _lexical_search 的批量版本：所有问题命中的 Chunk 合并后一次取回正文，每个问题拿到独立的副本。
+        """
+        index = self._get_lexical_index()
+        if index is None:
+            return [[] for _ in queries]
+        with timer.stage("lexical"):
+            hits = [[chunk_id for chunk_id, _ in index.search(query, k=self.lexical_k)] for query in queries]
+            found = self.db_manager.get_documents_map(list(dict.fromkeys(i for ids in hits for i in ids)))
+            return [self._copy_docs([found[i] for i in ids if i in found]) for ids in hits]
+
+    def _fuse(self, dense: List[Document], lexical: List[Document]) -> List[Document]:
+        """
+        用 RRF 融合向量和 BM25 两路候选，去重后保留前 rerank_candidates 个。
+        """
+        if not lexical:
+            return dense
+
+        def key(doc):
+            return doc.metadata.get("chunk_id") or doc.page_content
+
+        by_key = {}
+        for doc in dense + lexical:
+            by_key.setdefault(key(doc), doc)
+        fused = reciprocal_rank_fusion([[key(d) for d in dense], [key(d) for d in lexical]])
+        return [by_key[k] for k in fused[:self.rerank_candidates]]
+
+    def _sync_index_version(self) -> str:
+        """
+        检查索引版本，发生变化 (重建 / 增量同步) 时清空查询向量缓存和结果缓存。
+        """
+        version = self.db_manager.index_version
+        if version != self._index_version:
+            if self._index_version is not None:
+                print(f"[Search] 索引版本变化 ({self._index_version} -> {version})，清空检索缓存。")
+            self.result_cache.clear()
+            self.db_manager.embedding_fn.query_cache.clear()
+            self._lexical_loaded = False
+            self._index_version = version
+        return version
+
+    def _store_result(self, key, docs: List[Document], budget: Optional[RequestBudget]):
+        # Rerank 服务失败时返回的是未打分的原始排序，这种降级结果不缓存；因负载 / 超时降级的结果同样不缓存
+        if budget is not None and budget.degraded:
+            return
+        if all("relevance_score" in doc.metadata for doc in docs):
+            self.result_cache.set(key, docs)
+
+    def _dense_options(self, budget: Optional[RequestBudget]) -> dict:
+        """
+        按请求的延迟预算 / 准入时的负载决定向量检索的降级：
+        reduce_fetch_k 只取 2k 个候选 (不再自适应扩大到 4k)，skip_mmr 只取 k 个候选、直接按相似度排序。
+        """
+        if budget is None:
+            return {}
+        options = {}
+        if budget.should("reduce_fetch_k"):
+            options["fetch_k"] = self._dense_k() * 2
+        if budget.should("skip_mmr"):
+            options.update(fetch_k=self._dense_k(), use_mmr=False)
+        return options
+
+    def _skip_rerank(self, docs: List[Document], query: str, budget: Optional[RequestBudget],
+                     timer: StageTimer) -> Optional[List[Document]]:
+        # 剩余预算不够 Rerank 或负载过高时，直接用融合后的排序
+        if budget is None or not budget.should("skip_rerank"):
+            return None
+        self._log_rerank_path(query, "skipped", timer)
+        return docs[:self.reranker.top_n]
+
+    def _log_rerank_path(self, query: str, path: str, timer: StageTimer):
+        timer.note(rerank_path=path)
+        if self.rerank_mode == "cascade":
+            print(f"[Rerank] '{query[:30]}' 路径: {path}")
+
+    def _rerank(self, docs: List[Document], query: str, timer: StageTimer) -> List[Document]:
+        with timer.stage("rerank"):
+            if self.cascade.enabled:
+                self.db_manager.attach_dense_scores(query, docs)
+            results, path = self.cascade.compress_documents(docs, query)
+        self._log_rerank_path(query, path, timer)
+        return results
+
+    async def _arerank(self, docs: List[Document], query: str, timer: StageTimer) -> List[Document]:
+        with timer.stage("rerank"):
+            if self.cascade.enabled:
+                await asyncio.to_thread(self.db_manager.attach_dense_scores, query, docs)
+            results, path = await self.cascade.acompress_documents(docs, query)
+        self._log_rerank_path(query, path, timer)
+        return results
+
+    @staticmethod
+    def _note_candidates(timer: StageTimer, dense, lexical, fused, final):
+        timer.note(dense=len(dense), lexical=len(lexical), fused=len(fused), final=len(final))
+
+    def _finish_timing(self, query: str, timer: StageTimer, trace: Optional[RequestTrace] = None):
+        self.timing_stats.record(timer)
+        for name, ms in timer.timings.items():
+            STAGE_SECONDS.observe(ms / 1000, stage=name)
+        for source in ("dense", "lexical", "fused", "final"):
+            if source in timer.notes:
+                CANDIDATES.inc(timer.notes[source], source=source)
+        if trace is not None:
+            trace.merge_timer(timer)
+        if self.log_timings:
+            print(f"[Search] '{query[:30]}' 耗时: {timer.format()}")
+
+    @staticmethod
+    def _copy_docs(docs: List[Document]) -> List[Document]:
+        # 返回副本，避免下游修改缓存中的 Document
+        return [Document(page_content=doc.page_content, metadata=dict(doc.metadata)) for doc in docs]
+
+    def search(self, query: str, trace: Optional[RequestTrace] = None) -> List[Document]:
+        """
+        检索流程：VectorDB (MMR) + BM25 -> RRF 融合 -> Reranker (Top 5)，相同问题直接返回缓存结果。
+        当前请求带有延迟预算 (RequestBudget) 时，按剩余预算和负载逐级降级：减少 fetch_k、跳过 MMR、跳过 Rerank。
+        :param trace: 可选，分阶段耗时和候选数会合并进该请求的 RequestTrace
+        """
+        timer = StageTimer()
+        key = (normalize_query(query), self._sync_index_version())
+        budget = current_budget()
+
+        cached = self.result_cache.get(key)
+        timer.note(cache_hit=cached is not None)
+        if cached is None:
+            dense = self.db_manager.mmr_search(query, k=self._dense_k(), timer=timer, **self._dense_options(budget))
+            lexical = self._lexical_search(query, timer)
+            docs = self._fuse(dense, lexical)
+            cached = self._skip_rerank(docs, query, budget, timer)
+            if cached is None:
+                cached = self._rerank(docs, query, timer)
+            self._note_candidates(timer, dense, lexical, docs, cached)
+            self._store_result(key, cached, budget)
+
+        self._finish_timing(query, timer, trace)
+        return self._copy_docs(cached)
+
+    async def asearch(self, query: str, trace: Optional[RequestTrace] = None) -> List[Document]:
+        """
+        search 的异步版本：查询向量和 Rerank 走异步 HTTP，向量检索和 BM25 在线程池中并行执行。
+        """
+        timer = StageTimer()
+        key = (normalize_query(query), self._sync_index_version())
+        budget = current_budget()
+
+        cached = self.result_cache.get(key)
+        timer.note(cache_hit=cached is not None)
+        if cached is None:
+            dense, lexical = await asyncio.gather(
+                self.db_manager.amax_marginal_relevance_search(query, k=self._dense_k(), timer=timer,
+                                                               **self._dense_options(budget)),
+                asyncio.to_thread(self._lexical_search, query, timer),
+            )
+            docs = self._fuse(dense, lexical)
+            cached = self._skip_rerank(docs, query, budget, timer)
+            if cached is None:
+                cached = await self._arerank(docs, query, timer)
+            self._note_candidates(timer, dense, lexical, docs, cached)
+            self._store_result(key, cached, budget)
+
+        self._finish_timing(query, timer, trace)
+        return self._copy_docs(cached)
+
+    def batch_retrieve(self, queries: Sequence[str], batch_size: int = 128,
+                       rerank_pairs: int = 512) -> Iterator[dict]:
+        """
+        批量检索 (离线评测 / 批量查询)。流程和结果与逐条 search 一致，但按批执行：
+        1. 问题向量按大批请求 (embed_queries，不经过 MicroBatcher)；
+        2. 向量检索一次完成 (numpy 后端一次矩阵乘法，Chroma 一次 query 调用)，BM25 命中的正文一次取回；
+        3. 各问题第一轮要打分的 (问题, 候选) 对打包成少量大的 /score 调用 (score_many)，
+           之后逐个问题走原来的 Rerank / 级联逻辑 (直接命中分数缓存)。
+        分数缓存关闭 (score_cache_size=0) 时第 3 步退化为逐个问题调用 /score。
+        :param batch_size: 每批的问题数 (numpy 后端一次矩阵乘法的查询数)
+        :param rerank_pairs: 每次 /score 调用最多的 (问题, 候选) 对数
+        :return: 按输入顺序逐条产出 {"index", "query", "documents", "cache_hit", "timings"}，
+                 timings 为所在批次各阶段耗时按问题数均摊后的毫秒数
+        """
+        for start in range(0, len(queries), batch_size):
+            yield from self._retrieve_batch(list(queries[start:start + batch_size]), start, rerank_pairs)
+
+    def _retrieve_batch(self, queries: List[str], offset: int, rerank_pairs: int) -> Iterator[dict]:
+        timer = StageTimer()
+        version = self._sync_index_version()
+        keys = [(normalize_query(query), version) for query in queries]
+        results = [self.result_cache.get(key) if query else [] for query, key in zip(queries, keys)]
+        todo = [i for i, docs in enumerate(results) if docs is None]
+        fresh = set(todo)
+
+        if todo:
+            texts = [queries[i] for i in todo]
+            with timer.stage("embed_query"):
+                embeddings = self.db_manager.embedding_fn.embed_queries(texts)
+            dense = self.db_manager.mmr_search_by_vectors(embeddings, k=self._dense_k(), timer=timer)
+            lexical = self._lexical_search_batch(texts, timer)
+            fused = [self._fuse(d, l) for d, l in zip(dense, lexical)]
+
+            with timer.stage("rerank"):
+                if self.cascade.enabled:
+                    for text, embedding, docs in zip(texts, embeddings, fused):
+                        self.db_manager.attach_dense_scores(text, docs, query_vector=embedding)
+                self.reranker.score_many([(self.cascade.first_batch(docs), text) for text, docs in zip(texts, fused)],
+                                         max_pairs=rerank_pairs)
+                for i, text, docs_dense, docs_lexical, docs in zip(todo, texts, dense, lexical, fused):
+                    final, path = self.cascade.compress_documents(docs, text)
+                    CANDIDATES.inc(len(docs_dense), source="dense")
+                    CANDIDATES.inc(len(docs_lexical), source="lexical")
+                    CANDIDATES.inc(len(docs), source="fused")
+                    CANDIDATES.inc(len(final), source="final")
+                    self._store_result(keys[i], final, None)
+                    results[i] = final
+
+        timings = {name: ms / len(queries) for name, ms in timer.timings.items()}
+        if self.log_timings:
+            print(f"[Search] 批量检索 {len(queries)} 个问题 (新检索 {len(todo)} 个) 耗时: {timer.format()}")
+        for i, (query, docs) in enumerate(zip(queries, results)):
+            yield {"index": offset + i, "query": query, "documents": self._copy_docs(docs),
+                   "cache_hit": i not in fresh, "timings": timings}
 
     def get_retriever(self):
         """
-        返回一个“压缩检索器” (Compression Retriever)。
-        流程：VectorDB (Top 20) -> Reranker (Top 5) -> LLM
+        返回供 LCEL 链使用的检索器。
+        流程：VectorDB (MMR) + BM25 -> RRF -> Reranker (Top 5) -> LLM
         """
-        # 基础检索器：使用 MMR 获取多样化的 Top 20
-        base_retriever = self.db_manager.get_retriever(search_type="mmr", k=20)
-        
-        # 组合检索器：将 Reranker 挂载到基础检索器之上
-        compression_retriever = ContextualCompressionRetriever(
-            base_compressor=self.reranker,
-            base_retriever=base_retriever
-        )
-        
-        return compression_retriever
\ No newline at end of file
+        # 提前打开向量库，索引不存在时在构建阶段就报错
+        self.db_manager.load_index()
+        return SearchEngineRetriever(engine=self)
+
+    def timing_summary(self) -> dict:
+        """
+        最近查询各阶段 (embed_query / vector_search / mmr / lexical / rerank) 的 p50 / p95 / p99 耗时。
+        """
+        return self.timing_stats.summary()
+
+    def close(self):
+        """
+        释放 Embedding / Reranker 的后台线程、HTTP 连接池和 Embedding 缓存连接 (引擎切换到新索引后关闭旧实例)。
+        """
+        self.db_manager.embedding_fn.close()
+        self.reranker.close()
+
+    def cache_stats(self) -> dict:
+        """
+        查询向量缓存、检索结果缓存和 Rerank 分数缓存的命中统计，用于评估缓存容量。
+        """
+        return {
+            "query_embedding": self.db_manager.embedding_fn.query_cache.stats(),
+            "retrieval": self.result_cache.stats(),
+            "rerank": self.reranker.stats(),
+            "rerank_paths": self.cascade.stats(),
+        }
@@ -0,0 +1,198 @@
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+
+try:
+    from src.utils.metrics import REGISTRY
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+    from src.utils.metrics import REGISTRY
+
+BATCH_SIZE = REGISTRY.histogram(
+    "rag_microbatch_size", "Items (texts / query-candidate pairs) per coalesced upstream call", ["service"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+BATCH_WAIT_SECONDS = REGISTRY.histogram(
+    "rag_microbatch_queue_wait_seconds", "Time a request waited in the micro-batch queue", ["service"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+
+
+def default_wait_ms() -> float:
+    """
+    攒批窗口 (毫秒)，读取环境变量 MICRO_BATCH_WAIT_MS (未设置时为 5)。
+    """
+    return float(os.getenv("MICRO_BATCH_WAIT_MS", "5"))
+
+
+_CLOSE = object() # 放进队列通知后台线程退出
+
+
+class _Pending:
+    __slots__ = ("item", "size", "future", "enqueued")
+
+    def __init__(self, item: Any, size: int):
+        self.item = item
+        self.size = size
+        self.future = Future()
+        self.enqueued = time.perf_counter()
+
+
+class MicroBatcher:
+    """
+    跨请求的动态微批：并发请求各自提交一个小任务 (一个问题的 Embedding、一组 (问题, 候选) 的打分)，
+    后台线程把短时间内到达的任务合并成一次上游调用，再把结果切片交还各自的调用方。
+
+    - 上游空闲 (没有在途的批次) 时立即发送，低负载下不增加延迟；
+    - 上游忙时最多等待 max_wait_ms 或攒够 max_batch_size 再发送，负载越高批次越大；
+    - 最多 max_concurrency 个批次同时在途，全部占满时新任务在队列里继续合并；
+    - 批处理函数抛出异常时，该批次所有调用方收到同一个异常；
+    - 已放弃等待的调用方 (Future 被取消，例如异步调用超时) 在出队时被剔除，不影响同批次的其他调用方。
+    同步调用方等待 submit() 返回的 Future，异步调用方 await asyncio.wrap_future(...)。
+    不再使用时调用 close() 结束后台线程 (已提交的任务先处理完)。
+    """
+
+    def __init__(self, name: str, fn: Callable[[List[Any]], List[Any]], max_batch_size: int = 32,
+                 max_wait_ms: Optional[float] = None, max_concurrency: int = 4,
+                 size_of: Optional[Callable[[Any], int]] = None):
+        """
+        :param name: 服务名 (指标标签 service)
+        :param fn: 批处理函数，输入任务列表，返回等长的结果列表
+        :param max_batch_size: 每个批次的容量上限 (按 size_of 计，单个超大任务独占一个批次)
+        :param max_wait_ms: 上游忙时的攒批窗口 (毫秒)，默认见 default_wait_ms
+        :param max_concurrency: 同时在途的批次数
+        :param size_of: 任务的大小 (默认每个任务计 1)
+        """
+        self.name = name
+        self.fn = fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = (default_wait_ms() if max_wait_ms is None else max_wait_ms) / 1000
+        self.max_concurrency = max(1, max_concurrency)
+        self.size_of = size_of or (lambda item: 1)
+
+        self._queue: "queue.Queue[_Pending]" = queue.Queue()
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._inflight = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._closed = False
+        self.batches = 0
+        self.items = 0
+
+    def _ensure_started(self):
+        # 懒启动；fork 出的子进程没有父进程的线程，需要重新启动
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._slots = threading.BoundedSemaphore(self.max_concurrency)
+            self._inflight = 0
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                                thread_name_prefix=f"batch-{self.name}")
+            threading.Thread(target=self._dispatch_loop, name=f"batcher-{self.name}", daemon=True).start()
+            self._pid = os.getpid()
+
+    def submit(self, item: Any) -> Future:
+        if not self._closed:
+            self._ensure_started()
+        pending = _Pending(item, self.size_of(item))
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"MicroBatcher ({self.name}) 已关闭")
+            self._queue.put(pending)
+        return pending.future
+
+    def close(self):
+        """
+        停止接收新任务；后台线程处理完队列中已有的任务后退出，线程池随之关闭。
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            if self._pid == os.getpid():
+                self._queue.put(_CLOSE)
+
+    def __call__(self, item: Any) -> Any:
+        return self.submit(item).result()
+
+    def _collect(self, first: _Pending) -> tuple:
+        """
+        从 first 开始攒一个批次，返回 (批次, 放不下留给下一批的任务)。
+        """
+        batch, size = [first], first.size
+        busy = self._inflight > 0
+        deadline = first.enqueued + self.max_wait
+        while size < self.max_batch_size:
+            try:
+                if busy:
+                    pending = self._queue.get(timeout=max(deadline - time.perf_counter(), 0))
+                else:
+                    pending = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if pending is _CLOSE or size + pending.size > self.max_batch_size:
+                return batch, pending
+            if not pending.future.set_running_or_notify_cancel():
+                continue
+            batch.append(pending)
+            size += pending.size
+        return batch, None
+
+    def _dispatch_loop(self):
+        carry = None
+        while True:
+            first = carry or self._queue.get()
+            carry = None
+            if first is _CLOSE:
+                # 已经提交的批次继续执行完，空闲的工作线程随即退出
+                self._executor.shutdown(wait=False)
+                return
+            # 出队时把 Future 标记为运行中 (之后不能再被取消)；已被取消的直接丢弃
+            if not first.future.set_running_or_notify_cancel():
+                continue
+            self._slots.acquire()
+            batch, carry = self._collect(first)
+            with self._lock:
+                self._inflight += 1
+            self._executor.submit(self._run, batch)
+
+    def _run(self, batch: List[_Pending]):
+        batch = [pending for pending in batch if not pending.future.done()]
+        if not batch:
+            self._release()
+            return
+        started = time.perf_counter()
+        for pending in batch:
+            BATCH_WAIT_SECONDS.observe(started - pending.enqueued, service=self.name)
+        BATCH_SIZE.observe(sum(pending.size for pending in batch), service=self.name)
+        self.batches += 1
+        self.items += len(batch)
+        try:
+            results = self.fn([pending.item for pending in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"批处理函数返回了 {len(results)} 个结果，预期 {len(batch)} 个")
+        except BaseException as e:
+            for pending in batch:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
+        else:
+            for pending, result in zip(batch, results):
+                if not pending.future.done():
+                    pending.future.set_result(result)
+        finally:
+            self._release()
+
+    def _release(self):
+        with self._lock:
+            self._inflight -= 1
+        self._slots.release()
+
+    def stats(self) -> dict:
+        return {"batches": self.batches, "items": self.items,
+                "avg_batch": self.items / self.batches if self.batches else 0.0}
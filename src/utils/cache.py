@@ -0,0 +1,73 @@
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+def normalize_query(text: str) -> str:
+    """
+    查询文本规范化 (用作缓存 Key)：NFKC 统一全角/半角，合并空白，去掉首尾空白和结尾问号。
+    """
+    text = unicodedata.normalize("NFKC", str(text))
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip("?").strip()
+
+
+class TTLCache:
+    """
+    线程安全的内存缓存：LRU 容量淘汰 + 可选 TTL 过期，并统计命中率。
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        """
+        :param maxsize: 最大条目数，超出后淘汰最久未使用的条目
+        :param ttl: 过期时间 (秒)，None 表示不过期
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires_at = item
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any):
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+        }
@@ -0,0 +1,162 @@
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence
+
+try:
+    from src.utils.metrics import DEGRADATIONS
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+    from src.utils.metrics import DEGRADATIONS
+
+# 请求的各阶段依次执行，按比例分配端到端延迟预算 (llm_ttft 指从检索结束到大模型首 Token)
+STAGES = ("embed_query", "retrieve", "rerank", "llm_ttft")
+DEFAULT_SHARES = {"embed_query": 0.05, "retrieve": 0.10, "rerank": 0.15, "llm_ttft": 0.70}
+
+# 逐级降级的动作：负载达到第 n 级时启用前 n 个；时间不够 (剩余预算已覆盖不了某阶段及之后的份额) 时单独启用
+DEGRADE_ACTIONS = ("reduce_fetch_k", "skip_mmr", "skip_rerank")
+# 动作 -> 剩余预算低于哪个阶段 (含) 之后所有份额之和时触发
+_TIME_RULES = {"reduce_fetch_k": "retrieve", "skip_mmr": "rerank", "skip_rerank": "llm_ttft"}
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    请求超出端到端延迟预算。
+    """
+
+
+class ServerBusy(RuntimeError):
+    """
+    系统已满载，请求被直接拒绝 (不排队)。
+    """
+
+
+class RequestBudget:
+    """
+    单个请求的端到端延迟预算：
+    - timeout(stage)：某阶段可用的超时时间 = min(剩余预算, 该阶段的份额)，预算耗尽时抛出 DeadlineExceeded；
+    - should(action)：是否执行某个降级动作 (按准入时的负载级别或剩余预算判断)，
+      每个动作每个请求只计数一次 (rag_degradations_total)，并记录在 degraded 中。
+    """
+
+    def __init__(self, budget_ms: float, load_level: int = 0, shares: Optional[Dict[str, float]] = None):
+        self.budget_ms = budget_ms
+        self.load_level = load_level
+        self.shares = shares or DEFAULT_SHARES
+        self.deadline = time.perf_counter() + budget_ms / 1000
+        self.degraded: List[str] = []
+
+    def remaining_ms(self) -> float:
+        return (self.deadline - time.perf_counter()) * 1000
+
+    def stage_ms(self, stage: str) -> float:
+        return self.budget_ms * self.shares.get(stage, 1.0)
+
+    def _reserve_ms(self, stage: str) -> float:
+        # stage 及之后各阶段的份额之和
+        return self.budget_ms * sum(self.shares[name] for name in STAGES[STAGES.index(stage):])
+
+    def timeout(self, stage: str, cap: Optional[float] = None) -> float:
+        """
+        :param cap: 上限 (秒)，例如客户端自己的 HTTP 超时
+        :return: 该阶段可用的时间 (秒)
+        """
+        remaining = self.remaining_ms()
+        if remaining <= 0:
+            self.note("deadline_exceeded")
+            raise DeadlineExceeded(f"请求超出延迟预算 {self.budget_ms:.0f} ms (阶段 {stage})")
+        seconds = min(remaining, self.stage_ms(stage)) / 1000
+        return seconds if cap is None else min(seconds, cap)
+
+    def note(self, action: str):
+        if action not in self.degraded:
+            self.degraded.append(action)
+            DEGRADATIONS.inc(action=action)
+
+    def should(self, action: str) -> bool:
+        if action in self.degraded:
+            return True
+        by_load = self.load_level > DEGRADE_ACTIONS.index(action)
+        by_time = self.remaining_ms() < self._reserve_ms(_TIME_RULES[action])
+        if by_load or by_time:
+            self.note(action)
+            return True
+        return False
+
+
+_current: ContextVar[Optional[RequestBudget]] = ContextVar("rag_request_budget", default=None)
+
+
+def current_budget() -> Optional[RequestBudget]:
+    """
+    当前请求的延迟预算 (由 RAGEngine 在生成回答时设置，检索 / Embedding / Rerank 在调用链深处读取)。
+    """
+    return _current.get()
+
+
+@contextmanager
+def use_budget(budget: Optional[RequestBudget]):
+    token = _current.set(budget)
+    try:
+        yield budget
+    finally:
+        _current.reset(token)
+
+
+def stage_timeout(stage: str, default: float) -> float:
+    """
+    某阶段的超时时间 (秒)：没有预算时返回 default，否则取 min(default, 预算给该阶段的时间)。
+    """
+    budget = current_budget()
+    return default if budget is None else budget.timeout(stage, cap=default)
+
+
+class AdmissionController:
+    """
+    准入控制：限制同时生成回答的请求数，超出时直接拒绝 (ServerBusy)，不无限排队；
+    准入时按当前负载 (在途数 / 上限) 确定降级级别，负载越高降级越多。
+    """
+
+    def __init__(self, max_inflight: Optional[int] = None, budget_ms: Optional[float] = None,
+                 degrade_at: Sequence[float] = (0.5, 0.7, 0.85)):
+        """
+        :param max_inflight: 同时生成回答的请求数上限，默认读取环境变量 MAX_INFLIGHT_REQUESTS (未设置时为 16)，<= 0 表示不限
+        :param budget_ms: 每个请求的端到端延迟预算 (毫秒)，默认读取环境变量 REQUEST_BUDGET_MS (未设置时为 20000)，<= 0 表示不限
+        :param degrade_at: 负载达到这些比例时依次启用 DEGRADE_ACTIONS 中的降级动作
+        """
+        self.max_inflight = int(os.getenv("MAX_INFLIGHT_REQUESTS", "16")) if max_inflight is None else max_inflight
+        self.budget_ms = float(os.getenv("REQUEST_BUDGET_MS", "20000")) if budget_ms is None else budget_ms
+        self.degrade_at = tuple(degrade_at)
+        self.inflight = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def load(self) -> float:
+        return self.inflight / self.max_inflight if self.max_inflight > 0 else 0.0
+
+    def saturated(self) -> bool:
+        return 0 < self.max_inflight <= self.inflight
+
+    def try_admit(self) -> Optional[RequestBudget]:
+        """
+        :return: 本次请求的 RequestBudget；已满载时返回 None (调用方决定返回缓存还是拒绝)
+        """
+        with self._lock:
+            if self.saturated():
+                self.rejected += 1
+                return None
+            load = self.load()
+            self.inflight += 1
+        level = sum(1 for threshold in self.degrade_at if load >= threshold)
+        budget_ms = self.budget_ms if self.budget_ms > 0 else float("inf")
+        return RequestBudget(budget_ms, load_level=level)
+
+    def release(self):
+        with self._lock:
+            self.inflight = max(self.inflight - 1, 0)
+
+    def stats(self) -> dict:
+        return {"inflight": self.inflight, "max_inflight": self.max_inflight, "rejected": self.rejected}
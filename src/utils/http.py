@@ -0,0 +1,40 @@
+import asyncio
+import weakref
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def create_session(pool_size: int = 10, headers: dict = None) -> requests.Session:
+    """
+    创建带连接池的 HTTP Session (Keep-Alive 复用 TCP 连接)。
+    :param pool_size: 每个 host 的最大连接数，应不小于并发请求数。
+    :param headers: 所有请求共用的默认请求头。
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
+
+
+# 每个事件循环共享一个异步 HTTP 客户端 (httpx 的连接池不能跨事件循环使用)
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+
+def get_async_client(max_connections: int = 100) -> httpx.AsyncClient:
+    """
+    获取当前事件循环共享的 httpx.AsyncClient (Keep-Alive 连接池)。
+    必须在协程内调用。
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+        _async_clients[loop] = client
+    return client
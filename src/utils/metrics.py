@@ -0,0 +1,246 @@
+import bisect
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# 默认的耗时分桶 (秒)，覆盖 1ms 的缓存命中到 30s 的长回答
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 的标签应为 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """
+    只增不减的计数器 (请求数、缓存命中数、Token 数等)。
+    """
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}"
+                                for k, v in items]
+
+
+class Histogram(_Metric):
+    """
+    分桶直方图 (耗时、候选数)，Prometheus 端可用 histogram_quantile 计算 p50 / p95 / p99。
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # {labels: [各桶计数..., sum, count]}
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        lines = self.header()
+        for key, state in items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {_format_value(cumulative)}")
+            labels = _format_labels(self.labelnames, key, ("le", "+Inf"))
+            lines.append(f"{self.name}_bucket{labels} {_format_value(state[-1])}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {_format_value(state[-1])}")
+        return lines
+
+
+# 采集回调：抓取时调用，返回 [(指标名, 类型, 说明, {标签}, 值)]，用于导出已有的统计量 (如缓存命中数)
+Collector = Callable[[], Iterable[Tuple[str, str, str, Dict[str, str], float]]]
+
+
+class MetricsRegistry:
+    """
+    进程内指标注册表，按 Prometheus 文本格式 (0.0.4) 导出。
+    同名指标只创建一次，重复注册返回已有对象，方便各模块在导入时直接声明。
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: Dict[str, Collector] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"指标 {name} 已注册为 {metric.kind}")
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def register_collector(self, key: str, collector: Collector):
+        """
+        注册 (或替换) 一个抓取时执行的采集回调。
+        """
+        with self._lock:
+            self._collectors[key] = collector
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+
+        collected: Dict[str, Tuple[str, str, List[str]]] = {}
+        for collector in collectors:
+            try:
+                samples = list(collector())
+            except Exception as e:
+                print(f"[Metrics] 采集回调执行失败: {e}")
+                continue
+            for name, kind, documentation, labels, value in samples:
+                entry = collected.setdefault(name, (kind, documentation, []))
+                entry[2].append(f"{name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}")
+        for name, (kind, documentation, samples) in collected.items():
+            lines += [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}", *samples]
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# ==========================================
+# 各模块共用的指标
+# ==========================================
+STAGE_SECONDS = REGISTRY.histogram(
+    "rag_stage_seconds", "Latency of each RAG request stage", ["stage"])
+REQUEST_SECONDS = REGISTRY.histogram(
+    "rag_request_seconds", "End-to-end latency of answered questions", ["status"])
+TTFT_SECONDS = REGISTRY.histogram(
+    "rag_time_to_first_token_seconds", "Time from question to first streamed token")
+UPSTREAM_SECONDS = REGISTRY.histogram(
+    "rag_upstream_request_seconds", "Latency of calls to model services", ["service"])
+UPSTREAM_ERRORS = REGISTRY.counter(
+    "rag_upstream_errors_total", "Failed calls to model services", ["service"])
+CANDIDATES = REGISTRY.counter(
+    "rag_retrieval_candidates_total", "Retrieved candidates per retrieval step", ["source"])
+TOKENS = REGISTRY.counter(
+    "rag_llm_tokens_total", "Streamed LLM tokens (chunks)", ["kind"])
+ERRORS = REGISTRY.counter(
+    "rag_errors_total", "Errors raised while answering or indexing", ["component"])
+ANSWERS = REGISTRY.counter(
+    "rag_answers_total", "Answered questions by source (generated / coalesced / cache)", ["source"])
+DEGRADATIONS = REGISTRY.counter(
+    "rag_degradations_total", "Requests degraded or shed because of load or deadline pressure", ["action"])
+INGEST_SECONDS = REGISTRY.histogram(
+    "rag_ingest_batch_seconds", "Latency of each ingestion batch", ["stage"])
+INGEST_ITEMS = REGISTRY.counter(
+    "rag_ingest_items_total", "Documents and chunks processed by ingestion", ["stage"])
+
+
+# ==========================================
+# /metrics HTTP 服务
+# ==========================================
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+_server: Optional[ThreadingHTTPServer] = None
+
+
+def start_metrics_server(port: Optional[int] = None, host: str = "0.0.0.0") -> Optional[ThreadingHTTPServer]:
+    """
+    在后台线程启动 /metrics 服务 (与 Gradio 应用同进程)。
+    端口默认读取环境变量 METRICS_PORT (未设置时为 9464)，设置为 0 表示不启动。重复调用只启动一次。
+    """
+    global _server
+    if _server is not None:
+        return _server
+    port = int(os.getenv("METRICS_PORT", "9464")) if port is None else port
+    if port <= 0:
+        return None
+    _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"[Metrics] 指标服务已启动: http://{host}:{_server.server_address[1]}/metrics")
+    return _server
@@ -0,0 +1,83 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+import numpy as np
+
+
+class StageTimer:
+    """
+    单次请求的分阶段计时 (毫秒)。同名阶段多次进入时累加。
+    notes 用于记录与耗时相关的附加信息 (例如本次实际使用的 fetch_k)。
+    """
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+        self.notes: Dict[str, Any] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+    def note(self, **kwargs):
+        self.notes.update(kwargs)
+
+    def format(self) -> str:
+        parts = [f"{name} {ms:.1f}ms" for name, ms in self.timings.items()]
+        parts += [f"{key}={value}" for key, value in self.notes.items()]
+        return " | ".join(parts)
+
+
+def percentiles(values) -> Dict[str, float]:
+    """
+    一组耗时 (毫秒) 的次数和 p50 / p95 / p99。
+    """
+    if len(values) == 0:
+        return {"count": 0, "p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"count": len(values), "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)}
+
+
+def peak_rss_mb() -> float:
+    """
+    当前进程的 RSS 峰值 (MB)。
+    读取 /proc/self/status 的 VmHWM (ru_maxrss 会继承父进程的值)，非 Linux 系统返回 0。
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+class TimingStats:
+    """
+    最近 N 次请求的分阶段耗时汇总 (线程安全)，用于查看各阶段的 p50 / p95 / p99。
+    """
+
+    def __init__(self, window: int = 1000):
+        self._records = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, timer: Optional[StageTimer]):
+        if timer is not None and timer.timings:
+            with self._lock:
+                self._records.append(dict(timer.timings))
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            records = list(self._records)
+        stages: Dict[str, list] = {}
+        for record in records:
+            for name, ms in record.items():
+                stages.setdefault(name, []).append(ms)
+        return {name: percentiles(values) for name, values in stages.items()}
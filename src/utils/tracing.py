@@ -0,0 +1,226 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+try:
+    from src.utils.metrics import ERRORS, REQUEST_SECONDS, STAGE_SECONDS, TOKENS, TTFT_SECONDS
+    from src.utils.timing import StageTimer
+except ImportError:
+    import sys
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+    from src.utils.metrics import ERRORS, REQUEST_SECONDS, STAGE_SECONDS, TOKENS, TTFT_SECONDS
+    from src.utils.timing import StageTimer
+
+# LCEL 链中需要单独计时的步骤 (Runnable 名称 -> 阶段名)
+CHAIN_STAGES = {"format_docs": "format_docs", "ChatPromptTemplate": "prompt"}
+
+
+class SlowQueryLog:
+    """
+    慢查询日志：总耗时超过阈值的请求，把分阶段耗时、候选数、缓存命中等明细追加写入 JSON Lines 文件。
+    """
+
+    def __init__(self, path: Optional[str] = None, threshold_ms: Optional[float] = None):
+        """
+        :param path: 日志文件路径，默认读取环境变量 SLOW_QUERY_LOG (未设置时为 ./logs/slow_queries.jsonl)
+        :param threshold_ms: 慢查询阈值 (毫秒)，默认读取环境变量 SLOW_QUERY_MS (未设置时为 3000)，<= 0 表示关闭
+        """
+        self.path = path or os.getenv("SLOW_QUERY_LOG", "./logs/slow_queries.jsonl")
+        self.threshold_ms = float(os.getenv("SLOW_QUERY_MS", "3000")) if threshold_ms is None else threshold_ms
+        self._lock = threading.Lock()
+
+    def record(self, trace: "RequestTrace"):
+        if self.threshold_ms <= 0 or trace.total_ms is None or trace.total_ms < self.threshold_ms:
+            return
+        entry = trace.to_dict()
+        print(f"[SlowQuery] '{trace.question[:30]}' 耗时 {trace.total_ms:.0f} ms: "
+              + ", ".join(f"{name} {ms:.0f}ms" for name, ms in trace.stages.items()))
+        try:
+            with self._lock:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"[SlowQuery] 写入慢查询日志失败: {e}")
+
+
+SLOW_QUERY_LOG = SlowQueryLog()
+
+
+class RequestTrace:
+    """
+    单个问题从提问到回答结束的分阶段耗时 (毫秒) 和附加信息。
+    检索内部的阶段 (embed_query / vector_search / mmr / lexical / rerank) 由 SearchEngine 合并进来，
+    链上的阶段 (retrieve / format_docs / prompt / llm_ttft / llm_stream) 由 TracingCallbackHandler 记录。
+    """
+
+    def __init__(self, question: str, slow_log: Optional[SlowQueryLog] = None):
+        self.question = question
+        self.slow_log = slow_log or SLOW_QUERY_LOG
+        self.started = time.perf_counter()
+        self.timestamp = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+        self.stages: Dict[str, float] = {}
+        self.notes: Dict[str, Any] = {}
+        self.documents: Optional[list] = None # 检索到的文档 (即送入上下文的候选)，由 TracingCallbackHandler 记录
+        self.tokens = 0
+        self.ttft_ms: Optional[float] = None
+        self.total_ms: Optional[float] = None
+        self.status = "running"
+        self.error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def add_stage(self, name: str, ms: float):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + ms
+        STAGE_SECONDS.observe(ms / 1000, stage=name)
+
+    def merge_timer(self, timer: StageTimer):
+        # 检索阶段的指标已经由 SearchEngine 记录，这里只合并明细
+        with self._lock:
+            for name, ms in timer.timings.items():
+                self.stages[name] = self.stages.get(name, 0.0) + ms
+            self.notes.update(timer.notes)
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def mark_first_token(self):
+        if self.ttft_ms is None:
+            self.ttft_ms = self.elapsed_ms()
+            TTFT_SECONDS.observe(self.ttft_ms / 1000)
+
+    def fail(self, component: str, error: BaseException):
+        self.status = "error"
+        self.error = f"{component}: {type(error).__name__}: {error}"
+        ERRORS.inc(component=component)
+
+    def finish(self, status: Optional[str] = None):
+        """
+        请求结束 (正常、出错或被客户端中断) 时调用一次：记录总耗时指标，超过阈值时写慢查询日志。
+        """
+        if self.total_ms is not None:
+            return
+        self.total_ms = self.elapsed_ms()
+        if status is not None and self.status == "running":
+            self.status = status
+        elif self.status == "running":
+            self.status = "ok"
+        REQUEST_SECONDS.observe(self.total_ms / 1000, status=self.status)
+        self.slow_log.record(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "timestamp": self.timestamp,
+            "question": self.question,
+            "status": self.status,
+            "total_ms": self.total_ms,
+            "ttft_ms": self.ttft_ms,
+            "stages": dict(self.stages),
+            "notes": dict(self.notes),
+            "tokens": self.tokens,
+            "error": self.error,
+        }
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    挂在 LCEL 链上的回调：记录检索、格式化、Prompt、LLM 首 Token 和流式输出各阶段耗时，统计 Token 数，
+    并把链上任意步骤的异常计入 rag_errors_total。同步和异步链都在调用线程内直接执行 (run_inline)。
+    """
+
+    run_inline = True
+    raise_error = False
+
+    def __init__(self, trace: RequestTrace):
+        self.trace = trace
+        self._starts: Dict[UUID, tuple] = {}
+        self._llm_first_token: Dict[UUID, float] = {}
+
+    def _start(self, run_id: UUID, stage: str):
+        self._starts[run_id] = (stage, time.perf_counter())
+
+    def _end(self, run_id: UUID) -> Optional[str]:
+        item = self._starts.pop(run_id, None)
+        if item is None:
+            return None
+        stage, started = item
+        self.trace.add_stage(stage, (time.perf_counter() - started) * 1000)
+        return stage
+
+    # --- 检索 ---
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._start(run_id, "retrieve")
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id)
+        self.trace.documents = list(documents)
+        self.trace.notes["documents"] = len(documents)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._starts.pop(run_id, None)
+        self.trace.fail("retrieve", error)
+
+    # --- 链上的其他步骤 ---
+    def on_chain_start(self, serialized, inputs, *, run_id, **kwargs):
+        stage = CHAIN_STAGES.get(kwargs.get("name") or "")
+        if stage:
+            self._start(run_id, stage)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, parent_run_id=None, **kwargs):
+        stage = self._end(run_id)
+        # 只在最外层 (或已知阶段) 记录一次，避免同一个异常沿着嵌套的 Runnable 重复计数
+        if parent_run_id is None and self.trace.status != "error":
+            self.trace.fail(stage or "chain", error)
+
+    # --- LLM ---
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._starts[run_id] = ("llm", time.perf_counter())
+        self.trace.notes["prompt_chars"] = sum(len(str(m.content)) for batch in messages for m in batch)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._starts[run_id] = ("llm", time.perf_counter())
+        self.trace.notes["prompt_chars"] = sum(len(p) for p in prompts)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        now = time.perf_counter()
+        if run_id not in self._llm_first_token:
+            self._llm_first_token[run_id] = now
+            started = self._starts.get(run_id, (None, now))[1]
+            self.trace.add_stage("llm_ttft", (now - started) * 1000)
+            self.trace.mark_first_token()
+        self.trace.tokens += 1
+        TOKENS.inc(kind="completion")
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._starts.pop(run_id, None)
+        first = self._llm_first_token.pop(run_id, None)
+        if first is not None:
+            self.trace.add_stage("llm_stream", (time.perf_counter() - first) * 1000)
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if usage.get("prompt_tokens"):
+            TOKENS.inc(usage["prompt_tokens"], kind="prompt")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._starts.pop(run_id, None)
+        self._llm_first_token.pop(run_id, None)
+        self.trace.fail("llm", error)
+
+
+def find_trace(run_manager) -> Optional[RequestTrace]:
+    """
+    从检索器收到的 run_manager 中找到本次请求的 RequestTrace (没有挂 TracingCallbackHandler 时返回 None)。
+    """
+    if run_manager is None:
+        return None
+    for handler in getattr(run_manager, "handlers", []):
+        if isinstance(handler, TracingCallbackHandler):
+            return handler.trace
+    return None
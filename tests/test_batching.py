@@ -0,0 +1,72 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.utils.batching import MicroBatcher
+
+
+def _slow_echo(items):
+    time.sleep(0.2)
+    return list(items)
+
+
+def test_cancelled_waiter_does_not_block_batch_mates():
+    # 只有一个并发槽：第一个任务在途时，后续任务在队列里合并成同一个批次
+    batcher = MicroBatcher("test", _slow_echo, max_batch_size=8, max_wait_ms=50, max_concurrency=1)
+
+    async def main():
+        busy = batcher.submit("busy")
+        await asyncio.sleep(0.02)
+        abandoned = asyncio.wrap_future(batcher.submit("abandoned"))
+        mate = asyncio.wrap_future(batcher.submit("mate"))
+        try:
+            await asyncio.wait_for(abandoned, 0.05)
+        except asyncio.TimeoutError:
+            pass
+        assert await asyncio.wait_for(mate, 2) == "mate"
+        assert busy.result(timeout=2) == "busy"
+
+    asyncio.run(main())
+
+
+def test_cancelled_before_dispatch_is_dropped():
+    seen = []
+
+    def record(items):
+        seen.append(list(items))
+        time.sleep(0.1)
+        return list(items)
+
+    batcher = MicroBatcher("test", record, max_batch_size=8, max_wait_ms=50, max_concurrency=1)
+    busy = batcher.submit("busy")
+    time.sleep(0.02)
+    queued = [batcher.submit(f"q{i}") for i in range(3)]
+    # q0 已出队等待并发槽 (不能再取消)，q1 仍在队列中
+    time.sleep(0.02)
+    assert queued[1].cancel()
+    assert queued[0].result(timeout=2) == "q0"
+    assert queued[2].result(timeout=2) == "q2"
+    assert busy.result(timeout=2) == "busy"
+    assert ["q0", "q2"] in seen
+
+
+def test_close_stops_background_threads():
+    batcher = MicroBatcher("closing", _slow_echo, max_batch_size=8, max_concurrency=2)
+    pending = batcher.submit("last")
+    batcher.close()
+    # 关闭前提交的任务照常完成
+    assert pending.result(timeout=2) == "last"
+    deadline = time.time() + 2
+    while time.time() < deadline and any("closing" in t.name for t in threading.enumerate()):
+        time.sleep(0.02)
+    assert not any("closing" in t.name for t in threading.enumerate())
+    try:
+        batcher.submit("late")
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("关闭后不应再接收任务")